@@ -1,11 +1,11 @@
 import asyncio
-from datetime import datetime
-from core.wrappers import try_exc_regular, try_exc_async
+from core.wrappers import try_exc_regular, try_exc_async, try_exc_hot, exceptions
 import time
-import json
 import traceback
 from core.ap_class import AP
-import gc
+from core.orderbook import OrderBook, snapshots, get_book
+from core.deals import Deal
+from core.profit_ranges import ProfitRanges
 import uvloop
 
 asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
@@ -21,21 +21,57 @@ class ArbitrageFinder:
         self.markets = markets
         self.coins = [x for x in markets.keys()]
         self.clients_with_names = clients_with_names
+        self.positions_cache = multibot.positions_cache
         self.fees = {x: y.taker_fee for x, y in self.clients_with_names.items()}
+        self.pairs_index = self.get_pairs_index()
         self.write_ranges = False
+        self.depth_sizing = True
         self.last_deal_count = 0
         self.counts = 0
         self.successful_counts = 0
         self.time_start = time.time()
         if self.write_ranges:
-            self.profit_precise = 4
-            self.profit_ranges = self.unpack_ranges()
-            self.last_record = self.profit_ranges.get('timestamp', time.time())
+            self.profit_ranges = ProfitRanges('ranges_taker', precise=4, capacity=len(self.pairs_index))
             self.target_profits = self.get_all_target_profits()
-            print(f"TARGET PROFIT RANGES FOR {(time.time() - self.profit_ranges['timestamp_start']) / 3600} HOURS")
+            print(f"TARGET PROFIT RANGES FOR {self.profit_ranges.hours_collected(time.time())} HOURS")
             print(self.target_profits)
 
     @try_exc_regular
+    def get_pairs_index(self) -> dict:
+        # {(coin, trigger_exchange, trigger_side): ((client_buy, client_sell, ex_buy, ex_sell,
+        #                                            buy_mrkt, sell_mrkt, fees, buy_books, sell_books), ...)}
+        pairs_index = dict()
+        for coin in self.markets.keys():
+            for trigger_exchange, trigger_client in self.clients_with_names.items():
+                if not trigger_client.markets.get(coin):
+                    continue
+                for trigger_side in ['buy', 'sell']:
+                    pairs = []
+                    for exchange, client in self.clients_with_names.items():
+                        if trigger_exchange == exchange:
+                            continue
+                        if trigger_side == 'buy':
+                            client_buy, ex_buy, client_sell, ex_sell = trigger_client, trigger_exchange, client, exchange
+                        else:
+                            client_buy, ex_buy, client_sell, ex_sell = client, exchange, trigger_client, trigger_exchange
+                        if buy_mrkt := client_buy.markets.get(coin):
+                            if sell_mrkt := client_sell.markets.get(coin):
+                                fees = self.fees[ex_buy] + self.fees[ex_sell]
+                                pairs.append((client_buy, client_sell, ex_buy, ex_sell, buy_mrkt, sell_mrkt, fees,
+                                              snapshots.get_exchange_books(ex_buy),
+                                              snapshots.get_exchange_books(ex_sell)))
+                    pairs_index.update({(coin, trigger_exchange, trigger_side): tuple(pairs)})
+        return pairs_index
+
+    @try_exc_regular
+    def update_markets(self, markets: dict) -> None:
+        # Called when ClientsMarketData reloads markets. The only place where pairs index is rebuilt
+        self.markets = markets
+        self.coins = [x for x in markets.keys()]
+        self.fees = {x: y.taker_fee for x, y in self.clients_with_names.items()}
+        self.pairs_index = self.get_pairs_index()
+
+    @try_exc_hot
     def get_target_profit(self, deal_direction):
         if deal_direction == 'open':
             target_profit = self.profit_taker
@@ -45,7 +81,7 @@ class ArbitrageFinder:
             target_profit = (self.profit_taker + self.profit_close) / 2
         return target_profit
 
-    @try_exc_regular
+    @try_exc_hot
     def get_deal_direction(self, positions, exchange_buy, exchange_sell, buy_market, sell_market):
         buy_close = False
         sell_close = False
@@ -62,6 +98,7 @@ class ArbitrageFinder:
 
     def target_profit_exceptions(self, data):
         targets = dict()
+        instrument_table = self.multibot.instrument_table
         for coin in self.coins:
             for ex_buy, client_1 in self.clients_with_names.items():
                 for ex_sell, client_2 in self.clients_with_names.items():
@@ -73,15 +110,15 @@ class ArbitrageFinder:
                                 continue
                             buy_mrkt = self.markets[coin][ex_buy]
                             sell_mrkt = self.markets[coin][ex_sell]
-                            buy_ticksize_rel = client_1.instruments[buy_mrkt]['tick_size'] / ob_1['top_bid']
-                            sell_ticksize_rel = client_2.instruments[sell_mrkt]['tick_size'] / ob_2['top_ask']
+                            buy_ticksize_rel = instrument_table.get(ex_buy, buy_mrkt).tick / ob_1['top_bid']
+                            sell_ticksize_rel = instrument_table.get(ex_sell, sell_mrkt).tick / ob_2['top_ask']
                             if buy_ticksize_rel > self.profit_taker or sell_ticksize_rel > self.profit_taker:
                                 target_profit = 1.5 * max(buy_ticksize_rel, sell_ticksize_rel)
                                 targets.update({sell_mrkt + buy_mrkt: target_profit,
                                                 buy_mrkt + sell_mrkt: target_profit})
         self.excepts = targets
 
-    @try_exc_regular
+    @try_exc_hot
     def check_timestamps(self, client_buy, client_sell, ts_buy, ts_sell):
         # buy_own_ts_ping = now_ts - ob_buy['ts_ms']
         # sell_own_ts_ping = now_ts - ob_sell['ts_ms']
@@ -89,23 +126,14 @@ class ArbitrageFinder:
             return False
         return True
 
-    @try_exc_regular
-    def get_ob_pings(self, ob_buy, ob_sell):
-        if isinstance(ob_buy['timestamp'], float):
-            ts_buy = ob_buy['ts_ms'] - ob_buy['timestamp']
-        else:
-            ts_buy = ob_buy['ts_ms'] - (ob_buy['timestamp'] / 1000)
-
-        if isinstance(ob_sell['timestamp'], float):
-            ts_sell = ob_sell['ts_ms'] - ob_sell['timestamp']
-        else:
-            ts_sell = ob_sell['ts_ms'] - (ob_sell['timestamp'] / 1000)
-        return ts_buy, ts_sell
+    @try_exc_hot
+    def get_ob_pings(self, ob_buy: OrderBook, ob_sell: OrderBook):
+        return ob_buy.ping, ob_sell.ping
 
-    @try_exc_regular
-    def get_ob_ages(self, now_ts: float, ob_buy: dict, ob_sell: dict):
-        age_buy = now_ts - ob_buy['ts_ms']
-        age_sell = now_ts - ob_sell['ts_ms']
+    @try_exc_hot
+    def get_ob_ages(self, now_ts: float, ob_buy: OrderBook, ob_sell: OrderBook):
+        age_buy = now_ts - ob_buy.ts_ms
+        age_sell = now_ts - ob_sell.ts_ms
         return age_buy, age_sell
 
         # is_buy_ping_faster = ts_sell - sell_own_ts_ping > ts_buy - buy_own_ts_ping
@@ -124,16 +152,81 @@ class ArbitrageFinder:
                     return False
         return True
 
-    @try_exc_regular
+    @try_exc_hot
+    def get_depth(self, ob: OrderBook, side: str) -> tuple:
+        # Cumulative size and notional arrays per book side. Counted once per snapshot, i.e. once per book update
+        if depth := ob.ask_depth if side == 'asks' else ob.bid_depth:
+            return depth
+        cum_sz = []
+        cum_notional = []
+        total_sz = 0
+        total_notional = 0
+        for level in ob.asks if side == 'asks' else ob.bids:
+            total_sz += level[1]
+            total_notional += level[0] * level[1]
+            cum_sz.append(total_sz)
+            cum_notional.append(total_notional)
+        if side == 'asks':
+            ob.ask_depth = (cum_sz, cum_notional)
+        else:
+            ob.bid_depth = (cum_sz, cum_notional)
+        return cum_sz, cum_notional
+
+    @try_exc_hot
+    def get_executable_size(self, ex_buy, ex_sell, buy_mrkt, sell_mrkt, ob_buy, ob_sell, fees, target_profit):
+        # Largest size for which (VWAP sell - VWAP buy) / VWAP buy - fees >= target_profit.
+        # Condition is notional_sell(sz) - k * notional_buy(sz) >= 0, k = 1 + fees + target_profit.
+        # The function is concave (each next level is worse on both sides), so we walk merged
+        # level breakpoints while it stays >= 0 and interpolate inside the last segment.
+        asks = ob_buy.asks
+        bids = ob_sell.bids
+        cum_sz_buy, cum_ntl_buy = self.get_depth(ob_buy, 'asks')
+        cum_sz_sell, cum_ntl_sell = self.get_depth(ob_sell, 'bids')
+        k = 1 + fees + target_profit
+        i = j = 0
+        size = 0
+        ntl_buy = ntl_sell = 0
+        limit_buy_px = asks[0][0]
+        limit_sell_px = bids[0][0]
+        while i < len(asks) and j < len(bids):
+            next_sz = min(cum_sz_buy[i], cum_sz_sell[j])
+            slope = bids[j][0] - k * asks[i][0]
+            step = next_sz - size
+            surplus = ntl_sell - k * ntl_buy
+            if surplus + slope * step < 0:
+                if slope < 0 and surplus > 0:
+                    step = surplus / -slope
+                    size += step
+                    ntl_buy += asks[i][0] * step
+                    ntl_sell += bids[j][0] * step
+                    limit_buy_px = asks[i][0]
+                    limit_sell_px = bids[j][0]
+                break
+            size = next_sz
+            ntl_buy = cum_ntl_buy[i] - (cum_sz_buy[i] - size) * asks[i][0]
+            ntl_sell = cum_ntl_sell[j] - (cum_sz_sell[j] - size) * bids[j][0]
+            limit_buy_px = asks[i][0]
+            limit_sell_px = bids[j][0]
+            if cum_sz_buy[i] == size:
+                i += 1
+            if cum_sz_sell[j] == size:
+                j += 1
+        if not size:
+            return 0, asks[0][0], bids[0][0], asks[0][0], bids[0][0]
+        return size, ntl_buy / size, ntl_sell / size, limit_buy_px, limit_sell_px
+
+    @try_exc_hot
     def mm_check(self, coin: str, side: str) -> bool:
+        if self.multibot.maker_ladder:
+            return self.multibot.maker_ladder.has_orders(coin, side)
         if order := self.multibot.open_orders.get(coin + '-' + self.multibot.mm_exchange):
-            if order[1]['side'] == side:
+            if order[1].side == side:
                 return True
         return False
 
     @try_exc_async
     async def count_one_coin(self, coin, trigger_exchange, trigger_side, trigger_type):
-        if self.multibot.arbitrage_processing:
+        if self.multibot.arbitrage_processing or self.multibot.deal_locks.is_busy(coin):
             return
         now_ts = time.time()
         if not round(now_ts - self.time_start) % 120:
@@ -141,227 +234,117 @@ class ArbitrageFinder:
             print(f"{self.counts=} {self.successful_counts=}")
             self.counts = 0
             self.successful_counts = 0
-        for exchange, client in self.clients_with_names.items():
-            if trigger_exchange == exchange:
-                continue
-            if trigger_side == 'buy':
-                client_buy = self.clients_with_names[trigger_exchange]
-                client_sell = client
-                ex_buy = trigger_exchange
-                ex_sell = exchange
-            else:
-                client_buy = client
-                client_sell = self.clients_with_names[trigger_exchange]
-                ex_buy = exchange
-                ex_sell = trigger_exchange
-            if self.multibot.market_maker:
-                if self.mm_check(coin, trigger_side):
-                    continue
-            if buy_mrkt := client_buy.markets.get(coin):
-                if sell_mrkt := client_sell.markets.get(coin):
-                    ob_buy = client_buy.get_orderbook(buy_mrkt)
-                    if ob_buy:
-                        ob_sell = client_sell.get_orderbook(sell_mrkt)
-                        if ob_sell:
-                            if not ob_buy.get('bids') or not ob_buy.get('asks'):
-                                continue
-                            if not ob_sell.get('bids') or not ob_sell.get('asks'):
-                                continue
-                            age_buy, age_sell = self.get_ob_ages(now_ts, ob_buy, ob_sell)
-                            ts_buy, ts_sell = self.get_ob_pings(ob_buy, ob_sell)
-                            # if now_ts - self.last_deal_count > 60:
-                            #     print(f"ALERT! DEALS ARE NOT COUNTED: {age_buy=} {age_sell=} {ts_buy=} {ts_sell=}")
-                            if age_buy < 10:
-                                if age_sell < 10:
-                                    if ts_buy < 1:
-                                        if ts_sell < 1:
-                                            if not self.check_timestamps(client_buy, client_sell, ts_buy, ts_sell):
+        for client_buy, client_sell, ex_buy, ex_sell, buy_mrkt, sell_mrkt, fees, buy_books, sell_books in \
+                self.pairs_index.get((coin, trigger_exchange, trigger_side), ()):
+            try:
+                if self.multibot.market_maker:
+                    if self.mm_check(coin, trigger_side):
+                        continue
+                ob_buy = get_book(client_buy, buy_books, buy_mrkt)
+                if ob_buy:
+                    ob_sell = get_book(client_sell, sell_books, sell_mrkt)
+                    if ob_sell:
+                        if not ob_buy.valid or not ob_sell.valid:
+                            continue
+                        age_buy, age_sell = self.get_ob_ages(now_ts, ob_buy, ob_sell)
+                        ts_buy, ts_sell = self.get_ob_pings(ob_buy, ob_sell)
+                        # if now_ts - self.last_deal_count > 60:
+                        #     print(f"ALERT! DEALS ARE NOT COUNTED: {age_buy=} {age_sell=} {ts_buy=} {ts_sell=}")
+                        if age_buy < 10:
+                            if age_sell < 10:
+                                if ts_buy < 1:
+                                    if ts_sell < 1:
+                                        if not self.check_timestamps(client_buy, client_sell, ts_buy, ts_sell):
+                                            continue
+                        # self.last_deal_count = now_ts
+                                        direction = self.get_deal_direction(self.positions_cache.positions, ex_buy,
+                                                                            ex_sell, buy_mrkt, sell_mrkt)
+                                        buy_px = ob_buy.top_ask
+                                        sell_px = ob_sell.top_bid
+                                        raw_profit = (sell_px - buy_px) / buy_px
+                                        profit = raw_profit - fees
+                                        # if profit > 0:
+                                        #     name = f"T:{trigger_exchange}\nB:{ex_buy}|S:{ex_sell}|C:{coin}"
+                                        #     print(f"{name} | Profit: {profit}|PXB:{buy_px}|PXS:{sell_px}")
+                                        # print(f"ASB:{age_buy}|ASS:{age_sell}\n")
+                                        if self.write_ranges:
+                                            name = f"B:{ex_buy}|S:{ex_sell}|C:{coin}"
+                                            self.append_profit(profit=raw_profit, name=name, now=now_ts)
+                                            target_profit = self.target_profits.get(name)
+                                            if target_profit and target_profit < 0 and direction != 'close':
                                                 continue
-                            # self.last_deal_count = now_ts
-                                            poses = {x: y.get_positions() for x, y in self.clients_with_names.items()}
-                                            direction = self.get_deal_direction(poses, ex_buy, ex_sell,
-                                                                                buy_mrkt, sell_mrkt)
-                                            buy_px = ob_buy['asks'][0][0]
-                                            sell_px = ob_sell['bids'][0][0]
-                                            raw_profit = (sell_px - buy_px) / buy_px
-                                            profit = raw_profit - self.fees[ex_buy] - self.fees[ex_sell]
-                                            # if profit > 0:
-                                            #     name = f"T:{trigger_exchange}\nB:{ex_buy}|S:{ex_sell}|C:{coin}"
-                                            #     print(f"{name} | Profit: {profit}|PXB:{buy_px}|PXS:{sell_px}")
-                                            # print(f"ASB:{age_buy}|ASS:{age_sell}\n")
-                                            if self.write_ranges:
-                                                name = f"B:{ex_buy}|S:{ex_sell}|C:{coin}"
-                                                self.append_profit(profit=raw_profit, name=name)
-                                                target_profit = self.target_profits.get(name)
-                                                if target_profit and target_profit < 0 and direction != 'close':
-                                                    continue
-                                                if not target_profit:
-                                                    target_profit = self.get_target_profit(direction)
-                                            else:
+                                            if not target_profit:
                                                 target_profit = self.get_target_profit(direction)
+                                        else:
+                                            target_profit = self.get_target_profit(direction)
 
-                                                # if buy_trade := client_buy.public_trades.get(buy_mrkt):
-                                                #     if abs(buy_trade['ts'] - ob_buy['timestamp']) < 0.01:
-                                                #         print(f'LAST TRADE AND ORDERBOOK ON THE MOMENT: {buy_trade}')
-                                                #         print(f'ACTUAL OB {ob_buy}')
-                                                #         print()
-                                                # elif sell_trade := client_sell.public_trades.get(sell_mrkt):
-                                                #     if abs(sell_trade['ts'] - ob_sell['timestamp']) < 0.01:
-                                                #         print(f"TRIGGER: {trigger_exchange}\n{name}\nPROFIT {profit}")
-                                                #         print(f'LAST TRADE AND ORDERBOOK ON THE MOMENT: {sell_trade}')
-                                                #         print(f'ACTUAL OB {ob_sell}')
-                                                #         print()
-                                            # profit = raw_profit - fees
-                                            self.counts += 1
-                                            if profit >= target_profit:
-                                                self.successful_counts += 1
-                                                if gc.isenabled():
-                                                    gc.disable()
-                                                # name = f"B:{ex_buy}|S:{ex_sell}|C:{coin}"
-                                                # print(f"TRIGGER: {trigger_exchange} {trigger_type} {name} PROFIT {profit}")
-                                                # print(f"BUY PX: {buy_px} | SELL PX: {sell_px} | DIRECTION: {direction}")
-                                                # print()
+                                            # if buy_trade := client_buy.public_trades.get(buy_mrkt):
+                                            #     if abs(buy_trade['ts'] - ob_buy['timestamp']) < 0.01:
+                                            #         print(f'LAST TRADE AND ORDERBOOK ON THE MOMENT: {buy_trade}')
+                                            #         print(f'ACTUAL OB {ob_buy}')
+                                            #         print()
+                                            # elif sell_trade := client_sell.public_trades.get(sell_mrkt):
+                                            #     if abs(sell_trade['ts'] - ob_sell['timestamp']) < 0.01:
+                                            #         print(f"TRIGGER: {trigger_exchange}\n{name}\nPROFIT {profit}")
+                                            #         print(f'LAST TRADE AND ORDERBOOK ON THE MOMENT: {sell_trade}')
+                                            #         print(f'ACTUAL OB {ob_sell}')
+                                            #         print()
+                                        # profit = raw_profit - fees
+                                        self.counts += 1
+                                        if profit >= target_profit:
+                                            self.successful_counts += 1
+                                            # name = f"B:{ex_buy}|S:{ex_sell}|C:{coin}"
+                                            # print(f"TRIGGER: {trigger_exchange} {trigger_type} {name} PROFIT {profit}")
+                                            # print(f"BUY PX: {buy_px} | SELL PX: {sell_px} | DIRECTION: {direction}")
+                                            # print()
 
-                                                # print(f"OB PING IS HUGE: {ts_sell=} {ts_buy=}")
-                                                # print()
-                                                # if self.check_spread(ob_buy, 'asks', target_profit):
-                                                #     if self.check_spread(ob_sell, 'bids', target_profit):
-                                                deal = {'client_buy': client_buy,
-                                                        'client_sell': client_sell,
-                                                        'buy_px': buy_px,
-                                                        'sell_px': sell_px,
-                                                        'buy_sz': ob_buy['asks'][0][1],
-                                                        'sell_sz': ob_sell['bids'][0][1],
-                                                        'buy_mrkt': buy_mrkt,
-                                                        'sell_mrkt': sell_mrkt,
-                                                        'ts_start_counting': now_ts,
-                                                        'ob_buy_own_ts': ob_buy['ts_ms'],
-                                                        'ob_sell_own_ts': ob_sell['ts_ms'],
-                                                        'ob_buy_api_ts': ts_buy,
-                                                        'ob_sell_api_ts': ts_sell,
-                                                        'ex_buy': ex_buy,
-                                                        'ex_sell': ex_sell,
-                                                        'coin': coin,
-                                                        'target_profit': target_profit,
-                                                        'profit': profit,
-                                                        'direction': direction,
-                                                        'trigger_ex': trigger_exchange,
-                                                        'trigger_type': trigger_type}
-                                                # print(deal)
-                                                await self.multibot.run_arbitrage(deal)
-                            #     else:
-                            #         print(f"{sell_mrkt} {ex_sell=} {age_sell=}")
-                            # else:
-                            #     print(f"{buy_mrkt} {ex_buy=} {age_buy=}")
+                                            # print(f"OB PING IS HUGE: {ts_sell=} {ts_buy=}")
+                                            # print()
+                                            # if self.check_spread(ob_buy, 'asks', target_profit):
+                                            #     if self.check_spread(ob_sell, 'bids', target_profit):
+                                            buy_sz = ob_buy.ask_sz
+                                            sell_sz = ob_sell.bid_sz
+                                            limit_buy_px = buy_px
+                                            limit_sell_px = sell_px
+                                            if self.depth_sizing:
+                                                depth_sz, vwap_buy, vwap_sell, limit_buy_px, limit_sell_px = \
+                                                    self.get_executable_size(ex_buy, ex_sell, buy_mrkt, sell_mrkt,
+                                                                             ob_buy, ob_sell, fees, target_profit)
+                                                if depth_sz > min(buy_sz, sell_sz):
+                                                    buy_sz = sell_sz = depth_sz
+                                                    profit = (vwap_sell - vwap_buy) / vwap_buy - fees
+                                                else:
+                                                    limit_buy_px = buy_px
+                                                    limit_sell_px = sell_px
+                                            deal = Deal(client_buy, client_sell, buy_px, sell_px, buy_sz, sell_sz,
+                                                        buy_mrkt, sell_mrkt, now_ts, ob_buy.ts_ms, ob_sell.ts_ms,
+                                                        ts_buy, ts_sell, ex_buy, ex_sell, coin, target_profit, profit,
+                                                        direction, trigger_exchange, trigger_type, limit_buy_px,
+                                                        limit_sell_px)
+                                            # print(deal)
+                                            await self.multibot.run_arbitrage(deal)
+                        #     else:
+                        #         print(f"{sell_mrkt} {ex_sell=} {age_sell=}")
+                        # else:
+                        #     print(f"{buy_mrkt} {ex_buy=} {age_buy=}")
+            except Exception:
+                # One broken book skips only its pair
+                exceptions.report('ArbitrageFinder.count_one_coin')
 
-    @staticmethod
     @try_exc_regular
-    def unpack_ranges() -> dict:
-        try:
-            try:
-                with open(f'ranges{str(datetime.now()).split(" ")[0]}.json', 'r') as file:
-                    return json.load(file)
-            except:
-                with open('ranges.json', 'r') as file:
-                    return json.load(file)
-        except Exception:
-            with open('ranges.json', 'w') as file:
-                new = {'timestamp': time.time(), 'timestamp_start': time.time()}
-                json.dump(new, file)
-            return new
+    def get_direction_fees(self, exchange_1: str, exchange_2: str) -> float:
+        return self.fees[exchange_1] + self.fees[exchange_2]
 
     @try_exc_regular
     def get_all_target_profits(self):
-        directions = self.get_coins_profit_ranges()
-        if not directions:
-            return dict()
-        target_profits = dict()
-        for direction in directions.keys():
-            exchange_1 = direction.split(':')[1].split('|')[0]
-            exchange_2 = direction.split(':')[2].split('|')[0]
-            coin = direction.split(':')[-1]
-            reversed_direction = f"B:{exchange_2}|S:{exchange_1}|C:{coin}"
-            if not directions.get(reversed_direction):
-                continue
-            direction_one = directions[direction]
-            direction_two = directions[reversed_direction]
-
-            if exchange_1 not in (self.clients_with_names.keys()) or exchange_2 not in (self.clients_with_names.keys()):
-                continue
-            sum_freq_1 = 0
-            sum_freq_2 = 0
-            fees = self.fees[exchange_1] + self.fees[exchange_2]
-            ### Choosing target profit as particular rate of frequency appearing in whole range of profits
-            i = 0
-            profit_1 = None
-            profit_2 = None
-            # sum_profit = direction_one['range'][i][0] + direction_two['range'][i][0]
-            # print(direction_one['direction'], direction_two['direction'])
-            # print(sum_profit - fees)
-            # print(sum_profit - fees_1)
-            while (direction_one['range'][i][0] + direction_two['range'][i][0]) - 2 * fees >= 0:
-                profit_1 = direction_one['range'][i][0]
-                profit_2 = direction_two['range'][i][0]
-                sum_freq_1 += direction_one['range'][i][1]
-                sum_freq_2 += direction_two['range'][i][1]
-                i += 1
-            if profit_2 != None and profit_1 != None:
-                equalizer = 1
-                while sum_freq_1 > 100 and sum_freq_1 > 2 * sum_freq_2:
-                    profit_1 = direction_one['range'][i - equalizer][0]
-                    sum_freq_1 -= direction_one['range'][i - equalizer + 1][1]
-                    equalizer += 1
-                equalizer = 1
-                while sum_freq_2 > 100 and sum_freq_2 > 2 * sum_freq_1:
-                    profit_2 = direction_two['range'][i - equalizer][0]
-                    sum_freq_2 -= direction_two['range'][i - equalizer + 1][1]
-                    equalizer += 1
-                freq_relative_1 = sum_freq_1 / direction_one['range_len'] * 100
-                freq_relative_2 = sum_freq_2 / direction_two['range_len'] * 100
-                print(F"TARGET PROFIT {direction}:", profit_1, sum_freq_1, f"{freq_relative_1} %")
-                print(F"TARGET PROFIT REVERSED {reversed_direction}:", profit_2, sum_freq_2, f"{freq_relative_2} %")
-                print()
-                ### Defining of target profit including exchange fees
-                target_profits.update({direction: profit_1 - fees,
-                                       reversed_direction: profit_2 - fees})
-        return target_profits
+        return self.profit_ranges.get_target_profits(self.clients_with_names.keys(), self.get_direction_fees)
 
     @try_exc_regular
-    def append_profit(self, profit: float, name: str):
-        profit = round(profit, self.profit_precise)
-        if self.profit_ranges.get(name):
-            if self.profit_ranges[name].get(profit):
-                self.profit_ranges[name][profit] += 1
-            else:
-                self.profit_ranges[name].update({profit: 1})
-        else:
-            self.profit_ranges.update({name: {profit: 1}})
-        now = time.time()
-        self.profit_ranges.update({'timestamp': now})
-        if now - self.last_record > 3600:
-            with open('ranges.json', 'w') as file:
-                json.dump(self.profit_ranges, file)
-            self.last_record = now
-        if now - self.profit_ranges['timestamp_start'] > 3600 * 24:
-            with open(f'ranges{str(datetime.now()).split(" ")[0]}.json', 'w') as file:
-                json.dump(self.profit_ranges, file)
+    def append_profit(self, profit: float, name: str, now: float):
+        self.profit_ranges.append_profit(profit, name)
+        if now - self.profit_ranges.index['timestamp_start'] > 3600 * 24:
             self.target_profits = self.get_all_target_profits()
-            self.profit_ranges = {'timestamp': now, 'timestamp_start': now}
-
-    @try_exc_regular
-    def get_coins_profit_ranges(self):
-        directions = dict()
-        for direction in self.profit_ranges.keys():
-            if 'timestamp' in direction:
-                # Passing the timestamp key in profit_ranges dict
-                continue
-            range = sorted([[float(x), y] for x, y in self.profit_ranges[direction].items()], reverse=True)
-            range_len = sum([x[1] for x in range])
-            upd_data = {direction: {'range': range,  # profits dictionary in format key = profit, value = frequency
-                                    'range_len': range_len}}
-                                # direction in format B:{exch_buy}|S:{exch_sell}|C:{coin} (str)
-            directions.update(upd_data)
-        return directions
+            self.profit_ranges.rollover(now)
 
 
 if __name__ == '__main__':
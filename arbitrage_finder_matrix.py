@@ -0,0 +1,187 @@
+import asyncio
+import time
+import numpy as np
+import uvloop
+from core.wrappers import try_exc_regular, try_exc_async, try_exc_hot, exceptions
+from core.orderbook import OrderBook, snapshots, get_book
+from core.deals import Deal
+
+asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+
+
+class ArbitrageFinderMatrix:
+    # Top-of-book матрица coins x exchanges. Клиенты обновляют строку своей биржи на каждом апдейте стакана
+    # (update_orderbook), а sweep() одним векторным проходом считает профит для всех (coin, buy ex, sell ex).
+    # count_one_coin имеет ту же сигнатуру, что и у ArbitrageFinder, поэтому может стоять в client.finder.
+    # sweep() смотрит только строки (монеты), обновленные с прошлого прохода: иначе профит тихой монеты
+    # срабатывал бы заново на каждом апдейте других монет, пока стакан не старше max_ob_age.
+    # Сделки одного прохода уходят каждая своим таском: run_arbitrage ждет deal_pause, и следующие сделки
+    # отправлялись бы по ценам, посчитанным до паузы. Конфликты по монете и балансу разруливают deal_locks.
+
+    def __init__(self, multibot, markets, clients_with_names, profit_taker, profit_close):
+        self.multibot = multibot
+        self.profit_taker = profit_taker
+        self.profit_close = profit_close
+        self.markets = markets
+        self.clients_with_names = clients_with_names
+        self.positions_cache = multibot.positions_cache
+        self.counts = 0
+        self.successful_counts = 0
+        self.max_ob_age = 10
+        self.max_ob_ping = 1
+        self.books = {x: snapshots.get_exchange_books(x) for x in clients_with_names.keys()}
+        self.update_markets(markets)
+
+    @try_exc_regular
+    def update_markets(self, markets: dict) -> None:
+        self.markets = markets
+        self.coins = [x for x in markets.keys()]
+        self.exchanges = [x for x in self.clients_with_names.keys()]
+        self.clients = [self.clients_with_names[x] for x in self.exchanges]
+        self.coin_idx = {coin: i for i, coin in enumerate(self.coins)}
+        self.exchange_idx = {exchange: i for i, exchange in enumerate(self.exchanges)}
+        shape = (len(self.coins), len(self.exchanges))
+        self.bids = np.full(shape, np.nan)
+        self.asks = np.full(shape, np.nan)
+        self.bid_szs = np.zeros(shape)
+        self.ask_szs = np.zeros(shape)
+        self.ts_exchange = np.zeros(shape)  # seconds, exchange timestamp of the book
+        self.ts_own = np.zeros(shape)  # seconds, local receive time of the book ('ts_ms')
+        self.changed = np.zeros(len(self.coins), dtype=bool)  # rows updated since the last sweep
+        self.fees = np.array([x.taker_fee for x in self.clients])
+        # [buy exchange, sell exchange]
+        self.fees_matrix = self.fees[:, None] + self.fees[None, :]
+        self.top_ws_pings = np.array([x.top_ws_ping for x in self.clients])
+        self.tradable = np.zeros(shape, dtype=bool)
+        self.market_names = [[None] * shape[1] for _ in range(shape[0])]
+        for coin, i in self.coin_idx.items():
+            for exchange, j in self.exchange_idx.items():
+                if market := self.clients_with_names[exchange].markets.get(coin):
+                    self.tradable[i, j] = True
+                    self.market_names[i][j] = market
+        self.pair_mask = ~np.eye(len(self.exchanges), dtype=bool)[None, :, :]
+
+    @try_exc_hot
+    def update_orderbook(self, exchange: str, coin: str, ob: OrderBook) -> None:
+        i = self.coin_idx.get(coin)
+        if i is None:
+            return
+        j = self.exchange_idx[exchange]
+        self.changed[i] = True
+        if not ob or not ob.valid:
+            self.bids[i, j] = np.nan
+            self.asks[i, j] = np.nan
+            return
+        self.bids[i, j] = ob.top_bid
+        self.asks[i, j] = ob.top_ask
+        self.bid_szs[i, j] = ob.bid_sz
+        self.ask_szs[i, j] = ob.ask_sz
+        self.ts_exchange[i, j] = ob.timestamp
+        self.ts_own[i, j] = ob.ts_ms
+
+    @try_exc_hot
+    def sweep(self, now_ts: float):
+        # profits[coin, buy exchange, sell exchange]
+        asks = self.asks[:, :, None]
+        bids = self.bids[:, None, :]
+        profits = (bids - asks) / asks - self.fees_matrix[None, :, :]
+        pings = self.ts_own - self.ts_exchange
+        fresh = self.tradable & (now_ts - self.ts_own < self.max_ob_age)
+        fresh &= (pings < self.max_ob_ping) & (pings <= self.top_ws_pings[None, :])
+        valid = fresh[:, :, None] & fresh[:, None, :] & self.pair_mask & self.changed[:, None, None]
+        self.changed[:] = False
+        threshold = min(self.profit_taker, self.profit_close)
+        coins, buys, sells = np.nonzero(valid & (profits >= threshold))
+        hits_profits = profits[coins, buys, sells]
+        order = np.argsort(-hits_profits)
+        return [(coins[x], buys[x], sells[x], hits_profits[x]) for x in order], pings
+
+    @try_exc_hot
+    def get_target_profit(self, deal_direction):
+        if deal_direction == 'open':
+            target_profit = self.profit_taker
+        elif deal_direction == 'close':
+            target_profit = self.profit_close
+        else:
+            target_profit = (self.profit_taker + self.profit_close) / 2
+        return target_profit
+
+    @try_exc_hot
+    def get_deal_direction(self, exchange_buy, exchange_sell, buy_market, sell_market):
+        positions = self.positions_cache.positions
+        buy_close = False
+        sell_close = False
+        if pos_buy := positions[exchange_buy].get(buy_market):
+            buy_close = True if pos_buy['amount_usd'] < 0 else False
+        if pos_sell := positions[exchange_sell].get(sell_market):
+            sell_close = True if pos_sell['amount_usd'] > 0 else False
+        if buy_close and sell_close:
+            return 'close'
+        elif not buy_close and not sell_close:
+            return 'open'
+        else:
+            return 'half_close'
+
+    @try_exc_hot
+    def mm_check(self, coin: str, ex_buy: str, ex_sell: str) -> bool:
+        if ladder := self.multibot.maker_ladder:
+            if ex_buy == self.multibot.mm_exchange and ladder.has_orders(coin, 'buy'):
+                return True
+            return ex_sell == self.multibot.mm_exchange and ladder.has_orders(coin, 'sell')
+        if order := self.multibot.open_orders.get(coin + '-' + self.multibot.mm_exchange):
+            if ex_buy == self.multibot.mm_exchange and order[1].side == 'buy':
+                return True
+            if ex_sell == self.multibot.mm_exchange and order[1].side == 'sell':
+                return True
+        return False
+
+    @try_exc_regular
+    def get_deals(self, now_ts: float, trigger_coin: str, trigger_exchange: str, trigger_type: str) -> list:
+        deals = []
+        hits, pings = self.sweep(now_ts)
+        for i, b, s, profit in hits:
+            try:
+                coin = self.coins[i]
+                ex_buy = self.exchanges[b]
+                ex_sell = self.exchanges[s]
+                if self.multibot.market_maker:
+                    if self.mm_check(coin, ex_buy, ex_sell):
+                        continue
+                buy_mrkt = self.market_names[i][b]
+                sell_mrkt = self.market_names[i][s]
+                direction = self.get_deal_direction(ex_buy, ex_sell, buy_mrkt, sell_mrkt)
+                target_profit = self.get_target_profit(direction)
+                self.counts += 1
+                if profit < target_profit:
+                    continue
+                self.successful_counts += 1
+                if coin == trigger_coin and trigger_exchange in (ex_buy, ex_sell):
+                    trigger_ex = trigger_exchange
+                else:
+                    # Hit of an earlier update: the leg with the freshest book triggered it
+                    trigger_ex = ex_buy if self.ts_own[i, b] >= self.ts_own[i, s] else ex_sell
+                deals.append(Deal(self.clients[b], self.clients[s], float(self.asks[i, b]), float(self.bids[i, s]),
+                                  float(self.ask_szs[i, b]), float(self.bid_szs[i, s]), buy_mrkt, sell_mrkt, now_ts,
+                                  float(self.ts_own[i, b]), float(self.ts_own[i, s]), float(pings[i, b]),
+                                  float(pings[i, s]), ex_buy, ex_sell, coin, target_profit, float(profit), direction,
+                                  trigger_ex, trigger_type))
+            except Exception:
+                exceptions.report('ArbitrageFinderMatrix.get_deals')
+        return deals
+
+    @try_exc_async
+    async def count_one_coin(self, coin, trigger_exchange, trigger_side, trigger_type):
+        client = self.clients_with_names[trigger_exchange]
+        if market := client.markets.get(coin):
+            self.update_orderbook(trigger_exchange, coin, get_book(client, self.books[trigger_exchange], market))
+        if self.multibot.arbitrage_processing:
+            return
+        now_ts = time.time()
+        for deal in self.get_deals(now_ts, coin, trigger_exchange, trigger_type):
+            if self.multibot.deal_locks.is_busy(deal.coin):
+                continue
+            asyncio.get_event_loop().create_task(self.multibot.run_arbitrage(deal))
+
+
+if __name__ == '__main__':
+    pass
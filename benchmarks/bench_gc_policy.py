@@ -0,0 +1,99 @@
+# Latency of trigger handling (ws message parsing + ArbitrageFinder.count_one_coin) with default automatic GC
+# (before) and with GCPolicy: gc.freeze() after warm-up, high thresholds and collections at safe points (after).
+# A long-lived heap stands for markets, instruments, caches and history of a running bot.
+# Run from repo root: python benchmarks/bench_gc_policy.py config.ini
+import asyncio
+import gc
+import json
+import os
+import sys
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import core.wrappers as wrappers
+from core.gc_policy import GCPolicy
+from arbitrage_finder import ArbitrageFinder
+from bench_wrappers import get_finder
+
+TRIGGERS = 50000
+HEAP_OBJECTS = 100000
+MESSAGE = json.dumps({'type': 'orderbook', 'market': 'BTC-USDT', 'ts': 1700000000000,
+                      'asks': [[str(100 + x * 0.01), str(1 + x)] for x in range(20)],
+                      'bids': [[str(100 - x * 0.01), str(1 + x)] for x in range(20)]})
+
+
+class Cycle:
+    def __init__(self):
+        self.me = self
+
+
+async def handle_triggers(finder, latencies: list, state: dict):
+    # Responses and orders of clients are kept for the whole run, so containers grow and GC runs
+    orders = dict()
+    for idx in range(TRIGGERS):
+        state['in_trigger'] = True
+        ts_start = time.perf_counter()
+        message = json.loads(MESSAGE)
+        ob = {'asks': [[float(x[0]), float(x[1])] for x in message['asks']],
+              'bids': [[float(x[0]), float(x[1])] for x in message['bids']]}
+        await finder.count_one_coin('BTC', 'EX0', 'buy', 'ob')
+        orders[idx] = {'market': message['market'], 'price': ob['asks'][0][0], 'size': ob['asks'][0][1],
+                       'levels': ob['asks'][:2]}
+        latencies.append(time.perf_counter() - ts_start)
+        state['in_trigger'] = False
+        if not idx % 20:
+            # Cyclic garbage: futures, tracebacks, self-referencing deals
+            Cycle()
+        del ob
+        await asyncio.sleep(0)
+
+
+def run(policy: GCPolicy = None) -> dict:
+    finder = get_finder(ArbitrageFinder)
+    loop = asyncio.new_event_loop()
+    latencies = []
+    pauses = []  # [(generation, pause sec, inside trigger handling)]
+    state = {'in_trigger': False, 'gc_start': 0}
+
+    def gc_callback(phase, info):
+        if phase == 'start':
+            state['gc_start'] = time.perf_counter()
+        else:
+            pauses.append((info['generation'], time.perf_counter() - state['gc_start'], state['in_trigger']))
+    safe_points = None
+    if policy:
+        # The full collection of the warm-up is not a part of trigger handling
+        policy.start()
+        safe_points = loop.create_task(policy.run_safe_points())
+    gc.callbacks.append(gc_callback)
+    try:
+        ts_start = time.perf_counter()
+        loop.run_until_complete(handle_triggers(finder, latencies, state))
+        wall_time = time.perf_counter() - ts_start
+    finally:
+        gc.callbacks.remove(gc_callback)
+        if safe_points:
+            safe_points.cancel()
+            loop.run_until_complete(asyncio.sleep(0))
+        loop.close()
+    latencies.sort()
+
+    def percentile(part):
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * part))] * 10 ** 6, 1)
+    return {'p50_us': percentile(0.5), 'p99_us': percentile(0.99), 'p999_us': percentile(0.999),
+            'max_us': round(latencies[-1] * 10 ** 6, 1), 'wall_time_sec': round(wall_time, 3),
+            'collections': len(pauses), 'gen2_collections': len([x for x in pauses if x[0] == 2]),
+            'gc_total_ms': round(sum([x[1] for x in pauses]) * 1000, 2),
+            'gc_in_triggers': len([x for x in pauses if x[2]]),
+            'gc_in_triggers_ms': round(sum([x[1] for x in pauses if x[2]]) * 1000, 2),
+            'gc_max_ms': round(max([x[1] for x in pauses]) * 1000, 2) if pauses else 0}
+
+
+if __name__ == '__main__':
+    wrappers.telegram.send_message = lambda *args, **kwargs: None
+    heap = [{'id': x, 'data': [x]} for x in range(HEAP_OBJECTS)]
+    gc.collect()
+    before = run()
+    print(f"BEFORE (automatic GC, thresholds {gc.get_threshold()}): {before}")
+    after = run(GCPolicy(lambda: False, interval=0.01))
+    print(f"AFTER (GCPolicy, frozen {gc.get_freeze_count()}, thresholds {gc.get_threshold()}): {after}")
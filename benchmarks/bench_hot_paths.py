@@ -0,0 +1,300 @@
+# Microbenchmarks of finder and bot hot paths on synthetic books, N coins x M exchanges:
+# ArbitrageFinder.count_one_coin, MarketFinder.count_one_coin / get_top_deal / process_parse_results,
+# MultiBot.if_tradable / precise_size / ap_deal_report.
+# Per case: ns/call, calls/sec, peak bytes allocated during one call and blocks left alive after a call.
+# Run from repo root: python benchmarks/bench_hot_paths.py config.ini [previous_results.json]
+# Results are saved to benchmarks/results/<date>_<commit>.json, with a previous file deltas are printed too.
+import asyncio
+import contextlib
+import copy
+import gc
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import timeit
+import tracemalloc
+from datetime import datetime
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import core.wrappers as wrappers
+from core.balance_ledger import BalanceLedger
+from core.database import DB
+from core.deal_locks import DealLocks
+from core.instruments import InstrumentTable
+from core.deals import Deal, MakerCandidate
+from core.positions_cache import PositionsCache
+from core.quote_engine import QuoteEngine
+from core.rabbit import Rabbit
+from core.telegram import Telegram, sender
+from arbitrage_finder import ArbitrageFinder
+from market_maker_counter import MarketFinder
+from multi_bot import MultiBot
+
+COINS = [10, 100, 1000]
+EXCHANGES = [2, 4, 8]
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+MM_EXCHANGE = 'EX0'
+DEVNULL = open(os.devnull, 'w')
+
+
+class BenchClient:
+    def __init__(self, name, coins, rnd):
+        self.EXCHANGE_NAME = name
+        self.markets = {coin: coin + '-USDT' for coin in coins}
+        self.instruments = {x: {'tick_size': 0.0001, 'step_size': 0.001, 'min_size': 0.001}
+                            for x in self.markets.values()}
+        self.taker_fee = 0.0005
+        self.maker_fee = 0.0001
+        self.top_ws_ping = 0.5
+        self.responses = dict()
+        self.positions = dict()
+        self.orderbook = dict()
+        for idx, coin in enumerate(coins):
+            # Mids of the same coin differ between exchanges, some pairs are crossed above fees
+            mid = (10 + idx) * (1 + rnd.gauss(0, 0.0008))
+            self.orderbook[self.markets[coin]] = {
+                'asks': [[round(mid * (1 + 0.0001 * (x + 1)), 4), 10 + x] for x in range(5)],
+                'bids': [[round(mid * (1 - 0.0001 * (x + 1)), 4), 10 + x] for x in range(5)],
+                'timestamp': 0.0, 'ts_ms': 0.0}
+
+    def get_orderbook(self, market):
+        return self.orderbook.get(market)
+
+    def get_positions(self):
+        return self.positions
+
+    def refresh(self):
+        now = time.time()
+        for ob in self.orderbook.values():
+            ob['timestamp'] = now - 0.01
+            ob['ts_ms'] = now
+
+
+class BenchBot(MultiBot):
+    # MultiBot без __init__: только то, что читают хот пасы, ордера никуда не уходят
+
+    async def run_arbitrage(self, deal):
+        pass
+
+    async def new_maker_order(self, deal, coin):
+        pass
+
+    async def amend_maker_order(self, deal, coin, order_id):
+        pass
+
+    async def delete_maker_order(self, coin, order_id):
+        pass
+
+
+def get_bot(coins_amount: int, exchanges_amount: int) -> BenchBot:
+    rnd = random.Random(coins_amount * 100 + exchanges_amount)
+    coins = [f'C{x}' for x in range(coins_amount)]
+    bot = BenchBot.__new__(BenchBot)
+    bot.clients = [BenchClient(f'EX{x}', coins, rnd) for x in range(exchanges_amount)]
+    bot.clients_with_names = {x.EXCHANGE_NAME: x for x in bot.clients}
+    for client in bot.clients:
+        # Половина монет закрывает позицию через мейкер биржу в одну сторону, половина - в другую
+        for idx, coin in enumerate(coins):
+            sign = 1 if (idx % 2) == (client.EXCHANGE_NAME == MM_EXCHANGE) else -1
+            client.positions[client.markets[coin]] = {'amount': sign * 100, 'amount_usd': sign * 1000}
+    bot.markets = {coin: {x.EXCHANGE_NAME: x.markets[coin] for x in bot.clients} for coin in coins}
+    bot.instrument_table = InstrumentTable(bot.clients_with_names)
+    bot.positions_cache = PositionsCache(bot.clients_with_names)
+    bot.positions_cache.update_all()
+    bot.deal_locks = DealLocks()
+    bot.balance_ledger = BalanceLedger(bot.clients_with_names, bot.deal_locks, bot.positions_cache)
+    bot.balance_ledger.balances.update({x: {'buy': 10 ** 6, 'sell': 10 ** 6} for x in bot.clients_with_names})
+    bot.available_balances = bot.balance_ledger.balances
+    bot.arbitrage_processing = False
+    bot.market_maker = False
+    bot.mm_exchange = MM_EXCHANGE
+    bot.count_ob_level = 0
+    bot.profit_open = 0.0005
+    bot.profit_close = -0.001
+    bot.min_size = 10
+    bot.max_order_size_usd = 100
+    bot.open_orders = dict()
+    bot.quote_engine = QuoteEngine(bot)
+    bot.requests_in_progress = bot.quote_engine.in_progress
+    bot.maker_ladder = None
+    bot.env = 'BENCH'
+    bot.telegram = Telegram()
+    rabbit = Rabbit(asyncio.new_event_loop())
+    rabbit.enabled = False
+    bot.db = DB(rabbit)
+    return bot
+
+
+def get_cases(bot: BenchBot) -> dict:
+    # {name: (call, is_async)}, call() runs one call of the hot path
+    coins = list(bot.markets.keys())
+    exchanges = list(bot.clients_with_names.keys())
+    ap_finder = ArbitrageFinder(bot, bot.markets, bot.clients_with_names, bot.profit_open, bot.profit_close)
+    mm_finder = MarketFinder(bot.markets, bot.clients_with_names, bot)
+    mm_finder.orders_prints = False
+    state = {'idx': 0}
+
+    def next_args():
+        idx = state['idx'] = state['idx'] + 1
+        return coins[idx % len(coins)], exchanges[idx % len(exchanges)], 'buy' if idx % 2 else 'sell'
+
+    async def ap_count_one_coin():
+        coin, exchange, side = next_args()
+        await ap_finder.count_one_coin(coin, exchange, side, 'ob')
+
+    async def mm_count_one_coin():
+        coin, exchange, _ = next_args()
+        await mm_finder.count_one_coin(coin, exchange)
+
+    tick = 0.0001
+    buy_deals = [MakerCandidate(0.0006, 10, 'close', tick, 10 + x * tick, 10.01 + x * tick, [10.02, 10])
+                 for x in range(len(exchanges) - 1)]
+    sell_deals = [MakerCandidate(0.0006, 10, 'close', tick, 10.03 - x * tick, 10.04 - x * tick, [10.0, 10])
+                  for x in range(len(exchanges) - 1)]
+    now_ts = time.time()
+
+    def get_top_deal():
+        mm_finder.get_top_deal(sell_deals, buy_deals, coins[0], [], now_ts)
+
+    # Активный ордер совпадает с лучшей сделкой - путь "ORDER STILL GOOD", без создания ордеров
+    top_deal = mm_finder.get_top_deal(sell_deals, buy_deals, coins[0], [], now_ts)[0]
+    active_deal = ['bench_order', copy.copy(top_deal)]
+    bot.open_orders[coins[0] + '-' + MM_EXCHANGE] = active_deal
+
+    def process_parse_results():
+        mm_finder.process_parse_results(sell_deals, buy_deals, coins[0], active_deal, now_ts)
+
+    def if_tradable():
+        coin, exchange, _ = next_args()
+        bot.if_tradable(exchange, MM_EXCHANGE, bot.markets[coin][exchange], bot.markets[coin][MM_EXCHANGE], 10)
+
+    def precise_size():
+        coin, _, _ = next_args()
+        bot.precise_size(coin, 1.23456)
+
+    client_buy = bot.clients[0]
+    client_sell = bot.clients[1]
+    deal = Deal(client_buy=client_buy, client_sell=client_sell, buy_px=10.0, sell_px=10.02, buy_sz=10, sell_sz=10,
+                limit_buy_px=10.0, limit_sell_px=10.02, buy_mrkt=coins[0] + '-USDT', sell_mrkt=coins[0] + '-USDT',
+                ts_start_counting=now_ts, ob_buy_own_ts=now_ts - 0.001, ob_sell_own_ts=now_ts - 0.002,
+                ob_buy_api_ts=0.01, ob_sell_api_ts=0.012, ex_buy=client_buy.EXCHANGE_NAME,
+                ex_sell=client_sell.EXCHANGE_NAME, coin=coins[0], target_profit=0.0005, profit=0.001,
+                direction='open', trigger_ex=client_buy.EXCHANGE_NAME, trigger_type='ob')
+    resp = {'exchange_name': 'EX', 'exchange_order_id': 'bench', 'timestamp': now_ts + 0.02, 'status': 'Fully Executed',
+            'size': 1.0, 'price': 10.01, 'time_order_sent': now_ts + 0.001, 'create_order_time': 0.01}
+
+    def ap_deal_report():
+        client_buy.responses['bench'] = resp
+        client_sell.responses['bench'] = resp
+        bot.ap_deal_report(deal, 'bench', 1.0, now_ts + 0.0005)
+
+    return {'ArbitrageFinder.count_one_coin': (ap_count_one_coin, True),
+            'MarketFinder.count_one_coin': (mm_count_one_coin, True),
+            'MarketFinder.get_top_deal': (get_top_deal, False),
+            'MarketFinder.process_parse_results': (process_parse_results, False),
+            'MultiBot.if_tradable': (if_tradable, False),
+            'MultiBot.precise_size': (precise_size, False),
+            'MultiBot.ap_deal_report': (ap_deal_report, False)}
+
+
+def measure(loop, bot: BenchBot, call, is_async: bool) -> dict:
+    async def run_async(number):
+        for _ in range(number):
+            await call()
+
+    def run_sync(number):
+        for _ in range(number):
+            call()
+
+    def run(number):
+        for client in bot.clients:
+            client.refresh()
+        if is_async:
+            loop.run_until_complete(run_async(number))
+        else:
+            run_sync(number)
+
+    # Calls per repeat so that one repeat takes at least 50 ms
+    number = 1
+    while True:
+        ts_start = time.perf_counter()
+        run(number)
+        if time.perf_counter() - ts_start > 0.05:
+            break
+        number *= 2
+    best = min(timeit.repeat(lambda: run(number), repeat=5, number=1))
+    ns_per_call = best / number * 10 ** 9
+
+    # Allocations: peak of traced memory during one call and blocks which stay alive after it
+    tracemalloc.start()
+    peaks = []
+    for _ in range(50):
+        tracemalloc.reset_peak()
+        current = tracemalloc.get_traced_memory()[0]
+        run(1)
+        peaks.append(tracemalloc.get_traced_memory()[1] - current)
+    tracemalloc.stop()
+    gc.collect()
+    blocks = sys.getallocatedblocks()
+    run(1000)
+    gc.collect()
+    retained = (sys.getallocatedblocks() - blocks) / 1000
+    return {'ns_per_call': round(ns_per_call, 1),
+            'calls_per_sec': round(10 ** 9 / ns_per_call) if ns_per_call else 0,
+            'alloc_peak_bytes': sorted(peaks)[len(peaks) // 2],
+            'retained_blocks': round(retained, 3)}
+
+
+def get_commit() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True,
+                                       cwd=os.path.dirname(RESULTS_DIR)).strip()
+    except Exception:
+        return 'unknown'
+
+
+def compare(results: list, previous_file: str) -> None:
+    with open(previous_file, 'r') as file:
+        previous = {(x['bench'], x['coins'], x['exchanges']): x for x in json.load(file)['results']}
+    print(f"\nCOMPARED WITH {previous_file}")
+    for result in results:
+        if old := previous.get((result['bench'], result['coins'], result['exchanges'])):
+            change = (result['ns_per_call'] / old['ns_per_call'] - 1) * 100 if old['ns_per_call'] else 0
+            print(f"{result['bench']:<38} {result['coins']:>5}x{result['exchanges']:<2} "
+                  f"{old['ns_per_call']:>12} -> {result['ns_per_call']:>12} ns/call ({round(change, 1):+}%) | "
+                  f"alloc {old['alloc_peak_bytes']} -> {result['alloc_peak_bytes']} B")
+
+
+if __name__ == '__main__':
+    # Nothing leaves the process
+    wrappers.telegram.send_message = lambda *args, **kwargs: None
+    sender.enabled = False
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    results = []
+    for coins_amount in COINS:
+        for exchanges_amount in EXCHANGES:
+            bot = get_bot(coins_amount, exchanges_amount)
+            for bench, (call, is_async) in get_cases(bot).items():
+                # Prints of the hot paths (DB messages, counters) cost the same, but don't mix with the report
+                with contextlib.redirect_stdout(DEVNULL):
+                    stats = measure(loop, bot, call, is_async)
+                result = {'bench': bench, 'coins': coins_amount, 'exchanges': exchanges_amount, **stats}
+                results.append(result)
+                print(f"{bench:<38} {coins_amount:>5}x{exchanges_amount:<2} {result['ns_per_call']:>12} ns/call | "
+                      f"{result['calls_per_sec']:>10} calls/sec | alloc {result['alloc_peak_bytes']:>7} B | "
+                      f"retained {result['retained_blocks']} blocks")
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    commit = get_commit()
+    file_name = os.path.join(RESULTS_DIR, f"{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}_{commit}.json")
+    with open(file_name, 'w') as file:
+        json.dump({'meta': {'date': str(datetime.utcnow()), 'commit': commit, 'python': sys.version.split()[0],
+                            'platform': platform.platform()},
+                   'results': results}, file, indent=2)
+    print(f"RESULTS SAVED: {file_name}")
+    if len(sys.argv) > 2:
+        compare(results, sys.argv[2])
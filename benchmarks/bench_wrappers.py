@@ -0,0 +1,98 @@
+# Per-call cost of count_one_coin with finder helpers wrapped by try_exc_regular (before)
+# and with try_exc_hot helpers (after), plus cost of an exceptions storm.
+# Run from repo root: python benchmarks/bench_wrappers.py config.ini
+import asyncio
+import os
+import sys
+import time
+import timeit
+import traceback
+from types import SimpleNamespace
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import core.wrappers as wrappers
+from core.wrappers import try_exc_regular
+from core.deal_locks import DealLocks
+from arbitrage_finder import ArbitrageFinder
+
+HOT_HELPERS = ['get_target_profit', 'get_deal_direction', 'check_timestamps', 'get_ob_pings', 'get_ob_ages',
+               'get_depth', 'get_executable_size', 'mm_check']
+
+
+class WrappedFinder(ArbitrageFinder):
+    pass
+
+
+for helper in HOT_HELPERS:
+    setattr(WrappedFinder, helper, try_exc_regular(getattr(ArbitrageFinder, helper)))
+
+
+class BenchClient:
+    def __init__(self, name, coins, bid, ask):
+        self.EXCHANGE_NAME = name
+        self.markets = {coin: coin + '-USDT' for coin in coins}
+        self.taker_fee = 0.0005
+        self.top_ws_ping = 0.5
+        self.bid = bid
+        self.ask = ask
+
+    def get_orderbook(self, market):
+        now = time.time()
+        return {'asks': [[self.ask, 1], [self.ask + 1, 2]], 'bids': [[self.bid, 1], [self.bid - 1, 2]],
+                'timestamp': now - 0.01, 'ts_ms': now}
+
+
+DEVNULL = open(os.devnull, 'w')
+
+
+def legacy_try_exc_regular(func):
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            formatted_traceback = str(traceback.format_exc())
+            print(formatted_traceback, file=DEVNULL)
+    return wrapper
+
+
+def get_finder(finder_class, exchanges_amount=5):
+    coins = ['BTC', 'ETH', 'SOL']
+    clients = {f'EX{i}': BenchClient(f'EX{i}', coins, 100 - i * 0.001, 100.01 + i * 0.001)
+               for i in range(exchanges_amount)}
+    multibot = SimpleNamespace(positions_cache=SimpleNamespace(positions={x: {} for x in clients}),
+                               arbitrage_processing=False, deal_locks=DealLocks(), market_maker=False,
+                               open_orders={})
+    markets = {coin: {x: coin + '-USDT' for x in clients} for coin in coins}
+    return finder_class(multibot, markets, clients, 0.001, 0.001)
+
+
+def bench_count_one_coin(finder_class, number=20000):
+    finder = get_finder(finder_class)
+    loop = asyncio.new_event_loop()
+
+    async def calls():
+        for _ in range(number):
+            await finder.count_one_coin('BTC', 'EX0', 'buy', 'ob')
+
+    def run():
+        loop.run_until_complete(calls())
+    return min(timeit.repeat(run, number=1, repeat=5)) / number * 10 ** 6
+
+
+def bench_storm(wrapper, number=20000):
+    func = wrapper(lambda: 1 / 0)
+    return min(timeit.repeat(func, number=number, repeat=3)) / number * 10 ** 6
+
+
+if __name__ == '__main__':
+    # Nothing leaves the process
+    wrappers.telegram.send_message = lambda *args, **kwargs: None
+    wrappers.print = lambda *args, **kwargs: None
+    before = bench_count_one_coin(WrappedFinder)
+    after = bench_count_one_coin(ArbitrageFinder)
+    print(f"count_one_coin, 4 pairs: before {round(before, 2)} us/call | after {round(after, 2)} us/call | "
+          f"{round((1 - after / before) * 100, 1)}% less")
+    storm_before = bench_storm(legacy_try_exc_regular)
+    storm_after = bench_storm(try_exc_regular)
+    print(f"exceptions storm: before {round(storm_before, 2)} us/exception | "
+          f"after {round(storm_after, 2)} us/exception")
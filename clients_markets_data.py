@@ -58,6 +58,14 @@ class ClientsMarketData:
                 del coins_exchanges_symbol[coin]
         return coins_exchanges_symbol
 
+    @try_exc_regular
+    def reload_markets(self) -> dict:
+        # Перечитываем рынки с бирж. Финдеры пересобирают свои индексы только после этого вызова
+        self.all_markets = self.get_all_markets()
+        self.instance_markets = self.get_instance_markets()
+        self.clients_data = self.get_clients_data()
+        return self.instance_markets
+
     def get_instance_markets(self):
         coins_exchanges_symbol = self.all_markets
         total_len = len(list(coins_exchanges_symbol.keys()))
@@ -0,0 +1,144 @@
+import asyncio
+import threading
+import time
+from core.wrappers import try_exc_regular, try_exc_async
+
+
+class BalanceLedger:
+    # Доступные балансы (USD под новые позиции) по биржам вместо полной перезагрузки после каждой сделки.
+    # - reconcile(): берет цифры биржи (client.get_available_balance()) - при запуске и в фоне (run_reconcile);
+    # - между сверками балансы двигаются дельтами филлов: бот регистрирует свой ордер (expect),
+    #   ответ клиента по нему приходит в on_response (слушатель OrderResponses) и сразу меняет баланс;
+    # - биржа с филлом за последние settle_sec не сверяется: ее позиции в клиенте могут еще не обновиться;
+    #   сверка, во время которой пришел филл, тоже пропускается - иначе замена баланса потеряла бы его дельту;
+    #   после max_skips пропусков подряд (мейкер биржа с филлами чаще settle_sec) сверка все равно делается,
+    #   иначе дрифт такой биржи не исправлялся бы и не алертился никогда;
+    # - на каждом филле из ответа обновляются и позиции биржи в positions_cache.
+    # balances того же формата, что и раньше available_balances: {exchange: {'buy', 'sell', market: {'buy', 'sell'}}}
+
+    def __init__(self, clients_with_names, deal_locks, positions_cache=None, settle_sec=5, drift_alert=0.05,
+                 expect_ttl=60, max_skips=4):
+        self.clients_with_names = clients_with_names
+        self.deal_locks = deal_locks
+        self.positions_cache = positions_cache
+        self.settle_sec = settle_sec
+        self.drift_alert = drift_alert
+        self.expect_ttl = expect_ttl
+        self.max_skips = max_skips
+        self.lock = threading.Lock()
+        self.balances = dict()
+        self.expected = dict()  # {(exchange, client_id): [market, side, applied size, ts]}
+        self.last_fill = dict()  # {exchange: ts}
+        self.skips = dict()  # {exchange: reconciles skipped in a row}
+        self.fills = 0
+        self.reconciles = 0
+        self.time_stats = time.time()
+
+    @try_exc_regular
+    def reconcile(self, exchange: str, force: bool = False) -> None:
+        if not force and time.time() - self.last_fill.get(exchange, 0) < self.settle_sec:
+            skips = self.skips[exchange] = self.skips.get(exchange, 0) + 1
+            if skips < self.max_skips:
+                return
+            print(f"BALANCE LEDGER {exchange}: {skips} RECONCILES SKIPPED IN A ROW, RECONCILING WITHOUT SETTLING")
+        read_ts = time.time()
+        balance = self.clients_with_names[exchange].get_available_balance()
+        if not balance:
+            return
+        # Nested dicts are copied, deltas must not change the client's own data
+        balance = {x: dict(y) if isinstance(y, dict) else y for x, y in balance.items()}
+        with self.lock:
+            if self.last_fill.get(exchange, 0) >= read_ts:
+                # A fill was applied after the read: these numbers may miss it, the next reconcile catches up
+                self.skips[exchange] = self.skips.get(exchange, 0) + 1
+                return
+            if old := self.balances.get(exchange):
+                drift = abs(old['buy'] - balance['buy'])
+                if drift > self.drift_alert * max(abs(balance['buy']), 1):
+                    print(f"BALANCE LEDGER DRIFT {exchange}: LEDGER {round(old['buy'], 2)} "
+                          f"EXCHANGE {round(balance['buy'], 2)}")
+            self.balances[exchange] = balance
+            self.skips[exchange] = 0
+        self.reconciles += 1
+
+    @try_exc_regular
+    def reconcile_all(self, force: bool = False) -> None:
+        for exchange in self.clients_with_names.keys():
+            self.reconcile(exchange, force)
+        # Responses later than expect_ttl are left to reconciliation
+        now = time.time()
+        with self.lock:
+            for key in [x for x, y in self.expected.items() if now - y[3] > self.expect_ttl]:
+                self.expected.pop(key)
+
+    @try_exc_async
+    async def run_reconcile(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            self.reconcile_all()
+            self.print_stats()
+
+    @try_exc_regular
+    def expect(self, exchange: str, client_id: str, market: str, side: str) -> None:
+        with self.lock:
+            self.expected[(exchange, client_id)] = [market, side, 0, time.time()]
+
+    @try_exc_regular
+    def on_response(self, exchange: str, kind: str, key, response) -> None:
+        # Called by OrderResponses for every response write, also from clients' threads
+        if kind != 'order' or not response:
+            return
+        with self.lock:
+            if not (order := self.expected.get((exchange, key))):
+                return
+            # Status updates of the same order carry the total executed size
+            delta = (response.get('size') or 0) - order[2]
+            if delta <= 0 or not response.get('price'):
+                return
+            order[2] += delta
+            self.apply_fill(exchange, order[0], order[1], delta, response['price'])
+        if self.positions_cache:
+            self.positions_cache.update(exchange)
+
+    @try_exc_regular
+    def add_fill(self, exchange: str, market: str, side: str, size: float, price: float) -> None:
+        # Fills reported without our request: maker orders
+        with self.lock:
+            self.apply_fill(exchange, market, side, size, price)
+
+    def apply_fill(self, exchange: str, market: str, side: str, size: float, price: float) -> None:
+        # Under self.lock. Buying takes from 'buy' and gives to 'sell' (closing of a short), selling - vice versa
+        if not (balance := self.balances.get(exchange)):
+            return
+        delta_usd = size * price if side == 'buy' else -size * price
+        balance['buy'] -= delta_usd
+        balance['sell'] += delta_usd
+        if market_balance := balance.get(market):
+            market_balance['buy'] -= delta_usd
+            market_balance['sell'] += delta_usd
+        self.last_fill[exchange] = time.time()
+        self.fills += 1
+
+    def get_available(self, exchange: str, market: str, side: str):
+        # USD, reservations of deals in process excluded. None until the first reconcile of the exchange
+        if not (balance := self.balances.get(exchange)):
+            return None
+        if market_balance := balance.get(market):
+            return market_balance[side] - self.deal_locks.get_reserved(exchange, side)
+        return balance[side] - self.deal_locks.get_reserved(exchange, side)
+
+    def get_max_tradable_usd(self, buy_ex: str, buy_mrkt: str, sell_ex: str, sell_mrkt: str) -> float:
+        buy_usd = self.get_available(buy_ex, buy_mrkt, 'buy')
+        if buy_usd is None:
+            return 0
+        sell_usd = self.get_available(sell_ex, sell_mrkt, 'sell')
+        if sell_usd is None:
+            return 0
+        return min(buy_usd, sell_usd)
+
+    @try_exc_regular
+    def print_stats(self) -> None:
+        if time.time() - self.time_stats > 600:
+            print(f"BALANCE LEDGER STATS: FILLS: {self.fills} RECONCILES: {self.reconciles} "
+                  f"EXPECTED ORDERS: {len(self.expected)} SKIPS IN A ROW: {self.skips}")
+            self.time_stats = time.time()
@@ -0,0 +1,48 @@
+import threading
+from core.wrappers import try_exc_regular
+
+
+class DealLocks:
+    # Заменяет глобальный флаг arbitrage_processing. Пока AP по монете в работе, монета занята,
+    # а под обе ноги сделки зарезервирован доступный баланс (USD) на своих биржах.
+    # Независимые AP (другие монеты, хватает баланса) исполняются параллельно, конфликтующие отбрасываются.
+    # Финдеры и бот могут работать в лупах разных потоков, поэтому внутри threading.Lock.
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.coins = set()
+        self.reserved = dict()  # {exchange: {'buy': usd, 'sell': usd}}
+
+    def is_busy(self, coin: str) -> bool:
+        return coin in self.coins
+
+    def get_reserved(self, exchange: str, side: str) -> float:
+        if reserved := self.reserved.get(exchange):
+            return reserved[side]
+        return 0
+
+    @try_exc_regular
+    def acquire(self, coin: str, ex_buy: str, ex_sell: str, get_size_usd) -> float:
+        # get_size_usd is called under the lock, so the balance check and the reservation are atomic
+        with self.lock:
+            if coin in self.coins:
+                return 0
+            size_usd = get_size_usd()
+            if not size_usd:
+                return 0
+            self.coins.add(coin)
+            self.reserve(ex_buy, 'buy', size_usd)
+            self.reserve(ex_sell, 'sell', size_usd)
+            return size_usd
+
+    @try_exc_regular
+    def release(self, coin: str, ex_buy: str, ex_sell: str, size_usd: float) -> None:
+        with self.lock:
+            self.coins.discard(coin)
+            self.reserve(ex_buy, 'buy', -size_usd)
+            self.reserve(ex_sell, 'sell', -size_usd)
+
+    def reserve(self, exchange: str, side: str, size_usd: float) -> None:
+        if not self.reserved.get(exchange):
+            self.reserved[exchange] = {'buy': 0, 'sell': 0}
+        self.reserved[exchange][side] = max(0, self.reserved[exchange][side] + size_usd)
@@ -0,0 +1,125 @@
+class Deal:
+    # Тейкер AP от финдеров (ArbitrageFinder, ArbitrageFinderMatrix) -> MultiBot.run_arbitrage.
+    # Объект со __slots__ вместо словаря на каждое срабатывание: без хеширования ключей и с меньшим размером.
+    # В базу, отчеты и принты уходит через to_dict() - ключи те же, что были у словаря сделки.
+    # Финдеры создают сделку позиционными аргументами в порядке __init__: так в разы быстрее, чем по именам.
+    __slots__ = ['client_buy', 'client_sell', 'buy_px', 'sell_px', 'buy_sz', 'sell_sz', 'buy_mrkt', 'sell_mrkt',
+                 'ts_start_counting', 'ob_buy_own_ts', 'ob_sell_own_ts', 'ob_buy_api_ts', 'ob_sell_api_ts', 'ex_buy',
+                 'ex_sell', 'coin', 'target_profit', 'profit', 'direction', 'trigger_ex', 'trigger_type',
+                 'limit_buy_px', 'limit_sell_px']
+
+    def __init__(self, client_buy, client_sell, buy_px: float, sell_px: float, buy_sz: float, sell_sz: float,
+                 buy_mrkt: str, sell_mrkt: str, ts_start_counting: float, ob_buy_own_ts: float, ob_sell_own_ts: float,
+                 ob_buy_api_ts: float, ob_sell_api_ts: float, ex_buy: str, ex_sell: str, coin: str,
+                 target_profit: float, profit: float, direction: str, trigger_ex: str, trigger_type: str,
+                 limit_buy_px: float = None, limit_sell_px: float = None):
+        self.client_buy = client_buy
+        self.client_sell = client_sell
+        self.buy_px = buy_px
+        self.sell_px = sell_px
+        self.buy_sz = buy_sz
+        self.sell_sz = sell_sz
+        # Without depth sizing limit prices are the top of the books
+        self.limit_buy_px = limit_buy_px or buy_px
+        self.limit_sell_px = limit_sell_px or sell_px
+        self.buy_mrkt = buy_mrkt
+        self.sell_mrkt = sell_mrkt
+        self.ts_start_counting = ts_start_counting
+        self.ob_buy_own_ts = ob_buy_own_ts
+        self.ob_sell_own_ts = ob_sell_own_ts
+        self.ob_buy_api_ts = ob_buy_api_ts
+        self.ob_sell_api_ts = ob_sell_api_ts
+        self.ex_buy = ex_buy
+        self.ex_sell = ex_sell
+        self.coin = coin
+        self.target_profit = target_profit
+        self.profit = profit
+        self.direction = direction
+        self.trigger_ex = trigger_ex
+        self.trigger_type = trigger_type
+
+    def to_dict(self) -> dict:
+        return {x: getattr(self, x) for x in self.__slots__}
+
+    def __repr__(self):
+        return f"Deal({self.to_dict()})"
+
+
+class MakerCandidate:
+    # Потенциальная мейкер сделка одной пары бирж в MarketFinder.count_one_coin.
+    # Диапазон цены мейкер ордера [low, top], target - уровень стакана тейкер биржи [price, size].
+    __slots__ = ['fees', 'sz_coin', 'direction', 'tick', 'low', 'top', 'target']
+
+    def __init__(self, fees: float, sz_coin: float, direction: str, tick: float, low: float, top: float,
+                 target: list):
+        self.fees = fees
+        self.sz_coin = sz_coin
+        self.direction = direction
+        self.tick = tick
+        self.low = low
+        self.top = top
+        self.target = target
+
+    def to_dict(self) -> dict:
+        return {'fees': self.fees, 'sz_coin': self.sz_coin, 'direction': self.direction, 'tick': self.tick,
+                'range': [self.low, self.top], 'target': self.target}
+
+    def __repr__(self):
+        return f"MakerCandidate({self.to_dict()})"
+
+
+class MakerQuote:
+    # Лучшая мейкер сделка монеты (MarketFinder.get_top_deal), она же выставленный ордер в MultiBot.open_orders.
+    # market, client_id, order_id, old_order_size заполняет MultiBot при создании и amend ордера.
+    # level - уровень в лесенке (MakerLadder), None для одиночного ордера.
+    # Клиентам в async_tasks уходит to_dict() - тот же словарь ордера, что и раньше.
+    __slots__ = ['side', 'price', 'size', 'coin', 'last_update', 'profit', 'low', 'top', 'target', 'direction',
+                 'tick', 'market', 'client_id', 'order_id', 'old_order_size', 'level']
+
+    def __init__(self, side: str, price: float, size: float, coin: str, last_update: float, profit: float,
+                 low: float, top: float, target: float, direction: str, tick: float):
+        self.side = side
+        self.price = price
+        self.size = size
+        self.coin = coin
+        self.last_update = last_update
+        self.profit = profit
+        self.low = low
+        self.top = top
+        self.target = target
+        self.direction = direction
+        self.tick = tick
+        self.market = None
+        self.client_id = None
+        self.order_id = None
+        self.old_order_size = None
+        self.level = None
+
+    def to_dict(self) -> dict:
+        data = {'side': self.side, 'price': self.price, 'size': self.size, 'coin': self.coin,
+                'last_update': self.last_update, 'profit': self.profit, 'range': [self.low, self.top],
+                'target': self.target, 'direction': self.direction, 'tick': self.tick}
+        if self.market:
+            data.update({'market': self.market, 'client_id': self.client_id})
+        if self.order_id:
+            data.update({'order_id': self.order_id, 'old_order_size': self.old_order_size})
+        if self.level is not None:
+            data['level'] = self.level
+        return data
+
+    def __repr__(self):
+        return f"MakerQuote({self.to_dict()})"
+
+
+class LadderQuotes:
+    # Желаемая лесенка мейкер ордеров монеты (MakerLadder.build): котировки по уровням, уровень 0 - ближний к рынку
+    __slots__ = ['coin', 'last_update', 'buy', 'sell']
+
+    def __init__(self, coin: str, last_update: float, buy: list, sell: list):
+        self.coin = coin
+        self.last_update = last_update
+        self.buy = buy
+        self.sell = sell
+
+    def __repr__(self):
+        return f"LadderQuotes({self.coin}, buy={self.buy}, sell={self.sell})"
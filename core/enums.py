@@ -12,6 +12,8 @@ class RabbitMqQueues:
     ARBITRAGE_POSSIBILITIES = 'logger.event.insert_arbitrage_possibilities'
     ORDERS = 'logger.event.insert_orders'
     UPDATE_ORDERS = 'logger.event.update_orders'
+    # {'rows': [order updates of UPDATE_ORDERS format], 'count': n, 'ts': ...} -> bulk upsert by order id
+    UPDATE_ORDERS_BATCH = 'logger.event.update_orders_batch'
     CHECK_BALANCE = 'logger.event.check_balance'
     BALANCES = 'logger.event.insert_balances'
     # BALANCES = 'logger.event.insert_balances'
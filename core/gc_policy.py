@@ -0,0 +1,93 @@
+import asyncio
+import gc
+import time
+from core.wrappers import try_exc_regular, try_exc_async
+
+
+class GCPolicy:
+    # Вместо gc.disable() на найденном AP и gc.enable() после deal_pause:
+    # - start() после загрузки рынков, инструментов, клиентов и балансов: полная сборка и gc.freeze() -
+    #   все, что живет весь запуск, уходит в permanent generation и больше не сканируется;
+    # - пороги автоматического GC подняты (gen0_threshold), автоматическая сборка остается только страховкой;
+    # - run_safe_points() на лупе бота раз в interval собирает gen0 (и gen1/gen2 по своим счетчикам),
+    #   но только когда is_busy() ложно: нет AP в работе и мейкер запросов в процессе.
+    # Если сборка откладывается дольше max_delay, она выполняется в любом случае.
+
+    def __init__(self, is_busy, interval=0.5, gen0_threshold=50000, gen0_safe_point=1000, full_interval=600,
+                 max_delay=10):
+        self.is_busy = is_busy
+        self.interval = interval
+        self.thresholds = (gen0_threshold, 20, 100)
+        self.gen0_safe_point = gen0_safe_point
+        self.full_interval = full_interval
+        self.max_delay = max_delay
+        self.started = False
+        self.frozen = 0
+        self.last_collect = time.time()
+        self.last_full = time.time()
+        self.collections = {x: [0, 0] for x in range(3)}  # {generation: [collections, total sec]}
+        self.postponed = 0
+        self.time_stats = time.time()
+
+    @try_exc_regular
+    def start(self) -> None:
+        if self.started:
+            return
+        gc.collect()
+        gc.freeze()
+        gc.set_threshold(*self.thresholds)
+        self.frozen = gc.get_freeze_count()
+        self.started = True
+        self.last_collect = self.last_full = time.time()
+        print(f"GC POLICY STARTED. FROZEN OBJECTS: {self.frozen}. THRESHOLDS: {self.thresholds}")
+
+    @try_exc_async
+    async def run_safe_points(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            self.safe_point()
+
+    @try_exc_regular
+    def safe_point(self) -> None:
+        now = time.time()
+        if self.is_busy() and now - self.last_collect < self.max_delay:
+            self.postponed += 1
+            return
+        generation = self.get_generation(now)
+        if generation is None:
+            return
+        ts_start = time.perf_counter()
+        gc.collect(generation)
+        self.collections[generation][0] += 1
+        self.collections[generation][1] += time.perf_counter() - ts_start
+        self.last_collect = now
+        if generation == 2:
+            self.last_full = now
+        self.print_stats()
+
+    @try_exc_regular
+    def get_generation(self, now: float):
+        count0, count1, count2 = gc.get_count()
+        if now - self.last_full > self.full_interval:
+            return 2
+        if count2 >= self.thresholds[2] // 2:
+            return 2
+        if count1 >= self.thresholds[1] // 2:
+            return 1
+        if count0 >= self.gen0_safe_point:
+            return 0
+        return None
+
+    @try_exc_regular
+    def get_stats(self) -> dict:
+        return {'frozen': self.frozen,
+                'postponed': self.postponed,
+                'counts': gc.get_count(),
+                'collections': {f'gen{x}': {'amount': y[0], 'total_ms': round(y[1] * 1000, 3)}
+                                for x, y in self.collections.items()}}
+
+    @try_exc_regular
+    def print_stats(self) -> None:
+        if time.time() - self.time_stats > 600:
+            print(f"GC POLICY STATS: {self.get_stats()}")
+            self.time_stats = time.time()
@@ -0,0 +1,69 @@
+import math
+from decimal import Decimal
+from core.wrappers import try_exc_regular
+
+
+class Instrument:
+    # Параметры рынка одной биржи. ticks_per_unit - целочисленная шкала цены: price * ticks_per_unit = цена в тиках
+    __slots__ = ['exchange', 'market', 'tick', 'step', 'min_size', 'min_notional', 'ticks_per_unit']
+
+    def __init__(self, exchange: str, market: str, instrument: dict):
+        self.exchange = exchange
+        self.market = market
+        self.tick = instrument['tick_size']
+        self.step = instrument['step_size']
+        self.min_size = instrument.get('min_size', 0)
+        self.min_notional = instrument.get('min_notional', 0)
+        self.ticks_per_unit = 1 / self.tick
+
+    def to_ticks(self, price: float) -> int:
+        return round(price * self.ticks_per_unit)
+
+
+class InstrumentTable:
+    # Таблица инструментов по монетам, собирается на старте и в refresh() при смене рынков/инструментов.
+    # Вместо обхода client.instruments на каждой сделке и котировке:
+    # - steps[coin] - общий шаг размера для всех бирж монеты (НОК шагов), размер обеих ног округляется по нему;
+    # - venues[(exchange, market)] - тик, шаг, min size, min notional и шкала цены в тиках.
+
+    def __init__(self, clients_with_names):
+        self.clients_with_names = clients_with_names
+        self.venues = dict()  # {(exchange, market): Instrument}
+        self.steps = dict()  # {coin: (common step, decimals)}
+        self.refresh()
+
+    @try_exc_regular
+    def refresh(self) -> None:
+        venues = dict()
+        coin_steps = dict()
+        for exchange, client in self.clients_with_names.items():
+            for coin, market in client.markets.items():
+                if instrument := client.instruments.get(market):
+                    venue = venues[(exchange, market)] = Instrument(exchange, market, instrument)
+                    coin_steps.setdefault(coin, []).append(venue.step)
+        # Readers keep working with the old dicts until the swap
+        self.steps = {x: self.get_common_step(y) for x, y in coin_steps.items()}
+        self.venues = venues
+
+    @staticmethod
+    def get_common_step(steps: list) -> tuple:
+        # Least common multiple in integer units of the finest decimal place: sizes valid on every venue
+        decimals = max([max(-Decimal(str(x)).normalize().as_tuple().exponent, 0) for x in steps])
+        scale = 10 ** decimals
+        common = 1
+        for step in steps:
+            common = math.lcm(common, round(step * scale))
+        return common / scale, decimals
+
+    def get(self, exchange: str, market: str) -> Instrument:
+        return self.venues.get((exchange, market))
+
+    @try_exc_regular
+    def precise_size(self, coin: str, size: float) -> float:
+        step, decimals = self.steps[coin]
+        # Epsilon: 0.3 / 0.1 must give 3 steps, not 2
+        return round(math.floor(size / step + 1e-9) * step, decimals)
+
+    def check_min_size(self, exchange: str, market: str, size_usd: float, price: float) -> bool:
+        venue = self.venues[(exchange, market)]
+        return size_usd >= venue.min_size * price and size_usd >= venue.min_notional
@@ -0,0 +1,126 @@
+import json
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from core.wrappers import try_exc_regular
+
+# HDR-style бакеты по микросекундам: до 128 мкс - по 1 мкс, дальше каждая степень двойки делится на 64 бакета,
+# то есть относительная ошибка значения не больше ~1.5% на любом масштабе.
+SUB_BUCKETS = 64
+LINEAR_LIMIT = SUB_BUCKETS * 2
+
+
+def get_bucket(value_us: int) -> int:
+    if value_us < LINEAR_LIMIT:
+        return value_us
+    shift = value_us.bit_length() - 7
+    return LINEAR_LIMIT + (shift - 1) * SUB_BUCKETS + (value_us >> shift) - SUB_BUCKETS
+
+
+def get_bucket_value(bucket: int) -> float:
+    # Middle of the bucket, us
+    if bucket < LINEAR_LIMIT:
+        return bucket
+    shift = (bucket - LINEAR_LIMIT) // SUB_BUCKETS + 1
+    mantissa = (bucket - LINEAR_LIMIT) % SUB_BUCKETS + SUB_BUCKETS
+    return (mantissa << shift) + (1 << shift) / 2
+
+
+class LatencyHistograms:
+    # Гистограммы латенси по (биржа, стадия) в памяти. Каждая гистограмма - кольцо слотов по slot_sec секунд
+    # за последние keep_sec, перцентили за окно считаются по слитым слотам окна.
+    # Читаются из бота (get_percentiles), дампом в файл (dump) и по HTTP на localhost (serve):
+    # GET /latency?window=60 -> {exchange: {stage: {count, p50_ms, p99_ms, p999_ms, max_ms}}}
+
+    def __init__(self, slot_sec=10, keep_sec=3600):
+        self.slot_sec = slot_sec
+        self.max_slots = keep_sec // slot_sec + 1
+        self.lock = threading.Lock()
+        self.histograms = dict()  # {(exchange, stage): deque([[slot start ts, {bucket: count}, max_us], ...])}
+        self.server = None
+
+    @try_exc_regular
+    def record(self, exchange: str, stage: str, seconds: float, now: float = None) -> None:
+        if seconds is None:
+            return
+        now = now or time.time()
+        slot_start = now - now % self.slot_sec
+        # Exchange timestamps may be a bit ahead of local clock
+        value_us = max(int(seconds * 10 ** 6), 0)
+        bucket = get_bucket(value_us)
+        with self.lock:
+            slots = self.histograms.get((exchange, stage))
+            if slots is None:
+                slots = self.histograms[(exchange, stage)] = deque(maxlen=self.max_slots)
+            if not slots or slots[-1][0] != slot_start:
+                slots.append([slot_start, dict(), 0])
+            slot = slots[-1]
+            slot[1][bucket] = slot[1].get(bucket, 0) + 1
+            if value_us > slot[2]:
+                slot[2] = value_us
+
+    @try_exc_regular
+    def get_percentiles(self, window: float = 60, now: float = None) -> dict:
+        now = now or time.time()
+        results = dict()
+        with self.lock:
+            items = [(key, [x for x in slots if x[0] > now - window - self.slot_sec])
+                     for key, slots in self.histograms.items()]
+        for (exchange, stage), slots in items:
+            counts = dict()
+            max_us = 0
+            for _, slot_counts, slot_max in slots:
+                for bucket, count in slot_counts.items():
+                    counts[bucket] = counts.get(bucket, 0) + count
+                max_us = max(max_us, slot_max)
+            if not counts:
+                continue
+            total = sum(counts.values())
+            stats = {'count': total}
+            for name, part in [('p50_ms', 0.5), ('p99_ms', 0.99), ('p999_ms', 0.999)]:
+                stats[name] = round(min(self.get_value(counts, total * part), max_us) / 1000, 3)
+            stats['max_ms'] = round(max_us / 1000, 3)
+            results.setdefault(exchange, dict())[stage] = stats
+        return results
+
+    @staticmethod
+    def get_value(counts: dict, rank: float) -> float:
+        passed = 0
+        for bucket in sorted(counts.keys()):
+            passed += counts[bucket]
+            if passed >= rank:
+                return get_bucket_value(bucket)
+        return 0
+
+    @try_exc_regular
+    def dump(self, file_name: str, windows=(60, 600, 3600)) -> None:
+        data = {'ts': time.time(), 'windows': {str(x): self.get_percentiles(x) for x in windows}}
+        with open(file_name, 'w') as file:
+            json.dump(data, file, indent=2)
+
+    @try_exc_regular
+    def serve(self, port: int, host='127.0.0.1') -> None:
+        histograms = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                if url.path != '/latency':
+                    self.send_error(404)
+                    return
+                window = float(parse_qs(url.query).get('window', ['60'])[0])
+                body = json.dumps(histograms.get_percentiles(window)).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        print(f"LATENCY HISTOGRAMS: http://{host}:{port}/latency?window=60")
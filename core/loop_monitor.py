@@ -0,0 +1,140 @@
+import asyncio
+import gc
+import inspect
+import sys
+import threading
+import time
+from collections import deque
+from core.wrappers import try_exc_regular, try_exc_async
+
+
+class LoopMonitor:
+    # Задержки нашего процесса, а не бирж:
+    # - лаг каждого наблюдаемого лупа: корутина спит interval и меряет, насколько позже проснулась;
+    # - паузы GC по поколениям через gc.callbacks;
+    # - медленные колбэки: поток-сторож видит, что луп не проснулся вовремя дольше slow_callback,
+    #   и снимает стек потока лупа (sys._current_frames), чтобы назвать корутину, которая держит луп.
+    # Лаг и паузы GC пишутся в LatencyHistograms: (loop name, 'loop_lag') и ('GC', 'gen{N}_pause').
+
+    def __init__(self, histograms, interval=0.05, slow_callback_ms=20):
+        self.histograms = histograms
+        self.interval = interval
+        self.slow_callback = slow_callback_ms / 1000
+        self.loops = dict()  # {name: {'loop', 'thread_id', 'expected', 'culprit': (expected, text)}}
+        self.slow_callbacks = dict()  # {(loop name, culprit): [count, max sec]}
+        self.gc_start = 0
+        self.gc_pauses = deque(maxlen=10000)  # [(end perf_counter, generation, pause sec)]
+        self.gc_loop = None  # the only loop draining gc_pauses: the first one watched
+        self.last_gc = (0, 0, 0)
+        self.gc_stats = {x: [0, 0, 0] for x in range(3)}  # {generation: [collections, total sec, max sec]}
+        self.time_stats = time.time()
+        self.watchdog = None
+        gc.callbacks.append(self.gc_callback)
+
+    def gc_callback(self, phase, info):
+        # Runs inside the collection: no locks, only one small tuple appended to the bounded deque
+        if phase == 'start':
+            self.gc_start = time.perf_counter()
+        else:
+            now = time.perf_counter()
+            self.gc_pauses.append((now, info['generation'], now - self.gc_start))
+
+    @try_exc_regular
+    def watch(self, loop, name: str) -> None:
+        self.loops[name] = {'loop': loop, 'thread_id': None, 'expected': None}
+        if not self.gc_loop:
+            self.gc_loop = name
+        loop.call_soon_threadsafe(lambda: loop.create_task(self.sample_lag(name)))
+        if not self.watchdog:
+            self.watchdog = threading.Thread(target=self.run_watchdog, daemon=True)
+            self.watchdog.start()
+
+    @try_exc_async
+    async def sample_lag(self, name: str):
+        state = self.loops[name]
+        state['thread_id'] = threading.get_ident()
+        while True:
+            expected = state['expected'] = time.perf_counter() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = time.perf_counter() - expected
+            self.histograms.record(name, 'loop_lag', lag)
+            if name == self.gc_loop:
+                self.flush_gc_pauses()
+            culprit = state.pop('culprit', None)
+            if lag > self.slow_callback:
+                # Stack taken by the watchdog during this very stall
+                self.report_stall(name, lag, culprit[1] if culprit and culprit[0] == expected else None)
+
+    @try_exc_regular
+    def flush_gc_pauses(self) -> None:
+        while self.gc_pauses:
+            end, generation, pause = self.gc_pauses.popleft()
+            stats = self.gc_stats[generation]
+            stats[0] += 1
+            stats[1] += pause
+            stats[2] = max(stats[2], pause)
+            self.histograms.record('GC', f'gen{generation}_pause', pause)
+            if pause > self.last_gc[2] or end - self.last_gc[0] > self.interval:
+                self.last_gc = (end, generation, pause)
+
+    @try_exc_regular
+    def report_stall(self, name: str, lag: float, culprit: str) -> None:
+        culprit = culprit or 'unknown'
+        gc_pause = ''
+        end, generation, pause = self.last_gc
+        if time.perf_counter() - end < lag + self.interval and pause > self.slow_callback / 2:
+            culprit += f' | GC gen{generation}'
+            gc_pause = f' {round(pause * 1000, 1)} ms'
+        stats = self.slow_callbacks.setdefault((name, culprit), [0, 0])
+        stats[0] += 1
+        stats[1] = max(stats[1], lag)
+        print(f"SLOW CALLBACK {name}: {round(lag * 1000, 1)} ms | {culprit}{gc_pause}")
+
+    def run_watchdog(self) -> None:
+        while True:
+            time.sleep(self.interval / 2)
+            now = time.perf_counter()
+            frames = None
+            for name, state in list(self.loops.items()):
+                expected = state['expected']
+                if not expected or now - expected < self.slow_callback or 'culprit' in state:
+                    continue
+                if not state['loop'].is_running():
+                    continue
+                frames = frames or sys._current_frames()
+                if frame := frames.get(state['thread_id']):
+                    state['culprit'] = (expected, self.get_culprit(frame))
+
+    @staticmethod
+    def get_culprit(frame) -> str:
+        # Outermost coroutine on the stack (the task) and the innermost frame (what it is doing now)
+        if frame.f_code is LoopMonitor.gc_callback.__code__ and frame.f_back:
+            frame = frame.f_back
+        inner = frame
+        task = None
+        while frame:
+            if frame.f_code.co_flags & inspect.CO_COROUTINE:
+                task = frame
+            frame = frame.f_back
+        inner_name = f"{getattr(inner.f_code, 'co_qualname', inner.f_code.co_name)} " \
+                     f"({inner.f_code.co_filename.split('/')[-1]}:{inner.f_lineno})"
+        if task and task is not inner:
+            return f"{getattr(task.f_code, 'co_qualname', task.f_code.co_name)} -> {inner_name}"
+        return inner_name
+
+    @try_exc_regular
+    def get_stats(self, window=60) -> dict:
+        percentiles = self.histograms.get_percentiles(window)
+        return {'loop_lag': {x: percentiles.get(x, {}).get('loop_lag') for x in self.loops.keys()},
+                'gc': {f'gen{x}': {'collections': y[0], 'total_ms': round(y[1] * 1000, 3),
+                                   'max_ms': round(y[2] * 1000, 3)} for x, y in self.gc_stats.items()},
+                'slow_callbacks': {f'{x[0]} | {x[1]}': {'count': y[0], 'max_ms': round(y[1] * 1000, 1)}
+                                   for x, y in sorted(self.slow_callbacks.items(), key=lambda x: -x[1][0])[:10]}}
+
+    @try_exc_regular
+    def print_stats(self) -> None:
+        if time.time() - self.time_stats > 60:
+            print(f"LOOP MONITOR STATS: {self.get_stats()}")
+            self.time_stats = time.time()
+            self.gc_stats = {x: [0, 0, 0] for x in range(3)}
+            self.slow_callbacks = dict()
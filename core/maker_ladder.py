@@ -0,0 +1,148 @@
+import threading
+import time
+from core.deals import MakerQuote, LadderQuotes
+from core.wrappers import try_exc_regular
+
+
+class MakerLadder:
+    # Режим лесенки (MAKER_LADDER_LEVELS > 1): на монету до levels мейкер ордеров на каждую сторону вместо одного.
+    # Уровни равномерно делят прибыльный диапазон [low, top] из get_range_buy_side/get_range_sell_side:
+    # уровень 0 - ближний к рынку (та же цена, что у одиночного ордера), последний - дальний край диапазона.
+    # Размер монеты (доступный баланс и ликвидность тейкер биржи) делится поровну, каждый уровень не меньше min_size.
+    # orders - индекс выставленных ордеров {(market, side, level): [order_id, MakerQuote]},
+    # get_diff() сравнивает с ним желаемую лесенку, MultiBot.update_maker_ladder отправляет разницу одной пачкой.
+    # Филл может прийти раньше, чем бот получил ответ с id ордера: такие филлы ждут в early_fills и
+    # применяются в set(), иначе в индексе остался бы уже исполненный ордер.
+
+    def __init__(self, mm_client, levels: int, min_size: float):
+        self.mm_client = mm_client
+        self.levels = levels
+        self.min_size = min_size
+        self.orders = dict()  # {(market, side, level): [order_id, MakerQuote]}
+        self.early_fills = dict()  # {order_id: [filled size, ts]}
+        self.lock = threading.Lock()  # fills come from the client's loop
+
+    @try_exc_regular
+    def build(self, coin: str, buy_deals: list, sell_deals: list, now_ts: float) -> LadderQuotes:
+        return LadderQuotes(coin, now_ts, self.build_side(coin, 'buy', buy_deals, now_ts),
+                            self.build_side(coin, 'sell', sell_deals, now_ts))
+
+    @try_exc_regular
+    def build_side(self, coin: str, side: str, deals: list, now_ts: float) -> list:
+        if not deals:
+            return []
+        low = min([x.low for x in deals])
+        top = max([x.top for x in deals])
+        first = deals[0]
+        tick = first.tick
+        target_px = first.target[0]
+        size = min(first.sz_coin, first.target[1])
+        near, far = (top, low) if side == 'buy' else (low, top)
+        # Not more levels than distinct prices in the range and not smaller than min_size each
+        levels = min(self.levels, int(round((top - low) / tick)) + 1)
+        if self.min_size:
+            levels = min(levels, int(size * near / self.min_size))
+        if levels < 1:
+            return []
+        gap = (far - near) / (levels - 1) if levels > 1 else 0
+        quotes = []
+        for level in range(levels):
+            price = near + gap * level
+            if side == 'buy':
+                profit = (target_px - price) / price - first.fees
+            else:
+                profit = (price - target_px) / target_px - first.fees
+            quote = MakerQuote(side, price, size / levels, coin, now_ts, profit, round(low, 8), round(top, 8),
+                               target_px, first.direction, tick)
+            quote.level = level
+            quotes.append(quote)
+        return quotes
+
+    @try_exc_regular
+    def get_diff(self, market: str, side: str, quotes: list) -> list:
+        # [(action, key, quote, order_id)], action as in QuoteEngine: 'New order' / 'Amend' / 'Delete'
+        diff = []
+        for level in range(max(self.levels, len(quotes))):
+            key = (market, side, level)
+            quote = quotes[level] if level < len(quotes) else None
+            order = self.orders.get(key)
+            if order and quote:
+                if self.is_still_good(order[1], quote):
+                    order[1].last_update = quote.last_update
+                    continue
+                diff.append(('Amend', key, quote, order[0]))
+            elif order:
+                diff.append(('Delete', key, None, order[0]))
+            elif quote:
+                diff.append(('New order', key, quote, None))
+        return diff
+
+    @try_exc_regular
+    def has_diff(self, target: LadderQuotes) -> bool:
+        if not (market := self.mm_client.markets.get(target.coin)):
+            return False
+        return bool(self.get_diff(market, 'buy', target.buy) or self.get_diff(market, 'sell', target.sell))
+
+    def is_still_good(self, order: MakerQuote, quote: MakerQuote) -> bool:
+        # In the profitable range, near the level's price (within a half of the level gap) and not bigger than needed
+        tick = quote.tick
+        if not quote.low - tick < order.price < quote.top + tick:
+            return False
+        if abs(order.price - quote.price) > max(tick, (quote.top - quote.low) / (2 * self.levels)):
+            return False
+        return order.size <= quote.size
+
+    @try_exc_regular
+    def set(self, key: tuple, order_id: str, quote: MakerQuote) -> None:
+        with self.lock:
+            if early_fill := self.early_fills.pop(order_id, None):
+                quote.size -= early_fill[0]
+                if quote.size <= 1e-12:
+                    self.orders.pop(key, None)
+                    return
+            self.orders[key] = [order_id, quote]
+
+    @try_exc_regular
+    def pop(self, key: tuple):
+        return self.orders.pop(key, None)
+
+    @try_exc_regular
+    def find(self, order_id: str):
+        for key, order in self.orders.items():
+            if order[0] == order_id:
+                return key, order
+        return None, None
+
+    @try_exc_regular
+    def on_fill(self, order_id: str, size: float):
+        # Filled levels leave the index, the next finder's pass places them again
+        with self.lock:
+            key, order = self.find(order_id)
+            if not key:
+                now = time.time()
+                for old_id in [x for x, y in self.early_fills.items() if now - y[1] > 60]:
+                    self.early_fills.pop(old_id)
+                early_fill = self.early_fills.setdefault(order_id, [0, now])
+                early_fill[0] += size
+                return None
+            order[1].size -= size
+            if order[1].size <= 1e-12:
+                self.orders.pop(key, None)
+            return order
+
+    def get_near_px(self, coin: str, side: str) -> float:
+        # Price of the level 0: own order is not outbid by get_range_*
+        if order := self.orders.get((self.mm_client.markets.get(coin), side, 0)):
+            return order[1].price
+        return 0
+
+    def has_orders(self, coin: str, side: str) -> bool:
+        market = self.mm_client.markets.get(coin)
+        for level in range(self.levels):
+            if (market, side, level) in self.orders:
+                return True
+        return False
+
+    @try_exc_regular
+    def get_order_ids(self) -> set:
+        return {x[0] for x in self.orders.values()}
@@ -0,0 +1,174 @@
+import struct
+import threading
+import time
+from core.wrappers import try_exc_regular, try_exc_async
+
+# Бинарный журнал маркет даты: заголовок файла, затем записи, каждая начинается с 1 байта тега.
+# N - имя в таблице (0 exchange, 1 coin, 2 market, 3 trigger type): '<BHH' table, idx, len + utf-8
+# E - биржа: '<Hddd' exchange idx, taker_fee, maker_fee, top_ws_ping
+# M - рынок: '<HHHddd' exchange idx, coin idx, market idx, tick_size, step_size, min_size
+# B - стакан, на котором вызван финдер: '<dddHHHBBBHH' ts of the call, ts_ms, exchange timestamp, exchange idx,
+#     coin idx, market idx, kind, trigger type idx, timestamp in ms flag, asks amount, bids amount,
+#     затем (asks + bids) * 2 double: px, sz
+JOURNAL_HEADER = b'MDJ1'
+NAME = struct.Struct('<BHH')
+EXCHANGE = struct.Struct('<Hddd')
+MARKET = struct.Struct('<HHHddd')
+BOOK = struct.Struct('<dddHHHBBBHH')
+TABLES = ['exchange', 'coin', 'market', 'trigger_type']
+KINDS = ['ap_buy', 'ap_sell', 'mm']
+
+
+class MarketRecorder:
+    # Пишет каждый стакан, с которым клиенты вызывают finder.count_one_coin / market_finder.count_one_coin.
+    # Записи копятся в буфере и пишутся в файл при заполнении буфера и по flush() из цикла бота.
+
+    def __init__(self, file_name='market_data.bin', max_levels=10, buffer_size=1024 * 1024):
+        self.file_name = file_name
+        self.max_levels = max_levels
+        self.buffer_size = buffer_size
+        self.lock = threading.Lock()
+        self.buffer = bytearray()
+        self.names = [dict() for _ in TABLES]
+        self.records = 0
+        self.file = open(file_name, 'ab')
+        if not self.file.tell():
+            self.file.write(JOURNAL_HEADER)
+
+    @try_exc_regular
+    def get_idx(self, table: int, name: str) -> int:
+        idx = self.names[table].get(name)
+        if idx is None:
+            idx = len(self.names[table])
+            self.names[table][name] = idx
+            encoded = name.encode()
+            self.buffer += b'N' + NAME.pack(table, idx, len(encoded)) + encoded
+        return idx
+
+    @try_exc_regular
+    def write_markets(self, clients_with_names: dict, markets: dict) -> None:
+        # Fees and instruments of all instance markets, so that the journal is enough for a replay
+        with self.lock:
+            for exchange, client in clients_with_names.items():
+                ex_idx = self.get_idx(0, exchange)
+                self.buffer += b'E' + EXCHANGE.pack(ex_idx, client.taker_fee, client.maker_fee, client.top_ws_ping)
+                for coin in markets.keys():
+                    if market := client.markets.get(coin):
+                        instrument = client.instruments.get(market, {})
+                        self.buffer += b'M' + MARKET.pack(ex_idx, self.get_idx(1, coin), self.get_idx(2, market),
+                                                          instrument.get('tick_size', 0),
+                                                          instrument.get('step_size', 0),
+                                                          instrument.get('min_size', 0))
+
+    @try_exc_regular
+    def record(self, client, coin: str, kind: int, trigger_type: str) -> None:
+        market = client.markets.get(coin)
+        if not market:
+            return
+        ob = client.get_orderbook(market)
+        if not ob:
+            return
+        asks = ob.get('asks', [])[:self.max_levels]
+        bids = ob.get('bids', [])[:self.max_levels]
+        timestamp = ob.get('timestamp', 0)
+        is_ms = 0 if isinstance(timestamp, float) else 1
+        levels = [x for level in asks for x in level[:2]] + [x for level in bids for x in level[:2]]
+        with self.lock:
+            self.buffer += b'B' + BOOK.pack(time.time(), ob.get('ts_ms', 0), timestamp,
+                                            self.get_idx(0, client.EXCHANGE_NAME), self.get_idx(1, coin),
+                                            self.get_idx(2, market), kind, self.get_idx(3, trigger_type or ''),
+                                            is_ms, len(asks), len(bids))
+            self.buffer += struct.pack(f'<{len(levels)}d', *levels)
+            self.records += 1
+            if len(self.buffer) > self.buffer_size:
+                self.flush(locked=True)
+
+    @try_exc_regular
+    def flush(self, locked=False) -> None:
+        if not locked:
+            with self.lock:
+                return self.flush(locked=True)
+        if self.buffer:
+            self.file.write(self.buffer)
+            self.file.flush()
+            self.buffer = bytearray()
+
+
+class RecordingFinder:
+    # Стоит в client.finder / client.market_finder перед финдером (или CoinTriggerScheduler),
+    # записывает стакан триггера и передает вызов дальше без изменений.
+
+    def __init__(self, finder, recorder: MarketRecorder, clients_with_names: dict, market_finder=False):
+        self.finder = finder
+        self.recorder = recorder
+        self.clients_with_names = clients_with_names
+        self.market_finder = market_finder
+
+    def __getattr__(self, item):
+        return getattr(self.finder, item)
+
+    @try_exc_async
+    async def count_one_coin(self, coin, *args):
+        if self.market_finder:
+            self.recorder.record(self.clients_with_names[args[0]], coin, 2, '')
+        else:
+            trigger_exchange, trigger_side, trigger_type = args
+            self.recorder.record(self.clients_with_names[trigger_exchange], coin,
+                                 0 if trigger_side == 'buy' else 1, trigger_type)
+        await self.finder.count_one_coin(coin, *args)
+
+
+@try_exc_regular
+def read_journal(file_name: str):
+    # [('exchange', dict) | ('market', dict) | ('book', dict), ...] in the order of recording
+    with open(file_name, 'rb') as file:
+        data = file.read()
+    if data[:len(JOURNAL_HEADER)] != JOURNAL_HEADER:
+        raise Exception(f'Wrong journal header: {file_name}')
+    return list(iter_journal(data, len(JOURNAL_HEADER)))
+
+
+def iter_journal(data: bytes, pos: int):
+    try:
+        yield from iter_records(data, pos)
+    except struct.error:
+        # Last record was not written completely
+        print(f'JOURNAL IS TRUNCATED')
+
+
+def iter_records(data: bytes, pos: int):
+    names = [dict() for _ in TABLES]
+    length = len(data)
+    while pos < length:
+        tag = data[pos:pos + 1]
+        pos += 1
+        if tag == b'N':
+            table, idx, size = NAME.unpack_from(data, pos)
+            pos += NAME.size
+            names[table][idx] = data[pos:pos + size].decode()
+            pos += size
+        elif tag == b'E':
+            ex_idx, taker_fee, maker_fee, top_ws_ping = EXCHANGE.unpack_from(data, pos)
+            pos += EXCHANGE.size
+            yield 'exchange', {'exchange': names[0][ex_idx], 'taker_fee': taker_fee, 'maker_fee': maker_fee,
+                               'top_ws_ping': top_ws_ping}
+        elif tag == b'M':
+            ex_idx, coin_idx, market_idx, tick_size, step_size, min_size = MARKET.unpack_from(data, pos)
+            pos += MARKET.size
+            yield 'market', {'exchange': names[0][ex_idx], 'coin': names[1][coin_idx],
+                             'market': names[2][market_idx], 'tick_size': tick_size, 'step_size': step_size,
+                             'min_size': min_size}
+        elif tag == b'B':
+            ts, ts_ms, timestamp, ex_idx, coin_idx, market_idx, kind, type_idx, is_ms, n_asks, n_bids = \
+                BOOK.unpack_from(data, pos)
+            pos += BOOK.size
+            levels = struct.unpack_from(f'<{(n_asks + n_bids) * 2}d', data, pos)
+            pos += (n_asks + n_bids) * 16
+            asks = [[levels[i], levels[i + 1]] for i in range(0, n_asks * 2, 2)]
+            bids = [[levels[i], levels[i + 1]] for i in range(n_asks * 2, (n_asks + n_bids) * 2, 2)]
+            yield 'book', {'ts': ts, 'exchange': names[0][ex_idx], 'coin': names[1][coin_idx],
+                           'market': names[2][market_idx], 'kind': KINDS[kind], 'trigger_type': names[3][type_idx],
+                           'ob': {'asks': asks, 'bids': bids, 'ts_ms': ts_ms,
+                                  'timestamp': int(timestamp) if is_ms else timestamp}}
+        else:
+            raise Exception(f'Broken journal record {tag} at {pos - 1}')
@@ -0,0 +1,269 @@
+import asyncio
+import sys
+import time
+from configparser import ConfigParser
+from types import SimpleNamespace
+from core.deal_locks import DealLocks
+from core.deals import Deal, MakerQuote
+from core.instruments import InstrumentTable
+from core.market_recorder import read_journal
+from core.quote_engine import QuoteEngine
+from core.wrappers import try_exc_regular, try_exc_async
+import arbitrage_finder
+import arbitrage_finder_matrix
+import arbitrage_finder_parse
+import market_maker_counter
+
+config = ConfigParser()
+config.read(sys.argv[1], "utf-8")
+
+FINDER_MODULES = [arbitrage_finder, arbitrage_finder_matrix, arbitrage_finder_parse, market_maker_counter]
+
+
+class SimulatedTime:
+    # Подменяет модуль time в финдерах: time() возвращает время записи текущего события журнала
+    def __init__(self):
+        self.now = 0
+
+    def time(self):
+        return self.now
+
+    def __getattr__(self, item):
+        return getattr(time, item)
+
+
+class ReplayClient:
+    def __init__(self, exchange: str, taker_fee: float, maker_fee: float, top_ws_ping: float):
+        self.EXCHANGE_NAME = exchange
+        self.taker_fee = taker_fee
+        self.maker_fee = maker_fee
+        self.top_ws_ping = top_ws_ping
+        self.markets = dict()
+        self.instruments = dict()
+        self.orderbook = dict()
+
+    def get_orderbook(self, market):
+        return self.orderbook.get(market)
+
+    def get_thb_rate(self):
+        return 1
+
+
+class ReplayBot:
+    # Все, что финдеры берут у MultiBot. Тейкер сделки исполняются сразу по ценам сделки,
+    # мейкер ордер исполняется, когда противоположная сторона стакана мейкер биржи доходит до его цены.
+
+    def __init__(self, clients_with_names: dict, setts, market_maker: bool):
+        self.clients_with_names = clients_with_names
+        self.instrument_table = InstrumentTable(clients_with_names)
+        self.positions_cache = SimpleNamespace(positions={x: dict() for x in clients_with_names.keys()})
+        self.deal_locks = DealLocks()
+        self.arbitrage_processing = False
+        self.market_maker = market_maker
+        self.mm_exchange = setts.get('MM_EXCHANGE', '')
+        self.count_ob_level = int(setts.get('MAKER_SHIFTS', 0))
+        self.profit_open = float(setts.get('PROFIT_OPEN', 0.001))
+        self.profit_close = float(setts.get('PROFIT_CLOSE', 0.001))
+        self.min_size = int(setts.get('MIN_ORDER_SIZE', 10))
+        self.max_order_size_usd = int(setts.get('ORDER_SIZE', 100))
+        self.open_orders = dict()
+        self.quote_engine = QuoteEngine(self)
+        self.requests_in_progress = self.quote_engine.in_progress
+        self.maker_ladder = None
+        self.orders_count = 0
+        self.opportunities = 0
+        self.deals = 0
+        self.pnl_usd = 0
+
+    @try_exc_regular
+    def update_position(self, exchange: str, market: str, amount: float, amount_usd: float) -> None:
+        positions = self.positions_cache.positions[exchange]
+        position = positions.setdefault(market, {'amount': 0, 'amount_usd': 0})
+        position['amount'] += amount
+        position['amount_usd'] += amount_usd
+
+    @try_exc_regular
+    def execute_taker(self, deal: Deal) -> None:
+        self.opportunities += 1
+        size_usd = min(self.max_order_size_usd, deal.buy_sz * deal.buy_px, deal.sell_sz * deal.sell_px)
+        if size_usd < self.min_size:
+            return
+        self.deals += 1
+        self.pnl_usd += deal.profit * size_usd
+        self.update_position(deal.ex_buy, deal.buy_mrkt, size_usd / deal.buy_px, size_usd)
+        self.update_position(deal.ex_sell, deal.sell_mrkt, -size_usd / deal.sell_px, -size_usd)
+
+    @try_exc_async
+    async def run_arbitrage(self, deal: Deal):
+        self.execute_taker(deal)
+
+    @try_exc_regular
+    def if_tradable(self, buy_ex, sell_ex, buy_mrkt, sell_mrkt, price):
+        return self.max_order_size_usd
+
+    @try_exc_regular
+    def set_order(self, coin: str, deal: MakerQuote) -> None:
+        self.orders_count += 1
+        market_id = coin + '-' + self.mm_exchange
+        self.open_orders[market_id] = [f'replay{self.orders_count}', deal]
+
+    @try_exc_async
+    async def new_maker_order(self, deal, coin):
+        self.opportunities += 1
+        self.set_order(coin, deal)
+
+    @try_exc_async
+    async def amend_maker_order(self, deal, coin, order_id):
+        self.set_order(coin, deal)
+
+    @try_exc_async
+    async def delete_maker_order(self, coin, order_id):
+        market_id = coin + '-' + self.mm_exchange
+        self.open_orders.pop(market_id, None)
+
+    @try_exc_regular
+    def check_maker_fill(self, exchange: str, coin: str, market: str, ob: dict) -> None:
+        if exchange != self.mm_exchange:
+            return
+        market_id = coin + '-' + self.mm_exchange
+        if not (order := self.open_orders.get(market_id)):
+            return
+        deal = order[1]
+        if deal.side == 'buy' and ob['asks'] and ob['asks'][0][0] <= deal.price:
+            sign = 1
+        elif deal.side == 'sell' and ob['bids'] and ob['bids'][0][0] >= deal.price:
+            sign = -1
+        else:
+            return
+        size_usd = deal.size * deal.price
+        self.deals += 1
+        self.pnl_usd += deal.profit * size_usd
+        self.update_position(exchange, market, sign * deal.size, sign * size_usd)
+        self.open_orders.pop(market_id)
+
+    @try_exc_regular
+    def save_parser_deal(self, deal: dict) -> None:
+        # Parser deals stay dicts (they are rows of the csv)
+        self.execute_taker(SimpleNamespace(**deal))
+
+
+class MarketReplay:
+    # Прогоняет журнал MarketRecorder через финдер как можно быстрее, время финдеров - время записи событий.
+    # finder_type: 'ap' (ArbitrageFinder), 'matrix' (ArbitrageFinderMatrix), 'parse' (ArbitrageFinderParse),
+    # 'mm' (MarketFinder)
+
+    def __init__(self, file_name: str, finder_type='ap', setts=None):
+        self.file_name = file_name
+        self.finder_type = finder_type
+        self.setts = setts if setts is not None else config['SETTINGS']
+        self.clock = SimulatedTime()
+        self.clients_with_names = dict()
+        self.markets = dict()
+        self.bot = None
+        self.finder = None
+        self.latencies = []
+        self.events = 0
+        self.ts_first = None
+
+    @try_exc_regular
+    def get_finder(self):
+        self.bot = ReplayBot(self.clients_with_names, self.setts, self.finder_type == 'mm')
+        if self.finder_type == 'ap':
+            return arbitrage_finder.ArbitrageFinder(self.bot, self.markets, self.clients_with_names,
+                                                    self.bot.profit_open, self.bot.profit_close)
+        if self.finder_type == 'matrix':
+            return arbitrage_finder_matrix.ArbitrageFinderMatrix(self.bot, self.markets, self.clients_with_names,
+                                                                 self.bot.profit_open, self.bot.profit_close)
+        if self.finder_type == 'parse':
+            finder = arbitrage_finder_parse.ArbitrageFinderParse(self.markets, self.clients_with_names,
+                                                                 self.bot.profit_open, self.bot.profit_close)
+            finder.save_deal = self.bot.save_parser_deal
+            return finder
+        if self.finder_type == 'mm':
+            finder = market_maker_counter.MarketFinder(self.markets, self.clients_with_names, self.bot)
+            finder.orders_prints = False
+            return finder
+
+    @try_exc_regular
+    def add_record(self, record_type: str, data: dict) -> None:
+        if record_type == 'exchange':
+            self.clients_with_names[data['exchange']] = ReplayClient(data['exchange'], data['taker_fee'],
+                                                                     data['maker_fee'], data['top_ws_ping'])
+        elif record_type == 'market':
+            client = self.clients_with_names[data['exchange']]
+            client.markets[data['coin']] = data['market']
+            client.instruments[data['market']] = {'tick_size': data['tick_size'], 'step_size': data['step_size'],
+                                                  'min_size': data['min_size']}
+            self.markets.setdefault(data['coin'], dict())[data['exchange']] = data['market']
+
+    @try_exc_async
+    async def run(self) -> dict:
+        real_time = [module.time for module in FINDER_MODULES]
+        for module in FINDER_MODULES:
+            module.time = self.clock
+        try:
+            ts_start = time.perf_counter()
+            for record_type, data in read_journal(self.file_name):
+                if record_type != 'book':
+                    self.add_record(record_type, data)
+                    continue
+                await self.replay_book(data)
+            return self.get_stats(time.perf_counter() - ts_start)
+        finally:
+            for module, module_time in zip(FINDER_MODULES, real_time):
+                module.time = module_time
+
+    async def replay_book(self, event: dict) -> None:
+        if not self.finder:
+            self.finder = self.get_finder()
+        client = self.clients_with_names[event['exchange']]
+        client.orderbook[event['market']] = event['ob']
+        self.clock.now = event['ts']
+        if self.ts_first is None:
+            self.ts_first = event['ts']
+        self.events += 1
+        self.bot.check_maker_fill(event['exchange'], event['coin'], event['market'], event['ob'])
+        if self.finder_type == 'mm':
+            if event['kind'] != 'mm':
+                return
+            ts_start = time.perf_counter()
+            await self.finder.count_one_coin(event['coin'], event['exchange'])
+            self.latencies.append(time.perf_counter() - ts_start)
+            # Maker order tasks created by the finder
+            await asyncio.sleep(0)
+        else:
+            if event['kind'] == 'mm':
+                return
+            side = 'buy' if event['kind'] == 'ap_buy' else 'sell'
+            ts_start = time.perf_counter()
+            await self.finder.count_one_coin(event['coin'], event['exchange'], side, event['trigger_type'])
+            self.latencies.append(time.perf_counter() - ts_start)
+            # Deal tasks created by the matrix finder
+            await asyncio.sleep(0)
+
+    @try_exc_regular
+    def get_stats(self, wall_time: float) -> dict:
+        latencies = sorted(self.latencies)
+        sim_time = self.clock.now - self.ts_first if self.ts_first is not None else 0
+
+        def percentile(part):
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * part))] * 10 ** 6, 2)
+        return {'finder': self.finder_type,
+                'events': self.events,
+                'decisions': len(latencies),
+                'wall_time_sec': round(wall_time, 3),
+                'events_per_sec': round(self.events / wall_time) if wall_time else 0,
+                'simulated_time_sec': round(sim_time, 3),
+                'opportunities': self.bot.opportunities if self.bot else 0,
+                'opportunities_per_sim_sec': round(self.bot.opportunities / sim_time, 4) if sim_time else 0,
+                'deals': self.bot.deals if self.bot else 0,
+                'pnl_usd': round(self.bot.pnl_usd, 4) if self.bot else 0,
+                'latency_avg_us': round(sum(latencies) / len(latencies) * 10 ** 6, 2) if latencies else 0,
+                'latency_p50_us': percentile(0.5) if latencies else 0,
+                'latency_p99_us': percentile(0.99) if latencies else 0}
+
+
+if __name__ == '__main__':
+    # python -m core.market_replay config.ini market_data.bin ap|matrix|parse|mm
+    replay = MarketReplay(sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else 'ap')
+    print(asyncio.run(replay.run()))
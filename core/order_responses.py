@@ -0,0 +1,119 @@
+import asyncio
+import threading
+import time
+from core.wrappers import try_exc_regular, exceptions
+
+
+class ResponsesDict(dict):
+    # Drop-in replacement for client.responses / client.cancel_responses.
+    # Every write from the client wakes up the future waiting for this key.
+
+    def __init__(self, registry, exchange: str, kind: str, data: dict):
+        super().__init__(data)
+        self.registry = registry
+        self.exchange = exchange
+        self.kind = kind
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        if self.registry.notify(self.exchange, self.kind, key, value):
+            # Nobody waits for it anymore
+            super().pop(key, None)
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+
+class OrderResponses:
+    # Реестр ожидания ответов по ордерам вместо поллинга client.responses в цикле со sleep.
+    # На каждый client_id / order_id выдается asyncio.Future, клиент завершает ее записью ответа в словарь.
+    # Ответы могут приходить из потока клиента, поэтому future завершается через call_soon_threadsafe.
+    # Ответы, пришедшие после таймаута, удаляются из словаря клиента.
+    # listeners получают каждый записанный ответ, в том числе поздний (BalanceLedger.on_response).
+
+    def __init__(self, late_ttl=60):
+        self.lock = threading.Lock()
+        self.waiters = dict()  # {(exchange, kind, key): (loop, future)}
+        self.expired = dict()  # {(exchange, kind, key): ts of timeout}
+        self.late_ttl = late_ttl
+        self.late_responses = 0
+        self.listeners = []
+
+    @try_exc_regular
+    def watch(self, client) -> None:
+        exchange = client.EXCHANGE_NAME
+        client.responses = ResponsesDict(self, exchange, 'order', client.responses)
+        client.cancel_responses = ResponsesDict(self, exchange, 'cancel', client.cancel_responses)
+
+    @try_exc_regular
+    def add_listener(self, listener) -> None:
+        # listener(exchange, kind, key, response), called in the thread of the client
+        self.listeners.append(listener)
+
+    @try_exc_regular
+    def notify(self, exchange: str, kind: str, key, response) -> bool:
+        # Returns True if response came after its waiter timed out
+        for listener in self.listeners:
+            listener(exchange, kind, key, response)
+        with self.lock:
+            waiter = self.waiters.pop((exchange, kind, key), None)
+            expired = self.expired.pop((exchange, kind, key), None)
+        if waiter:
+            loop, future = waiter
+            loop.call_soon_threadsafe(self.set_result, future, key, response)
+        elif expired:
+            self.late_responses += 1
+            print(f"LATE {kind.upper()} RESPONSE {exchange} {key} AFTER {round(time.time() - expired, 3)} SEC: {response}")
+            return True
+        return False
+
+    @staticmethod
+    def set_result(future, key, response):
+        if not future.done():
+            future.set_result((key, response))
+
+    async def wait(self, client, keys: list, timeout: float, kind: str = 'order'):
+        # Returns (key, response) for the first of keys which got a response or (None, None) on timeout.
+        # Never raises and never returns None: callers unpack the result right after the order was sent
+        try:
+            return await self.wait_response(client, keys, timeout, kind)
+        except Exception:
+            exceptions.report('OrderResponses.wait')
+            return None, None
+
+    async def wait_response(self, client, keys: list, timeout: float, kind: str):
+        exchange = client.EXCHANGE_NAME
+        responses = client.responses if kind == 'order' else client.cancel_responses
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self.lock:
+            for key in keys:
+                self.waiters[(exchange, kind, key)] = (loop, future)
+        # Response could come before the waiter was registered
+        for key in keys:
+            if (response := responses.get(key)) is not None:
+                self.set_result(future, key, response)
+                break
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            now = time.time()
+            with self.lock:
+                for key in keys:
+                    self.expired[(exchange, kind, key)] = now
+            self.clean_expired(now)
+            return None, None
+        finally:
+            with self.lock:
+                for key in keys:
+                    if waiter := self.waiters.get((exchange, kind, key)):
+                        if waiter[1] is future:
+                            self.waiters.pop((exchange, kind, key))
+
+    @try_exc_regular
+    def clean_expired(self, now: float) -> None:
+        with self.lock:
+            for waiter_key, ts in list(self.expired.items()):
+                if now - ts > self.late_ttl:
+                    self.expired.pop(waiter_key)
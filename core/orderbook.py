@@ -0,0 +1,52 @@
+from core.wrappers import try_exc_hot
+
+
+class OrderBook:
+    # Снимок стакана клиента для финдеров. Строится один раз на апдейт стакана (первое чтение после прихода):
+    # timestamp биржи приведен к float секундам, топ и пинг посчитаны заранее, дальше сравнения идут
+    # по атрибутам без isinstance и поиска по ключам. Уровни (asks, bids) - те же списки, что у клиента.
+    # ts_ms, как и в стакане клиента, - локальное время получения в секундах.
+    __slots__ = ['source', 'asks', 'bids', 'timestamp', 'ts_ms', 'ping', 'top_ask', 'top_bid', 'ask_sz', 'bid_sz',
+                 'valid', 'ask_depth', 'bid_depth']
+
+    def __init__(self, ob: dict):
+        self.source = ob
+        asks = self.asks = ob.get('asks') or []
+        bids = self.bids = ob.get('bids') or []
+        self.ts_ms = ob.get('ts_ms', 0)
+        timestamp = ob.get('timestamp', 0)
+        # Exchanges give seconds as float or milliseconds as int
+        self.timestamp = timestamp if isinstance(timestamp, float) else timestamp / 1000
+        self.ping = self.ts_ms - self.timestamp
+        self.valid = bool(asks and bids)
+        self.top_ask, self.ask_sz = (asks[0][0], asks[0][1]) if asks else (0, 0)
+        self.top_bid, self.bid_sz = (bids[0][0], bids[0][1]) if bids else (0, 0)
+        # (cumulative sizes, cumulative notionals), counted on demand by ArbitrageFinder.get_depth
+        self.ask_depth = None
+        self.bid_depth = None
+
+
+class OrderBookSnapshots:
+    # Общие для всех финдеров снимки: {exchange: {market: OrderBook}}.
+    # Финдер берет словарь биржи один раз (get_exchange_books) и дальше читает стаканы через get_book.
+
+    def __init__(self):
+        self.books = dict()
+
+    def get_exchange_books(self, exchange: str) -> dict:
+        return self.books.setdefault(exchange, dict())
+
+
+snapshots = OrderBookSnapshots()
+
+
+@try_exc_hot
+def get_book(client, books: dict, market: str):
+    # Snapshot is rebuilt when the client has replaced the book or updated it in place (ts_ms has changed)
+    ob = client.get_orderbook(market)
+    if not ob:
+        return None
+    book = books.get(market)
+    if book is None or book.source is not ob or book.ts_ms != ob.get('ts_ms', 0):
+        book = books[market] = OrderBook(ob)
+    return book
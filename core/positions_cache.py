@@ -0,0 +1,34 @@
+from core.wrappers import try_exc_regular
+
+
+class PositionsCache:
+    # Общий кэш позиций по всем биржам. Позиции меняются только на филлах, поэтому финдеры читают
+    # self.positions напрямую (без копирования), а бот вызывает update() на каждом филле: тейкер сделки,
+    # мейкер филл в hedge_maker_position и ответы по ордерам в BalanceLedger.on_response; update_all() - в фоне.
+    # Клиенты update() не вызывают. version растет на каждое обновление - по нему можно понять,
+    # что позиции поменялись с прошлого чтения.
+
+    def __init__(self, clients_with_names):
+        self.clients_with_names = clients_with_names
+        self.positions = {x: dict() for x in clients_with_names.keys()}
+        # {exchange: {market: {'amount': , 'entry_price': , 'unrealized_pnl_usd': , 'side': ,
+        #                      'amount_usd': , 'realized_pnl_usd': }}}
+        self.version = 0
+
+    @try_exc_regular
+    def update(self, exchange: str, positions: dict = None) -> int:
+        if positions is None:
+            positions = self.clients_with_names[exchange].get_positions()
+        self.positions[exchange] = positions
+        self.version += 1
+        return self.version
+
+    @try_exc_regular
+    def update_all(self) -> int:
+        for exchange, client in self.clients_with_names.items():
+            self.positions[exchange] = client.get_positions()
+        self.version += 1
+        return self.version
+
+    def get_position(self, exchange: str, market: str):
+        return self.positions[exchange].get(market)
@@ -0,0 +1,148 @@
+import json
+import os
+import shutil
+import time
+from datetime import datetime
+import numpy as np
+from core.wrappers import try_exc_regular
+
+
+class ProfitRanges:
+    # Частоты профитов по направлениям B:{exch_buy}|S:{exch_sell}|C:{coin} в виде гистограмм с фиксированными
+    # бинами шириной 10 ** -precise. Одна строка массива на направление, массив лежит в memmap файле,
+    # поэтому запись сэмпла - это инкремент ячейки, а сохранение на диск делает ОС.
+    # Имена направлений -> номер строки хранятся рядом в json, он переписывается только при новом направлении.
+
+    def __init__(self, file_name='ranges', precise=4, max_profit=0.05, capacity=1024):
+        self.file_name = file_name
+        self.bin_width = 10 ** -precise
+        self.max_profit = max_profit
+        self.bins_amount = int(round(2 * max_profit / self.bin_width)) + 1
+        # profit of every bin, ascending
+        self.bins = np.round(np.linspace(-max_profit, max_profit, self.bins_amount), precise)
+        self.data_path = file_name + '.bin'
+        self.index_path = file_name + '_index.json'
+        self.index = self.unpack_index()
+        self.directions = self.index['directions']
+        capacity = max(capacity, len(self.directions))
+        self.counts = self.open_counts(capacity)
+
+    @try_exc_regular
+    def unpack_index(self) -> dict:
+        if os.path.exists(self.index_path) and os.path.exists(self.data_path):
+            with open(self.index_path, 'r') as file:
+                index = json.load(file)
+            if index.get('bins_amount') == self.bins_amount:
+                return index
+        now = time.time()
+        return {'timestamp_start': now, 'bins_amount': self.bins_amount, 'directions': dict()}
+
+    @try_exc_regular
+    def save_index(self) -> None:
+        with open(self.index_path, 'w') as file:
+            json.dump(self.index, file)
+
+    @try_exc_regular
+    def open_counts(self, capacity: int) -> np.memmap:
+        old = None
+        if os.path.exists(self.data_path) and self.directions:
+            old = np.memmap(self.data_path, dtype=np.int64, mode='r')
+            old_rows = old.size // self.bins_amount
+            if old_rows >= capacity:
+                del old
+                return np.memmap(self.data_path, dtype=np.int64, mode='r+', shape=(old_rows, self.bins_amount))
+            old = np.array(old.reshape(old_rows, self.bins_amount))
+        counts = np.memmap(self.data_path, dtype=np.int64, mode='w+', shape=(capacity, self.bins_amount))
+        if old is not None:
+            counts[:len(old)] = old
+        self.save_index()
+        return counts
+
+    @try_exc_regular
+    def get_row(self, name: str) -> int:
+        row = self.directions.get(name)
+        if row is None:
+            row = len(self.directions)
+            if row >= self.counts.shape[0]:
+                self.counts.flush()
+                self.counts = self.open_counts(self.counts.shape[0] * 2)
+            self.directions[name] = row
+            self.save_index()
+        return row
+
+    def append_profit(self, profit: float, name: str) -> None:
+        idx = int(round((profit + self.max_profit) / self.bin_width))
+        if idx < 0:
+            idx = 0
+        elif idx >= self.bins_amount:
+            idx = self.bins_amount - 1
+        row = self.get_row(name)
+        self.counts[row, idx] += 1
+
+    @try_exc_regular
+    def hours_collected(self, now: float) -> float:
+        return (now - self.index['timestamp_start']) / 3600
+
+    @try_exc_regular
+    def rollover(self, now: float) -> None:
+        # Day is over: keep a dated copy of the ranges and start counting from zero
+        self.counts.flush()
+        date = str(datetime.now()).split(" ")[0]
+        shutil.copy(self.data_path, f'{self.file_name}{date}.bin')
+        shutil.copy(self.index_path, f'{self.file_name}{date}_index.json')
+        self.counts[:] = 0
+        self.index.update({'timestamp_start': now})
+        self.save_index()
+
+    @try_exc_regular
+    def get_direction_range(self, name: str):
+        # Profits of non-empty bins in descending order with their frequencies and cumulative frequencies
+        row = self.counts[self.directions[name]][::-1]
+        nonzero = np.nonzero(row)[0]
+        freqs = row[nonzero]
+        return self.bins[::-1][nonzero], freqs, np.cumsum(freqs)
+
+    @try_exc_regular
+    def get_target_profits(self, exchanges, get_fees) -> dict:
+        # Target profit of direction is the lowest profit P1 for which there is a reversed direction profit P2
+        # on the same position of sorted ranges with P1 + P2 >= 2 * fees. Frequencies of both directions are
+        # then equalized: the side with > 100 and > 2x of the other side samples is cut down to the lower profits.
+        target_profits = dict()
+        for direction in self.directions.keys():
+            exchange_1 = direction.split(':')[1].split('|')[0]
+            exchange_2 = direction.split(':')[2].split('|')[0]
+            coin = direction.split(':')[-1]
+            reversed_direction = f"B:{exchange_2}|S:{exchange_1}|C:{coin}"
+            if reversed_direction not in self.directions:
+                continue
+            if exchange_1 not in exchanges or exchange_2 not in exchanges:
+                continue
+            fees = get_fees(exchange_1, exchange_2)
+            profits_1, freqs_1, cum_1 = self.get_direction_range(direction)
+            profits_2, freqs_2, cum_2 = self.get_direction_range(reversed_direction)
+            length = min(len(profits_1), len(profits_2))
+            if not length:
+                continue
+            fails = np.nonzero(profits_1[:length] + profits_2[:length] - 2 * fees < 0)[0]
+            i = fails[0] if len(fails) else length
+            if not i:
+                continue
+            sum_freq_1 = cum_1[i - 1]
+            sum_freq_2 = cum_2[i - 1]
+            m_1 = i
+            if sum_freq_1 > 100 and sum_freq_1 > 2 * sum_freq_2:
+                m_1 = max(1, int(np.searchsorted(cum_1[:i], max(100, 2 * sum_freq_2), side='right')))
+                sum_freq_1 = cum_1[m_1 - 1]
+            m_2 = i
+            if sum_freq_2 > 100 and sum_freq_2 > 2 * sum_freq_1:
+                m_2 = max(1, int(np.searchsorted(cum_2[:i], max(100, 2 * sum_freq_1), side='right')))
+                sum_freq_2 = cum_2[m_2 - 1]
+            profit_1 = float(profits_1[m_1 - 1])
+            profit_2 = float(profits_2[m_2 - 1])
+            # print(F"TARGET PROFIT {direction}:", profit_1, sum_freq_1, f"{sum_freq_1 / cum_1[-1] * 100} %")
+            # print(F"TARGET PROFIT REVERSED {reversed_direction}:", profit_2, sum_freq_2,
+            #       f"{sum_freq_2 / cum_2[-1] * 100} %")
+            ### Defining of target profit including exchange fees
+            target_profits.update({direction: profit_1 - fees,
+                                   reversed_direction: profit_2 - fees})
+        return target_profits
@@ -0,0 +1,122 @@
+import asyncio
+import threading
+import time
+from core.wrappers import try_exc_regular, try_exc_async
+
+
+class QuoteEngine:
+    # Запросы мейкер ордеров (new/amend/delete) от MarketFinder.process_parse_results -> MultiBot.*_maker_order.
+    # На рынок (coin-exchange) не больше одного запроса в полете (in_progress, он же MultiBot.requests_in_progress)
+    # и один слот последней желаемой котировки. Решения, пришедшие пока запрос в полете, не выкидываются,
+    # а перезаписывают слот: после ответа уходит только самая свежая цель, промежуточные считаются coalesced.
+    # Цель из слота сверяется с open_orders на момент отправки - ордер мог быть создан, удален или заменен
+    # запросом, который был в полете. В режиме лесенки цель - LadderQuotes монеты ('Ladder'),
+    # разница с индексом MakerLadder считается тоже в момент отправки.
+    # in_progress пишет только движок (под lock), MultiBot его только читает. Хедж мейкер филла
+    # ставит рынок в hedging: пока хедж не отправлен, новые цели рынка отбрасываются.
+
+    def __init__(self, multibot, pending_ttl=1.0):
+        self.multibot = multibot
+        self.pending_ttl = pending_ttl
+        self.in_progress = dict()  # {market_id: 'New order' / 'Amend' / 'Delete' / False}
+        self.pending = dict()  # {market_id: (coin, action, MakerQuote / LadderQuotes or None for delete)}
+        self.hedging = set()  # market_ids with a maker fill being hedged
+        self.lock = threading.Lock()
+        self.submitted = 0
+        self.sent = 0
+        self.coalesced = 0
+        self.expired = 0
+        self.skipped = 0
+        self.time_stats = time.time()
+
+    @try_exc_regular
+    def submit(self, market_id: str, coin: str, action: str, quote=None, order_id=None) -> None:
+        # action: 'New order', 'Amend' (quote and order_id), 'Delete' (order_id), 'Ladder' (LadderQuotes)
+        with self.lock:
+            self.submitted += 1
+            if market_id in self.hedging:
+                # Positions are changing: the next finder's pass gives a fresh target
+                self.skipped += 1
+                return
+            if self.in_progress.get(market_id):
+                if market_id in self.pending:
+                    self.coalesced += 1
+                self.pending[market_id] = (coin, action, None if action == 'Delete' else quote)
+                return
+            self.in_progress[market_id] = action
+            # A target left from before is older than this one
+            self.pending.pop(market_id, None)
+        asyncio.get_event_loop().create_task(self.run_request(market_id, coin, action, quote, order_id))
+
+    @try_exc_regular
+    def set_hedging(self, market_id: str, hedging: bool) -> None:
+        with self.lock:
+            if hedging:
+                self.hedging.add(market_id)
+            else:
+                self.hedging.discard(market_id)
+
+    @try_exc_regular
+    def keep(self, market_id: str) -> bool:
+        # Active order is still good: a waiting target is outdated. False if a request is in flight
+        with self.lock:
+            if self.pending.pop(market_id, None):
+                self.coalesced += 1
+            return not self.in_progress.get(market_id)
+
+    @try_exc_async
+    async def run_request(self, market_id: str, coin: str, action: str, quote, order_id):
+        while action:
+            self.sent += 1
+            if action == 'New order':
+                await self.multibot.new_maker_order(quote, coin)
+            elif action == 'Amend':
+                await self.multibot.amend_maker_order(quote, coin, order_id)
+            elif action == 'Ladder':
+                await self.multibot.update_maker_ladder(quote, coin)
+            else:
+                await self.multibot.delete_maker_order(coin, order_id)
+            action, coin, quote, order_id = self.next_request(market_id)
+        self.print_stats()
+
+    @try_exc_regular
+    def next_request(self, market_id: str) -> tuple:
+        # The market stays in progress if the slot holds a target, otherwise it is released
+        with self.lock:
+            coin, action, quote = self.pending.pop(market_id, (None, None, None))
+            order_id = None
+            if coin:
+                if quote and time.time() - quote.last_update > self.pending_ttl:
+                    # The next finder's pass gives a fresh target
+                    self.expired += 1
+                    action = None
+                elif action != 'Ladder':
+                    action, order_id = self.resolve(market_id, quote)
+            self.in_progress[market_id] = action or False
+        return action, coin, quote, order_id
+
+    @try_exc_regular
+    def resolve(self, market_id: str, quote) -> tuple:
+        if active := self.multibot.open_orders.get(market_id):
+            if not quote or quote.side != active[1].side:
+                # Side change goes through delete, the new side is placed by the next finder's pass
+                return 'Delete', active[0]
+            return 'Amend', active[0]
+        if quote:
+            return 'New order', None
+        return None, None
+
+    @try_exc_regular
+    def get_stats(self) -> dict:
+        return {'submitted': self.submitted,
+                'sent': self.sent,
+                'coalesced': self.coalesced,
+                'expired': self.expired,
+                'skipped': self.skipped,
+                'pending': len(self.pending)}
+
+    @try_exc_regular
+    def print_stats(self) -> None:
+        if time.time() - self.time_stats > 60:
+            print(f"QUOTE ENGINE STATS: {self.get_stats()}")
+            self.time_stats = time.time()
@@ -1,5 +1,8 @@
 import asyncio
-import queue
+import os
+import threading
+import time
+from collections import deque
 from aio_pika import connect_robust, ExchangeType, Message
 from orjson import orjson
 from core.enums import RabbitMqQueues
@@ -14,13 +17,46 @@ from core.wrappers import try_exc_regular, try_exc_async
 
 
 class Rabbit:
+    # Одно долгоживущее соединение и пул каналов с publisher confirms.
+    # Exchange/queue/bind объявляются один раз на имя (exchange объект кэшируется на канал),
+    # сообщения публикуются пачками: все publish пачки уходят сразу, подтверждения ждутся вместе.
+    # add_task_to_queue только кладет задачу в ограниченный буфер и будит drain таск, который постоянно
+    # отправляет буфер в брокер. Если буфер полон (брокер лежит) - задачи дописываются в spill файл на диске,
+    # который переотправляется, когда брокер снова доступен.
+    # Частые строки одного типа (обновления ордеров) идут через add_batch_row: копятся по очереди и уходят
+    # одним сообщением {'rows': [...], 'count': n, 'ts': ...}, когда набралось batch_max_rows строк
+    # или первой строке больше batch_max_delay секунд. Консьюмер такой очереди делает bulk upsert всех rows.
+    channels_amount = 2
+    batch_size = 100
+    max_buffer = 10000
+    spill_path = 'rabbit_spill.jsonl'
+    batch_max_rows = 500
+    batch_max_delay = 2
+
     def __init__(self, loop):
         self.telegram = Telegram()
         rabbit = config['RABBIT']
         self.rabbit_url = f"amqp://{rabbit['USERNAME']}:{rabbit['PASSWORD']}@{rabbit['HOST']}:{rabbit['PORT']}/"
         self.mq = None
-        self.tasks = queue.Queue() # точно ли здесь нужны очереди? Чтение из нее происходит в один поток, можно List + Append.
+        self.tasks = deque()  # [(ts added, task)], append/popleft are thread safe
         self.loop = loop
+        self.wake = asyncio.Event()
+        self.drain_task = None
+        self.spill_file = None
+        self.spill_lock = threading.Lock()  # spill() runs in clients' threads, replay and close - in the loop
+        self.spilled = 0
+        self.replayed = 0
+        self.drain_latencies = []
+        self.time_stats = time.time()
+        self.channels = []
+        self.exchanges = []  # [{exchange_name: exchange}] for every channel of the pool
+        self.declared_queues = set()  # (exchange_name, queue_name, routing_key)
+        self.channel_idx = 0
+        self.published = 0
+        self.batches = dict()  # {queue_name: [ts of the first row, rows]}
+        self.batches_lock = threading.Lock()
+        self.batched_rows = 0
+        self.enabled = True
 
     @staticmethod
     @try_exc_regular
@@ -34,6 +70,8 @@ class Rabbit:
 
     @try_exc_regular
     def add_task_to_queue(self, message, queue_name):
+        if not self.enabled:
+            return
         if hasattr(RabbitMqQueues, queue_name):
             event_name = getattr(RabbitMqQueues, queue_name)
             task = {
@@ -42,46 +80,239 @@ class Rabbit:
                 'exchange_name': self.get_exchange_name(event_name),
                 'queue_name': event_name
             }
-            self.tasks.put(task)
+            if len(self.tasks) >= self.max_buffer:
+                self.spill([task])
+            else:
+                self.tasks.append((time.time(), task))
+                self.wake_up()
         else:
             print(f"Method '{queue_name}' not found in RabbitMqQueues class")
             self.telegram.send_message(f"Method '{queue_name}' not found in RabbitMqQueues class", TG_Groups.Alerts)
 
+    @try_exc_regular
+    def add_batch_row(self, row, queue_name):
+        if not self.enabled:
+            return
+        with self.batches_lock:
+            if not (batch := self.batches.get(queue_name)):
+                batch = self.batches[queue_name] = [time.time(), []]
+            batch[1].append(row)
+            if len(batch[1]) < self.batch_max_rows:
+                return
+            self.batches.pop(queue_name)
+        self.flush_batch(queue_name, batch[1])
+
+    @try_exc_regular
+    def flush_batch(self, queue_name, rows: list) -> None:
+        self.batched_rows += len(rows)
+        self.add_task_to_queue({'rows': rows, 'count': len(rows), 'ts': time.time()}, queue_name)
+
+    @try_exc_regular
+    def flush_batches(self, force: bool = False) -> None:
+        # Called by the drain task, force - on close
+        now = time.time()
+        with self.batches_lock:
+            ready = [x for x, y in self.batches.items() if force or now - y[0] >= self.batch_max_delay]
+            ready = [(x, self.batches.pop(x)[1]) for x in ready]
+        for queue_name, rows in ready:
+            self.flush_batch(queue_name, rows)
+
     @try_exc_async
     async def setup_mq(self) -> None:
+        # Connects only once, robust connection restores itself and its channels after failures
+        if self.mq and not self.mq.is_closed:
+            return
         self.mq = await connect_robust(self.rabbit_url, loop=self.loop)
+        self.reset_channels()
         # print(f"SETUP MQ DONE")
 
+    @try_exc_regular
+    def reset_channels(self) -> None:
+        self.channels = []
+        self.exchanges = []
+        self.declared_queues = set()
+
     @try_exc_async
-    async def send_messages(self):
-        while self.tasks.qsize():
-            task = self.tasks.get()
-            # print('TASK TO MQ:\n\n',task)
-            # self.telegram.send_message('TASK TO MQ:\n\n' + str(task), TG_Groups.DebugDima)
-            await self.publish_message(**task)
-        # self.tasks.task_done()
-        # await asyncio.sleep(0.1)
+    async def get_channel(self):
+        # Round robin over the pool, closed channels are reopened
+        if not self.channels:
+            self.channels = [None] * self.channels_amount
+            self.exchanges = [dict() for _ in range(self.channels_amount)]
+        idx = self.channel_idx
+        self.channel_idx = (self.channel_idx + 1) % self.channels_amount
+        channel = self.channels[idx]
+        if not channel or channel.is_closed:
+            channel = await self.mq.channel(publisher_confirms=True)
+            self.channels[idx] = channel
+            self.exchanges[idx] = dict()
+        return idx, channel
 
     @try_exc_async
-    async def publish_message(self, message, routing_key, exchange_name, queue_name):
-        try:
-            channel = await self.mq.channel()
+    async def get_exchange(self, idx: int, channel, exchange_name: str, queue_name: str, routing_key: str):
+        if not (exchange := self.exchanges[idx].get(exchange_name)):
             exchange = await channel.declare_exchange(exchange_name, type=ExchangeType.DIRECT, durable=True)
+            self.exchanges[idx][exchange_name] = exchange
+        if (exchange_name, queue_name, routing_key) not in self.declared_queues:
             # Точно ли нужны следующие 2 строчки, как будто эти привязки уже прописаны и так в Rabbit MQ?
             queue = await channel.declare_queue(queue_name, durable=True)
             await queue.bind(exchange, routing_key=routing_key)
-            message_body = orjson.dumps(message)
-            message = Message(message_body)
-            await exchange.publish(message, routing_key=routing_key)
-            await channel.close()
+            self.declared_queues.add((exchange_name, queue_name, routing_key))
+        return exchange
+
+    @try_exc_regular
+    def wake_up(self) -> None:
+        if self.wake.is_set():
+            return
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is self.loop:
+            self.wake.set()
+        else:
+            # Called from a client thread
+            self.loop.call_soon_threadsafe(self.wake.set)
+
+    @try_exc_regular
+    def spill(self, tasks: list) -> None:
+        lines = b''.join([orjson.dumps(task) + b'\n' for task in tasks])
+        with self.spill_lock:
+            if not self.spill_file:
+                self.spill_file = open(self.spill_path, 'ab')
+            self.spill_file.write(lines)
+            self.spill_file.flush()
+            self.spilled += len(tasks)
+
+    @try_exc_regular
+    def start_drain(self) -> None:
+        if not self.enabled:
+            return
+        if not self.drain_task or self.drain_task.done():
+            self.drain_task = self.loop.create_task(self.run_drain())
+
+    @try_exc_async
+    async def run_drain(self):
+        # Continuous drain of the buffer
+        await self.setup_mq()
+        await self.replay_spill()
+        while True:
+            try:
+                await asyncio.wait_for(self.wake.wait(), min(1, self.batch_max_delay))
+            except asyncio.TimeoutError:
+                pass
+            self.wake.clear()
+            self.flush_batches()
+            if await self.send_messages():
+                await self.replay_spill()
+            else:
+                # Broker is down, buffer keeps filling and spills to disk when full
+                await asyncio.sleep(5)
+            self.print_stats()
+
+    @try_exc_async
+    async def send_messages(self) -> bool:
+        await self.setup_mq()
+        while self.tasks:
+            batch = []
+            while self.tasks and len(batch) < self.batch_size:
+                batch.append(self.tasks.popleft())
+            # print('TASK TO MQ:\n\n',task)
+            # self.telegram.send_message('TASK TO MQ:\n\n' + str(task), TG_Groups.DebugDima)
+            if not await self.publish_batch([task for _, task in batch]):
+                # Messages are not lost: they go back to the buffer and are sent after reconnect
+                print(f"RABBIT PUBLISH FAILED. {len(batch)} MESSAGES RETURNED TO BUFFER")
+                self.tasks.extendleft(reversed(batch))
+                self.reset_channels()
+                return False
+            now = time.time()
+            self.drain_latencies.extend([now - ts for ts, _ in batch])
+            await asyncio.sleep(0)
+        return True
+
+    @try_exc_async
+    async def replay_spill(self) -> None:
+        # Spill file is moved aside, so new spills during the replay go to a fresh file
+        replay_path = self.spill_path + '.replay'
+        if not os.path.exists(replay_path):
+            with self.spill_lock:
+                if not os.path.exists(self.spill_path) or not os.path.getsize(self.spill_path):
+                    return
+                if self.spill_file:
+                    self.spill_file.close()
+                    self.spill_file = None
+                os.replace(self.spill_path, replay_path)
+        with open(replay_path, 'rb') as file:
+            tasks = [orjson.loads(line) for line in file if line.strip()]
+        print(f"RABBIT REPLAY OF {len(tasks)} SPILLED MESSAGES")
+        for i in range(0, len(tasks), self.batch_size):
+            batch = tasks[i:i + self.batch_size]
+            if not await self.publish_batch(batch):
+                self.spill(tasks[i:])
+                self.reset_channels()
+                break
+            self.replayed += len(batch)
+            await asyncio.sleep(0)
+        os.remove(replay_path)
+
+    @try_exc_regular
+    def get_stats(self) -> dict:
+        latencies = sorted(self.drain_latencies)
+        return {'queue_depth': len(self.tasks),
+                'published': self.published,
+                'spilled': self.spilled,
+                'replayed': self.replayed,
+                'batched_rows': self.batched_rows,
+                'drain_latency_avg': round(sum(latencies) / len(latencies), 4) if latencies else 0,
+                'drain_latency_max': round(latencies[-1], 4) if latencies else 0}
+
+    @try_exc_regular
+    def print_stats(self) -> None:
+        if time.time() - self.time_stats > 60:
+            print(f"RABBIT STATS: {self.get_stats()}")
+            self.time_stats = time.time()
+            self.drain_latencies = []
+
+    @try_exc_async
+    async def publish_batch(self, batch: list) -> bool:
+        try:
+            idx, channel = await self.get_channel()
+            confirmations = []
+            for task in batch:
+                exchange = await self.get_exchange(idx, channel, task['exchange_name'],
+                                                   task['queue_name'], task['routing_key'])
+                message = Message(orjson.dumps(task['message']))
+                confirmations.append(exchange.publish(message, routing_key=task['routing_key']))
+            await asyncio.gather(*confirmations)
+            self.published += len(batch)
             return True
         except aiormq.exceptions.AMQPConnectionError as e:
-            await asyncio.sleep(1)  # Wait for 5 seconds before retrying
-            await self.setup_mq()
-            await self.publish_message(message, routing_key, exchange_name, queue_name)
+            print(f"RABBIT CONNECTION ERROR: {e}")
+            await asyncio.sleep(1)
+            return False
+
+    @try_exc_async
+    async def publish_message(self, message, routing_key, exchange_name, queue_name):
+        return await self.publish_batch([{'message': message,
+                                          'routing_key': routing_key,
+                                          'exchange_name': exchange_name,
+                                          'queue_name': queue_name}])
+
+    @try_exc_async
+    async def close(self) -> None:
+        self.flush_batches(force=True)
+        if self.tasks and self.mq and not self.mq.is_closed:
+            await self.send_messages()
+        for channel in self.channels:
+            if channel and not channel.is_closed:
+                await channel.close()
+        self.reset_channels()
+        if self.mq and not self.mq.is_closed:
+            await self.mq.close()
+        with self.spill_lock:
+            if self.spill_file:
+                self.spill_file.close()
+                self.spill_file = None
 
 
 if __name__ == '__main__':
     pass
-
-
@@ -0,0 +1,395 @@
+import asyncio
+import math
+import random
+import threading
+import time
+import uuid
+from clients.core.enums import OrderStatus
+from core.market_recorder import read_journal
+from core.wrappers import try_exc_regular, try_exc_async
+
+
+class SimReference:
+    # Общая для всех симулированных бирж "справедливая" цена монеты: случайное блуждание по времени.
+    # Цена каждой биржи = reference * (1 + собственный шум), так между биржами появляются арбитражи.
+
+    def __init__(self, volatility=0.0005):
+        self.volatility = volatility  # relative std per second
+        self.prices = dict()  # {coin: [price, ts]}
+        self.last_ticks = dict()  # {coin: ts of last orderbook update on any sim exchange}
+        self.lock = threading.Lock()
+
+    def get_price(self, coin: str, now: float) -> float:
+        with self.lock:
+            if not (price := self.prices.get(coin)):
+                price = self.prices[coin] = [random.uniform(1, 1000), now]
+            elapsed = now - price[1]
+            if elapsed > 0:
+                price[0] *= math.exp(random.gauss(0, self.volatility * math.sqrt(elapsed)))
+                price[1] = now
+            return price[0]
+
+
+reference = SimReference()
+
+
+class SimExchangeClient:
+    # In-process биржа с контрактом клиента из README: стаканы (синтетические или из журнала MarketRecorder),
+    # тейкер ордера матчатся по стакану с частичными исполнениями и реджектами, мейкер ордера из async_tasks
+    # стоят в книге и исполняются при пересечении цены, задержки ордеров и вебсокета - лог-нормальные.
+    # Настройки берутся из секции биржи в конфиге, если она есть.
+
+    def __init__(self, multibot=None, keys=None, leverage=2, max_pos_part=20, ob_len=4, markets_list=None,
+                 exchange_name='SIM'):
+        keys = keys or dict()
+        self.multibot = multibot
+        self.EXCHANGE_NAME = keys.get('EXCHANGE_NAME', exchange_name)
+        self.leverage = leverage
+        self.max_pos_part = max_pos_part
+        self.ob_len = max(ob_len, 1)
+        self.taker_fee = float(keys.get('TAKER_FEE', 0.0005))
+        self.maker_fee = float(keys.get('MAKER_FEE', 0.0001))
+        self.top_ws_ping = float(keys.get('TOP_WS_PING', 0.1))
+        self.order_latency = float(keys.get('ORDER_LATENCY_MS', 20)) / 1000  # median
+        self.ws_latency = float(keys.get('WS_LATENCY_MS', 5)) / 1000  # median
+        self.latency_sigma = float(keys.get('LATENCY_SIGMA', 0.5))
+        self.reject_rate = float(keys.get('REJECT_RATE', 0.01))
+        self.partial_fill_rate = float(keys.get('PARTIAL_FILL_RATE', 0.1))
+        self.ob_updates_per_sec = float(keys.get('OB_UPDATES_PER_SEC', 20))
+        self.spread = float(keys.get('SPREAD', 0.0004))
+        self.price_noise = float(keys.get('PRICE_NOISE', 0.001))
+        self.balance = float(keys.get('BALANCE', 10000))
+        self.journal_events = []
+        coins = keys.get('COINS', 'BTC,ETH,SOL').split(',')
+        self.markets = {coin: f'{coin}-USD' for coin in coins}
+        self.markets_list = markets_list or []
+        self.instruments = {market: {'tick_size': 0.0001, 'step_size': 0.001, 'min_size': 0.001}
+                            for market in self.markets.values()}
+        if journal := keys.get('JOURNAL'):
+            self.load_journal(journal)
+        self.orderbook = dict()
+        self.public_trades = dict()
+        self.positions = dict()
+        self.responses = dict()
+        self.cancel_responses = dict()
+        self.orders = dict()
+        self.resting_orders = dict()  # {exchange_order_id: order}
+        self.async_tasks = []
+        self.error_info = None
+        self.finder = None
+        self.market_finder = None
+        self.order_loop = asyncio.new_event_loop()
+        self.stats = {'ob_updates': 0, 'orders': 0, 'rejects': 0, 'partial_fills': 0, 'maker_fills': 0}
+        self.tick_to_trade = []
+        self.order_latencies = []
+        self.time_stats = time.time()
+
+    @try_exc_regular
+    def load_journal(self, file_name: str) -> None:
+        # Books of this exchange from the MarketRecorder journal, played with recorded pauses between them
+        self.journal_events = []
+        markets = dict()
+        for record_type, data in read_journal(file_name):
+            if data['exchange'] != self.EXCHANGE_NAME:
+                continue
+            if record_type == 'market':
+                markets[data['coin']] = data['market']
+                self.instruments[data['market']] = {'tick_size': data['tick_size'], 'step_size': data['step_size'],
+                                                    'min_size': data['min_size']}
+            elif record_type == 'exchange':
+                self.taker_fee = data['taker_fee']
+                self.maker_fee = data['maker_fee']
+            elif record_type == 'book':
+                self.journal_events.append(data)
+        if markets:
+            self.markets = markets
+
+    def get_latency(self, median: float) -> float:
+        return random.lognormvariate(math.log(median), self.latency_sigma) if median > 0 else 0
+
+    @try_exc_regular
+    def get_markets(self) -> dict:
+        return self.markets
+
+    def get_orderbook(self, market) -> dict:
+        return self.orderbook.get(market, {})
+
+    def get_orderbook_by_symbol_reg(self, market) -> dict:
+        return self.get_orderbook(market)
+
+    @try_exc_regular
+    def get_all_tops(self) -> dict:
+        tops = dict()
+        for coin, market in self.markets.items():
+            if (ob := self.orderbook.get(market)) and ob['asks'] and ob['bids']:
+                tops[self.EXCHANGE_NAME + '__' + coin] = {'top_bid': ob['bids'][0][0], 'top_ask': ob['asks'][0][0],
+                                                          'bid_vol': ob['bids'][0][1], 'ask_vol': ob['asks'][0][1],
+                                                          'ts_exchange': ob['timestamp']}
+        return tops
+
+    @try_exc_regular
+    def fit_sizes(self, price: float, size: float, market: str):
+        instrument = self.instruments[market]
+        tick = instrument['tick_size']
+        step = instrument['step_size']
+        price = round(round(price / tick) * tick, 10)
+        size = round(math.floor(size / step + 1e-9) * step, 10)
+        return price, size
+
+    @try_exc_regular
+    def get_balance(self) -> float:
+        return self.balance
+
+    @try_exc_regular
+    def get_positions(self) -> dict:
+        return self.positions
+
+    @try_exc_regular
+    def get_available_balance(self) -> dict:
+        total_pos_usd = sum([x['amount_usd'] for x in self.positions.values()])
+        return {'buy': self.balance * self.leverage - total_pos_usd,
+                'sell': self.balance * self.leverage + total_pos_usd}
+
+    @try_exc_regular
+    def get_thb_rate(self) -> float:
+        return 1
+
+    @try_exc_regular
+    def run_updater(self) -> None:
+        threading.Thread(target=self.run_loop, daemon=True).start()
+
+    def run_loop(self) -> None:
+        asyncio.set_event_loop(self.order_loop)
+        self.order_loop.create_task(self.process_async_tasks())
+        if self.journal_events:
+            self.order_loop.create_task(self.replay_books())
+        else:
+            self.order_loop.create_task(self.generate_books())
+        self.order_loop.run_forever()
+
+    @try_exc_regular
+    def get_synthetic_book(self, coin: str, now: float) -> dict:
+        mid = reference.get_price(coin, now) * (1 + random.gauss(0, self.price_noise))
+        tick = self.instruments[self.markets[coin]]['tick_size']
+        half_spread = max(mid * self.spread / 2, tick)
+        asks = []
+        bids = []
+        for level in range(self.ob_len):
+            size = round(random.uniform(0.5, 5) * (level + 1) * 100 / mid, 6)
+            asks.append([round(mid + half_spread + level * 2 * tick, 10), size])
+            bids.append([round(mid - half_spread - level * 2 * tick, 10), size])
+        return {'asks': asks, 'bids': bids}
+
+    @try_exc_async
+    async def generate_books(self):
+        coins = [x for x in self.markets.keys() if not self.markets_list or x in self.markets_list]
+        while True:
+            await asyncio.sleep(random.expovariate(self.ob_updates_per_sec))
+            coin = random.choice(coins)
+            now = time.time()
+            ob = self.get_synthetic_book(coin, now)
+            await self.update_orderbook(coin, ob['asks'], ob['bids'], now - self.get_latency(self.ws_latency))
+
+    @try_exc_async
+    async def replay_books(self):
+        ts_previous = None
+        for event in self.journal_events:
+            if ts_previous is not None:
+                await asyncio.sleep(max(0, event['ts'] - ts_previous))
+            ts_previous = event['ts']
+            ob = event['ob']
+            await self.update_orderbook(event['coin'], [x[:] for x in ob['asks']], [x[:] for x in ob['bids']],
+                                        time.time() - self.get_latency(self.ws_latency))
+
+    @try_exc_async
+    async def update_orderbook(self, coin: str, asks: list, bids: list, timestamp: float):
+        market = self.markets[coin]
+        now = time.time()
+        old_ob = self.orderbook.get(market)
+        self.orderbook[market] = {'asks': asks, 'bids': bids, 'timestamp': timestamp, 'ts_ms': now}
+        self.stats['ob_updates'] += 1
+        reference.last_ticks[coin] = now
+        self.check_resting_orders(coin, market)
+        if self.market_finder:
+            await self.market_finder.count_one_coin(coin, self.EXCHANGE_NAME)
+        if self.finder:
+            if not old_ob or not old_ob['asks'] or asks[0][0] != old_ob['asks'][0][0]:
+                await self.finder.count_one_coin(coin, self.EXCHANGE_NAME, 'buy', 'ob')
+            if not old_ob or not old_ob['bids'] or bids[0][0] != old_ob['bids'][0][0]:
+                await self.finder.count_one_coin(coin, self.EXCHANGE_NAME, 'sell', 'ob')
+        self.print_stats()
+
+    @try_exc_regular
+    def match(self, market: str, side: str, price: float, size: float):
+        # Walks the opposite side up to the limit price and takes liquidity out of the book
+        levels = self.orderbook.get(market, {}).get('asks' if side == 'buy' else 'bids', [])
+        filled = 0
+        notional = 0
+        while levels and filled < size:
+            level_px, level_sz = levels[0][0], levels[0][1]
+            if (side == 'buy' and level_px > price) or (side == 'sell' and level_px < price):
+                break
+            take = min(level_sz, size - filled)
+            filled += take
+            notional += take * level_px
+            if take >= level_sz:
+                levels.pop(0)
+            else:
+                levels[0][1] = level_sz - take
+        return filled, notional / filled if filled else 0
+
+    @try_exc_regular
+    def update_position(self, market: str, side: str, size: float, price: float, fee: float) -> None:
+        sign = 1 if side == 'buy' else -1
+        position = self.positions.setdefault(market, {'amount': 0, 'entry_price': price, 'unrealized_pnl_usd': 0,
+                                                      'side': 'LONG', 'amount_usd': 0, 'realized_pnl_usd': 0})
+        position['amount'] += sign * size
+        position['amount_usd'] = position['amount'] * price
+        position['side'] = 'LONG' if position['amount'] >= 0 else 'SHORT'
+        self.balance -= size * price * fee
+
+    @try_exc_async
+    async def create_fast_order(self, price, size, side, market, client_id=None):
+        ts_sent = time.time()
+        if coin := self.get_coin(market):
+            if last_tick := reference.last_ticks.get(coin):
+                self.tick_to_trade.append(ts_sent - last_tick)
+        latency = self.get_latency(self.order_latency)
+        await asyncio.sleep(latency)
+        self.stats['orders'] += 1
+        filled, fill_price = 0, 0
+        if random.random() < self.reject_rate:
+            self.stats['rejects'] += 1
+            self.error_info = 'Simulated reject'
+        else:
+            filled, fill_price = self.match(market, side, price, size)
+            if filled and random.random() < self.partial_fill_rate:
+                self.stats['partial_fills'] += 1
+                filled = round(filled * random.uniform(0.1, 0.9), 10)
+        if filled >= size:
+            status = OrderStatus.FULLY_EXECUTED
+        elif filled:
+            status = OrderStatus.PARTIALLY_EXECUTED
+        else:
+            status = OrderStatus.NOT_EXECUTED
+        if filled:
+            self.update_position(market, side, filled, fill_price, self.taker_fee)
+        exchange_order_id = str(uuid.uuid4())
+        resp = {'exchange_name': self.EXCHANGE_NAME,
+                'exchange_order_id': exchange_order_id,
+                'timestamp': ts_sent + latency / 2,
+                'status': status,
+                'size': filled,
+                'price': fill_price,
+                'time_order_sent': ts_sent,
+                'create_order_time': latency / 2}
+        self.order_latencies.append(latency)
+        self.orders[exchange_order_id] = {**resp, 'market': market, 'side': side, 'client_id': client_id}
+        if client_id:
+            self.responses[client_id] = resp
+        return resp
+
+    @try_exc_regular
+    def get_coin(self, market: str):
+        for coin, coin_market in self.markets.items():
+            if coin_market == market:
+                return coin
+
+    @try_exc_async
+    async def process_async_tasks(self):
+        # Maker orders: ['create_order', deal] | ['amend_order', deal] | ['cancel_order', {'market', 'order_id'}]
+        while True:
+            while self.async_tasks:
+                task_type, data = self.async_tasks.pop(0)
+                self.order_loop.create_task(self.process_maker_task(task_type, data))
+            await asyncio.sleep(0.001)
+
+    @try_exc_async
+    async def process_maker_task(self, task_type: str, data: dict):
+        ts_sent = time.time()
+        latency = self.get_latency(self.order_latency)
+        await asyncio.sleep(latency)
+        resp = {'exchange_name': self.EXCHANGE_NAME, 'timestamp': ts_sent + latency / 2, 'size': 0, 'price': 0,
+                'time_order_sent': ts_sent, 'create_order_time': latency / 2}
+        if task_type == 'cancel_order':
+            if self.resting_orders.pop(data['order_id'], None):
+                self.cancel_responses[data['order_id']] = {**resp, 'exchange_order_id': data['order_id'],
+                                                           'status': 'Canceled'}
+            else:
+                # Already filled or canceled: the exchange answers with an error, not silence
+                self.cancel_responses[data['order_id']] = {**resp, 'exchange_order_id': None,
+                                                           'status': OrderStatus.NOT_EXECUTED}
+            return
+        if random.random() < self.reject_rate:
+            self.stats['rejects'] += 1
+            self.responses[data['client_id']] = {**resp, 'exchange_order_id': None,
+                                                 'status': OrderStatus.NOT_EXECUTED}
+            return
+        if task_type == 'amend_order':
+            if not self.resting_orders.pop(data['order_id'], None):
+                # Already filled or canceled: rejected
+                self.stats['rejects'] += 1
+                self.responses[data['client_id']] = {**resp, 'exchange_order_id': None,
+                                                     'status': OrderStatus.NOT_EXECUTED}
+                return
+        exchange_order_id = str(uuid.uuid4())
+        self.resting_orders[exchange_order_id] = {'coin': data['coin'], 'market': data['market'],
+                                                  'side': data['side'], 'price': data['price'],
+                                                  'size': data['size'], 'client_id': data['client_id']}
+        self.responses[data['client_id']] = {**resp, 'exchange_order_id': exchange_order_id,
+                                             'status': OrderStatus.NEW, 'price': data['price']}
+
+    @try_exc_regular
+    def check_resting_orders(self, coin: str, market: str) -> None:
+        ob = self.orderbook[market]
+        for order_id, order in list(self.resting_orders.items()):
+            if order['market'] != market:
+                continue
+            if order['side'] == 'buy' and ob['asks'] and ob['asks'][0][0] <= order['price']:
+                pass
+            elif order['side'] == 'sell' and ob['bids'] and ob['bids'][0][0] >= order['price']:
+                pass
+            else:
+                continue
+            self.resting_orders.pop(order_id)
+            self.stats['maker_fills'] += 1
+            now = time.time()
+            self.update_position(market, order['side'], order['size'], order['price'], self.maker_fee)
+            deal = {'coin': coin, 'side': order['side'], 'size': order['size'], 'price': order['price'],
+                    'type': 'maker', 'order_id': order_id, 'ts_ms': now, 'timestamp': ob['timestamp']}
+            if self.multibot:
+                self.order_loop.create_task(self.multibot.hedge_maker_position(deal))
+
+    @try_exc_regular
+    def cancel_order(self, order_id) -> None:
+        self.resting_orders.pop(order_id, None)
+
+    @try_exc_regular
+    def cancel_all_orders(self) -> None:
+        self.resting_orders = dict()
+
+    @try_exc_regular
+    def get_all_orders(self) -> list:
+        return [{'orderID': x, **y} for x, y in self.resting_orders.items()]
+
+    @try_exc_regular
+    def get_stats(self) -> dict:
+        def percentile(values, part):
+            values = sorted(values)
+            return round(values[min(len(values) - 1, int(len(values) * part))] * 1000, 3) if values else 0
+        elapsed = time.time() - self.time_stats
+        return {**self.stats,
+                'ob_updates_per_sec': round(self.stats['ob_updates'] / elapsed, 1) if elapsed else 0,
+                'tick_to_trade_p50_ms': percentile(self.tick_to_trade, 0.5),
+                'tick_to_trade_p99_ms': percentile(self.tick_to_trade, 0.99),
+                'order_latency_p50_ms': percentile(self.order_latencies, 0.5),
+                'order_latency_p99_ms': percentile(self.order_latencies, 0.99)}
+
+    @try_exc_regular
+    def print_stats(self) -> None:
+        if time.time() - self.time_stats > 60:
+            print(f"SIM {self.EXCHANGE_NAME} STATS: {self.get_stats()}")
+            self.time_stats = time.time()
+            self.stats = {x: 0 for x in self.stats.keys()}
+            self.tick_to_trade = []
+            self.order_latencies = []
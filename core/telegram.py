@@ -3,6 +3,9 @@ from datetime import datetime
 import requests
 from core.ap_class import AP
 import sys
+import time
+import threading
+from collections import deque
 import aiohttp
 import asyncio
 from configparser import ConfigParser
@@ -20,27 +23,136 @@ class TG_Groups:
     Alerts = {'chat_id': _alert_id, 'bot_token': _main_token}
 
 
+class TelegramSender:
+    # Один на процесс. Сообщения из любых потоков/лупов складываются в очередь своего чата, а отправляет их
+    # отдельный поток со своим лупом и одной aiohttp сессией (без TLS хендшейка на каждое сообщение).
+    # На чат не чаще одного запроса в chat_interval (лимит Telegram для групп - 20 сообщений в минуту),
+    # все, что накопилось за это время, склеивается в одно сообщение до max_length символов.
+    # Одинаковые тексты (например, один и тот же traceback) в пределах dedup_window отправляются один раз,
+    # количество повторов дописывается к следующей отправке в этот чат.
+    chat_interval = 3
+    dedup_window = 60
+    max_length = 4000
+    max_pending = 1000
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = dict()  # {(url, chat_id): deque of texts}
+        self.last_sent = dict()  # {(url, chat_id): ts}
+        self.recent = dict()  # {(chat_id, text): ts of first send}
+        self.duplicates = dict()  # {(url, chat_id): amount of suppressed duplicates}
+        self.loop = None
+        self.session = None
+        self.wake = None
+        self.sent = 0
+        self.dropped = 0
+        self.enabled = True
+
+    def start(self) -> None:
+        with self.lock:
+            if self.loop:
+                return
+            self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def run(self) -> None:
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(self.send_loop())
+
+    def put(self, url: str, chat_id: int, text: str) -> None:
+        if not self.enabled:
+            return
+        now = time.time()
+        key = (url, chat_id)
+        with self.lock:
+            if now - self.recent.get((chat_id, text), 0) < self.dedup_window:
+                self.duplicates[key] = self.duplicates.get(key, 0) + 1
+                return
+            self.recent[(chat_id, text)] = now
+            if len(self.recent) > self.max_pending:
+                self.recent = {x: ts for x, ts in self.recent.items() if now - ts < self.dedup_window}
+            chat_queue = self.pending.setdefault(key, deque())
+            if len(chat_queue) >= self.max_pending:
+                chat_queue.popleft()
+                self.dropped += 1
+            chat_queue.append(text)
+        if not self.loop:
+            self.start()
+        self.loop.call_soon_threadsafe(self.wake_up)
+
+    def wake_up(self) -> None:
+        if self.wake:
+            self.wake.set()
+
+    def get_batch(self, key) -> str:
+        # Texts which fit into one message, the rest stays for the next send
+        with self.lock:
+            chat_queue = self.pending.get(key)
+            texts = []
+            length = 0
+            while chat_queue and (not texts or length + len(chat_queue[0]) < self.max_length):
+                text = chat_queue.popleft()[:self.max_length]
+                texts.append(text)
+                length += len(text) + 5
+            if duplicates := self.duplicates.pop(key, 0):
+                texts.append(f'+{duplicates} DUPLICATED MESSAGES SUPPRESSED')
+        return '\n---\n'.join(texts)
+
+    async def send_loop(self):
+        self.wake = asyncio.Event()
+        self.session = aiohttp.ClientSession()
+        while True:
+            self.wake.clear()
+            now = time.time()
+            next_send = None
+            with self.lock:
+                keys = [x for x, texts in self.pending.items() if texts] + \
+                       [x for x in self.duplicates.keys() if not self.pending.get(x)]
+            for key in keys:
+                wait = self.last_sent.get(key, 0) + self.chat_interval - now
+                if wait > 0:
+                    next_send = min(next_send, wait) if next_send else wait
+                    continue
+                if text := self.get_batch(key):
+                    self.last_sent[key] = now
+                    await self.post(key, text)
+                if self.pending.get(key):
+                    next_send = min(next_send, self.chat_interval) if next_send else self.chat_interval
+            try:
+                await asyncio.wait_for(self.wake.wait(), next_send)
+            except asyncio.TimeoutError:
+                pass
+
+    async def post(self, key, text: str) -> None:
+        url, chat_id = key
+        message_data = {"chat_id": chat_id, "parse_mode": "HTML", "text": f"<pre>{text}</pre>"}
+        try:
+            async with self.session.post(url=url, json=message_data) as resp:
+                if resp.status == 429:
+                    # Telegram asks to slow down: postpone the whole chat
+                    retry_after = (await resp.json()).get('parameters', {}).get('retry_after', 5)
+                    self.last_sent[key] = time.time() + retry_after
+                    with self.lock:
+                        self.pending.setdefault(key, deque()).appendleft(text)
+                    return
+            self.sent += 1
+        except Exception:
+            print(f'TELEGRAM MESSAGE NOT SENT:')
+            traceback.print_exc()
+
+
+sender = TelegramSender()
+
+
 class Telegram:
     def __init__(self):
         self.tg_url = "https://api.telegram.org/bot"
         self.env = config['SETTINGS']['ENV']
 
-    @staticmethod
-    async def async_send_message(url, message_data):
-        async with aiohttp.ClientSession() as session:
-            await session.get(url=url, json=message_data)
-            await session.close()
-
     def send_message(self, message: str, tg_group_obj: TG_Groups = None):
         url = self.tg_url + tg_group_obj['bot_token'] + "/sendMessage"
-        message_data = {"chat_id": tg_group_obj['chat_id'], "parse_mode": "HTML",
-                        "text": f"<pre>ENV: {self.env}\n{str(message)}</pre>"}
         try:
-            # r = requests.post(url, json=message_data)
-            # return r.json()
-            #OPTION 1
-            loop = asyncio.get_event_loop()
-            loop.create_task(self.async_send_message(url, message_data))
+            sender.put(url, tg_group_obj['chat_id'], f"ENV: {self.env}\n{str(message)}")
         except Exception as e:
             print(f'TELEGRAM MESSAGE NOT SENT:')
             traceback.print_exc()
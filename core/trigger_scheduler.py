@@ -0,0 +1,88 @@
+import asyncio
+import threading
+import time
+from core.wrappers import try_exc_regular, try_exc_async
+
+
+class CoinTriggerScheduler:
+    # Стоит между клиентами и финдером (ArbitrageFinder/MarketFinder) с той же сигнатурой count_one_coin.
+    # На монету держится не больше одной ожидающей оценки: триггеры, пришедшие пока оценка не началась,
+    # сливаются в нее (по одному на trigger exchange/side), а сама оценка читает стаканы в момент запуска,
+    # т.е. всегда считает по последним стаканам. Монета считается одной задачей за раз (running):
+    # триггеры, пришедшие во время оценки (например, пока идет сделка), та же задача отрабатывает после нее.
+
+    def __init__(self, finder, name='finder'):
+        self.finder = finder
+        self.name = name
+        self.pending = dict()  # {coin: {(trigger_exchange, trigger_side): (trigger_exchange, trigger_side, ...)}}
+        self.running = set()  # coins with an evaluate task
+        self.lock = threading.Lock()
+        self.triggers_received = 0
+        self.triggers_merged = 0
+        self.evaluations = 0
+        self.time_start = time.time()
+
+    def __getattr__(self, item):
+        # Everything except count_one_coin is taken from the wrapped finder
+        return getattr(self.finder, item)
+
+    @try_exc_async
+    async def count_one_coin(self, coin, *args):
+        key = args[:2]
+        with self.lock:
+            self.triggers_received += 1
+            if triggers := self.pending.get(coin):
+                if key in triggers:
+                    self.triggers_merged += 1
+                triggers[key] = args
+                return
+            self.pending[coin] = {key: args}
+            if coin in self.running:
+                return
+            self.running.add(coin)
+        task = asyncio.get_event_loop().create_task(self.evaluate(coin))
+        task.add_done_callback(lambda x: self.on_evaluate_done(coin, x))
+
+    @try_exc_async
+    async def evaluate(self, coin):
+        try:
+            # Yield once so that triggers from the same burst are merged into this evaluation
+            await asyncio.sleep(0)
+            while True:
+                with self.lock:
+                    if not (triggers := self.pending.pop(coin, None)):
+                        self.running.discard(coin)
+                        return
+                for args in triggers.values():
+                    self.evaluations += 1
+                    await self.finder.count_one_coin(coin, *args)
+                self.print_stats()
+        except BaseException:
+            self.release(coin)
+            raise
+
+    @try_exc_regular
+    def on_evaluate_done(self, coin, task) -> None:
+        # A task cancelled before its first step never enters evaluate's try
+        if task.cancelled():
+            self.release(coin)
+
+    @try_exc_regular
+    def release(self, coin) -> None:
+        # Triggers left in pending would only be merged and never evaluated
+        with self.lock:
+            self.running.discard(coin)
+            self.pending.pop(coin, None)
+
+    @try_exc_regular
+    def get_stats(self) -> dict:
+        return {'received': self.triggers_received,
+                'merged': self.triggers_merged,
+                'evaluated': self.evaluations,
+                'pending': len(self.pending)}
+
+    @try_exc_regular
+    def print_stats(self):
+        if time.time() - self.time_start > 120:
+            self.time_start = time.time()
+            print(f"{self.name.upper()} TRIGGERS: {self.get_stats()}")
@@ -1,10 +1,73 @@
+import sys
 import time
+import threading
 import traceback
+from datetime import datetime
 from core.telegram import Telegram, TG_Groups
 
 telegram = Telegram()
 
 
+class ExceptionsAggregator:
+    # Исключения группируются по месту (функция, тип исключения, файл:строка, где оно возникло).
+    # Первое исключение места печатается и уходит в телеграм с полным traceback, повторы в пределах window
+    # только считаются (без форматирования traceback) и отправляются одной сводкой с количеством,
+    # временем первого и последнего появления.
+    window = 60
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sites = dict()  # {site: [count, first seen, last seen, repeats not reported yet]}
+        self.last_flush = time.time()
+
+    def report(self, func_name: str) -> None:
+        exc_type, exc, tb = sys.exc_info()
+        while tb.tb_next:
+            tb = tb.tb_next
+        site = (func_name, exc_type.__name__, tb.tb_frame.f_code.co_filename, tb.tb_lineno)
+        now = time.time()
+        with self.lock:
+            if stats := self.sites.get(site):
+                stats[0] += 1
+                stats[2] = now
+                stats[3] += 1
+                first = False
+            else:
+                self.sites[site] = [1, now, now, 0]
+                first = True
+        if first:
+            formatted_traceback = str(traceback.format_exc())
+            print(formatted_traceback)
+            telegram.send_message(formatted_traceback, TG_Groups.Alerts)
+        if now - self.last_flush > self.window:
+            self.flush(now)
+
+    def flush(self, now: float = None) -> None:
+        # Sends summary of repeated exceptions and forgets sites which were quiet for the whole window
+        now = now or time.time()
+        with self.lock:
+            self.last_flush = now
+            summary = []
+            for site, stats in list(self.sites.items()):
+                if stats[3]:
+                    summary.append((site, stats[:]))
+                    stats[3] = 0
+                elif now - stats[2] > self.window:
+                    self.sites.pop(site)
+        if not summary:
+            return
+        message = 'EXCEPTIONS STORM\n'
+        for (func_name, exc_name, file_name, line), (count, first_seen, last_seen, repeats) in summary:
+            message += f"{func_name} {exc_name} {file_name.split('/')[-1]}:{line}\n"
+            message += f"COUNT: {count} (+{repeats}) FIRST: {datetime.utcfromtimestamp(first_seen)} "
+            message += f"LAST: {datetime.utcfromtimestamp(last_seen)}\n"
+        print(message)
+        telegram.send_message(message, TG_Groups.Alerts)
+
+
+exceptions = ExceptionsAggregator()
+
+
 def timeit(func):
     async def wrapper(*args, **kwargs):
         ts_start = int(time.time() * 1000)
@@ -17,26 +80,47 @@ def timeit(func):
 
 
 def try_exc_regular(func):
+    func_name = func.__qualname__
+
     def wrapper(*args, **kwargs):
         try:
             result = func(*args, **kwargs)
             return result
         except Exception:
-            formatted_traceback = str(traceback.format_exc())
-            print(formatted_traceback)
-            telegram.send_message(formatted_traceback, TG_Groups.Alerts)
+            exceptions.report(func_name)
 
     return wrapper
 
 
 def try_exc_async(func):
+    func_name = func.__qualname__
+
     async def wrapper(*args, **kwargs):
         try:
             result = await func(*args, **kwargs)
             return result
         except Exception:
-            formatted_traceback = str(traceback.format_exc())
-            print(formatted_traceback)
-            telegram.send_message(formatted_traceback, TG_Groups.Alerts)
+            exceptions.report(func_name)
     return wrapper
 
+
+def try_exc_hot(func):
+    # For functions called many times per trigger (finder helpers): no wrapper frame at all.
+    # Exceptions go up to the caller: finders catch them per pair, so a broken book skips only its pair
+    func.hot_path = True
+    return func
+
+
+def loop_exception_handler(loop, context):
+    if exc := context.get('exception'):
+        try:
+            raise exc
+        except Exception:
+            exceptions.report(str(context.get('task', context.get('message'))).split(' coro=<')[-1].split('(')[0])
+    else:
+        loop.default_exception_handler(context)
+
+
+def install_exception_handler(loop) -> None:
+    # Reports exceptions of tasks nobody awaited (hot path coroutines started with create_task)
+    loop.set_exception_handler(loop_exception_handler)
@@ -10,6 +10,7 @@ sudo pip3 install aiohttp & wait
 sudo pip3 install uvloop & wait
 sudo pip3 install pytelegrambotapi & wait
 sudo pip3 install orjson & wait
+sudo pip3 install numpy & wait
 sudo pip3 install bravado & wait
 sudo pip3 install asyncpg & wait
 sudo pip3 install aiopika & wait
@@ -4,21 +4,33 @@ import sys
 import time
 import uuid
 from datetime import datetime
-import math
 
 from market_maker_counter import MarketFinder
 from arbitrage_finder import ArbitrageFinder
 from arbitrage_finder_parse import ArbitrageFinderParse
+from arbitrage_finder_matrix import ArbitrageFinderMatrix
 from clients.core.all_clients import ALL_CLIENTS
 from clients_markets_data import ClientsMarketData
 from core.database import DB
+from core.positions_cache import PositionsCache
+from core.trigger_scheduler import CoinTriggerScheduler
+from core.deal_locks import DealLocks
+from core.balance_ledger import BalanceLedger
+from core.instruments import InstrumentTable
+from core.quote_engine import QuoteEngine
+from core.maker_ladder import MakerLadder
+from core.order_responses import OrderResponses
+from core.market_recorder import MarketRecorder, RecordingFinder
+from core.latency_histograms import LatencyHistograms
+from core.loop_monitor import LoopMonitor
+from core.gc_policy import GCPolicy
 from core.rabbit import Rabbit
-from core.telegram import Telegram, TG_Groups
-from core.wrappers import try_exc_regular, try_exc_async
+from core.sim_client import SimExchangeClient
+from core.telegram import Telegram, TG_Groups, sender
+from core.wrappers import try_exc_regular, try_exc_async, exceptions, install_exception_handler
 import random
 import string
 import os
-import gc
 import uvloop
 from clients.core.enums import ResponseStatus, OrderStatus
 
@@ -44,7 +56,9 @@ class MultiBot:
                  'deal_done_event', 'new_ap_event', 'new_db_record_event', 'ap_count_event', 'open_orders',
                  'mm_exchange', 'requests_in_progress', 'deleted_orders', 'count_ob_level', 'dump_orders', 'min_size',
                  'created_orders', 'deleted_orders', 'market_maker', 'arbitrage', 'arbitrage_processing', 'parser_mode',
-                 'last_unsuccess']
+                 'last_unsuccess', 'positions_cache', 'deal_locks', 'order_responses', 'order_response_timeout',
+                 'market_recorder', 'simulation', 'latency_histograms', 'loop_monitor', 'gc_policy', 'balance_ledger',
+                 'instrument_table', 'quote_engine', 'maker_ladder', 'mm_finder']
 
     def __init__(self):
         self.bot_launch_id = uuid.uuid4()
@@ -71,32 +85,81 @@ class MultiBot:
         self.exchanges = self.setts['EXCHANGES'].split(',')
         self.mm_exchange = self.setts["MM_EXCHANGE"]
         self.parser_mode = True if self.setts['PARSER'] == '1' else False
+        # SIMULATION=1: все биржи - SimExchangeClient, без сети (Telegram, Rabbit, Postgres выключены)
+        self.simulation = True if self.setts.get('SIMULATION', '0') == '1' else False
         self.clients = []
         self.telegram = Telegram()
+        if self.simulation:
+            sender.enabled = False
         for exchange in self.exchanges:
-            client = ALL_CLIENTS[exchange](self, keys=config[exchange], leverage=leverage,
-                                           max_pos_part=self.max_position_part,
-                                           ob_len=self.limit_order_shift + 1)
+            if self.simulation:
+                keys = config[exchange] if config.has_section(exchange) else {}
+                client = SimExchangeClient(self, keys=keys, leverage=leverage, max_pos_part=self.max_position_part,
+                                           ob_len=self.limit_order_shift + 1, exchange_name=exchange)
+            else:
+                client = ALL_CLIENTS[exchange](self, keys=config[exchange], leverage=leverage,
+                                               max_pos_part=self.max_position_part,
+                                               ob_len=self.limit_order_shift + 1)
             self.clients.append(client)
         self.clients_with_names = {}
         for client in self.clients:
             self.clients_with_names.update({client.EXCHANGE_NAME: client})
+        self.order_responses = OrderResponses()
+        self.order_response_timeout = 0.2
+        for client in self.clients:
+            self.order_responses.watch(client)
         self.start_time = datetime.utcnow().timestamp()
-        self.available_balances = {}
         self.positions = {}
+        self.positions_cache = PositionsCache(self.clients_with_names)
+        self.deal_locks = DealLocks()
+        # Available balances move by fills as responses arrive and are reconciled with exchanges in background
+        self.balance_ledger = BalanceLedger(self.clients_with_names, self.deal_locks, self.positions_cache)
+        self.order_responses.add_listener(self.balance_ledger.on_response)
+        self.available_balances = self.balance_ledger.balances
         self.clients_markets_data = ClientsMarketData(self.clients,
                                                       self.setts['INSTANCE_NUM'],
                                                       self.instance_markets_amount)
         self.markets = self.clients_markets_data.get_instance_markets()
+        # Steps, ticks and min sizes by coin and venue for sizing, quoting and min size checks
+        self.instrument_table = InstrumentTable(self.clients_with_names)
         self.markets_data = self.clients_markets_data.get_clients_data()
         self.base_launch_config = self.get_default_launch_config()
         self._loop = asyncio.new_event_loop()
+        install_exception_handler(self._loop)
+        for client in self.clients:
+            install_exception_handler(client.order_loop)
         self.rabbit = Rabbit(self._loop)
+        # Tick-to-trade stages of taker deals by exchange, filled in ap_deal_report
+        self.latency_histograms = LatencyHistograms()
+        if port := self.setts.get('LATENCY_HTTP_PORT'):
+            self.latency_histograms.serve(int(port))
+        # GC runs at safe points between deals, see core/gc_policy.py
+        self.gc_policy = None
+        if self.setts.get('GC_POLICY', '1') == '1':
+            self.gc_policy = GCPolicy(self.is_busy, interval=float(self.setts.get('GC_SAFE_POINT_SEC', 0.5)),
+                                      gen0_threshold=int(self.setts.get('GC_GEN0_THRESHOLD', 50000)))
+        # Loop lag, GC pauses and slow callbacks of our own process, diagnostics: off by default
+        self.loop_monitor = None
+        if self.setts.get('LOOP_MONITOR', '0') == '1':
+            self.loop_monitor = LoopMonitor(self.latency_histograms,
+                                            slow_callback_ms=float(self.setts.get('SLOW_CALLBACK_MS', 20)))
+            self.loop_monitor.watch(self._loop, 'MULTIBOT')
+            for client in self.clients:
+                self.loop_monitor.watch(client.order_loop, client.EXCHANGE_NAME + '_ORDER_LOOP')
+        self.rabbit.enabled = not self.simulation
         self.open_orders = {'COIN-EXCHANGE': ['id', "ORDER_DATA"]}
         self.dump_orders = {'COIN-EXCHANGE': ['id', "ORDER_DATA"]}
+        # Maker requests in flight by market and the latest target waiting for each of them
+        self.quote_engine = QuoteEngine(self, pending_ttl=float(self.setts.get('QUOTE_PENDING_TTL', 1)))
+        self.requests_in_progress = self.quote_engine.in_progress  # read only, written by the engine
+        # MAKER_LADDER_LEVELS > 1: up to N maker orders on each side of a coin instead of one
+        self.maker_ladder = None
+        if self.market_maker and int(self.setts.get('MAKER_LADDER_LEVELS', 1)) > 1:
+            self.maker_ladder = MakerLadder(self.clients_with_names[self.mm_exchange],
+                                            int(self.setts['MAKER_LADDER_LEVELS']), self.min_size)
+        # Blocks finders until init is done. Deals in process are tracked by self.deal_locks
         self.arbitrage_processing = True
         self.run_sub_processes()
-        self.requests_in_progress = dict()
         self.created_orders = set()
         self.deleted_orders = set()
         self.arbitrage_processing = False
@@ -127,189 +190,203 @@ class MultiBot:
     async def main_process(self):
         await self.launch()
         print(f"MULTIBOT LAUNCH DONE")
+        if self.gc_policy and not self.gc_policy.started:
+            # Markets, instruments, clients and balances are loaded: everything alive now lives for the whole run
+            self.gc_policy.start()
+            self._loop.create_task(self.gc_policy.run_safe_points())
+        self._loop.create_task(self.balance_ledger.run_reconcile(float(self.setts.get('BALANCE_RECONCILE_SEC', 25))))
         count = 0
+        self.rabbit.start_drain()
+        # ORDER_UPDATES_BATCH=1 only when the logger service consumes update_orders_batch
+        self._loop.create_task(self.run_order_updates(float(self.setts.get('ORDER_UPDATES_SEC', 0.5)),
+                                                      self.setts.get('ORDER_UPDATES_BATCH', '0') == '1'))
         while True:
             if count == 5:
                 count = 0
-                await self.update_all_av_balances()
-            await self.rabbit.setup_mq()
-            tasks = [self._loop.create_task(self.__check_order_status()),
-                     self._loop.create_task(self.rabbit.send_messages())]
-            await asyncio.gather(*tasks, return_exceptions=True)
+                self.positions_cache.update_all()
+                await self.reload_markets()
+                self.instrument_table.refresh()
+                if file_name := self.setts.get('LATENCY_DUMP_FILE'):
+                    self.latency_histograms.dump(file_name)
+            exceptions.flush()
+            if self.market_recorder:
+                self.market_recorder.flush()
+            if self.loop_monitor:
+                self.loop_monitor.print_stats()
+            self.quote_engine.print_stats()
             await asyncio.sleep(5)
-            await self.rabbit.mq.close()
             count += 1
 
+    @try_exc_regular
+    def is_busy(self):
+        # AP in process or maker order request in flight: no GC at this moment
+        if self.deal_locks.coins or self.quote_engine.hedging:
+            return True
+        return any(self.requests_in_progress.values())
+
     @try_exc_regular
     def unsuccessful_deal_report(self, deal):
         message = 'UNSUCCESSFUL DEAL BITKUB\n'
-        message += '\n'.join([x + ': ' + str(y) for x, y in deal.items() if 'client' not in x])
+        message += '\n'.join([x + ': ' + str(y) for x, y in deal.to_dict().items() if 'client' not in x])
         self.telegram.send_message(message, TG_Groups.MainGroup)
 
     @try_exc_async
     async def bitkub_run_arbitrage(self, deal, precised_sz):
         rand_id = self.id_generator()
-        client_id = f'takerxxx' + deal['coin'] + 'xxx' + rand_id
-        if deal['ex_buy'] == 'BITKUB':
-            buy_price, buy_size = deal['client_buy'].fit_sizes(deal['buy_px'] * 1.003, precised_sz, deal['buy_mrkt'])
+        client_id = f'takerxxx' + deal.coin + 'xxx' + rand_id
+        if deal.ex_buy == 'BITKUB':
+            buy_price, buy_size = deal.client_buy.fit_sizes(deal.buy_px * 1.003, precised_sz, deal.buy_mrkt)
             if [buy_price, buy_size] == self.last_unsuccess:
-                deal['client_buy'].orderbook[deal['buy_mrkt']] = {'asks': [], 'bids': [], 'ts_ms': 0, 'timestamp': 0}
-            deal['client_buy'].order_loop.create_task(deal['client_buy'].create_fast_order(buy_price,
-                                                                                           buy_size,
-                                                                                           'buy',
-                                                                                           deal['buy_mrkt'],
-                                                                                           client_id))
-            for i in range(30):
-                time.sleep(0.1)
-                resp_buy = deal['client_buy'].responses.get(client_id)
-                if resp_buy:
-                    break
+                deal.client_buy.orderbook[deal.buy_mrkt] = {'asks': [], 'bids': [], 'ts_ms': 0, 'timestamp': 0}
+            self.balance_ledger.expect(deal.ex_buy, client_id, deal.buy_mrkt, 'buy')
+            deal.client_buy.order_loop.create_task(deal.client_buy.create_fast_order(buy_price,
+                                                                                     buy_size,
+                                                                                     'buy',
+                                                                                     deal.buy_mrkt,
+                                                                                     client_id))
+            resp_id, resp_buy = await self.order_responses.wait(deal.client_buy, [client_id], 3)
             if not resp_buy:
-                deal['client_buy'].cancel_all_orders()
-                gc.enable()
+                deal.client_buy.cancel_all_orders()
                 self.last_unsuccess = [buy_price, buy_size]
                 self.unsuccessful_deal_report(deal)
                 return
             elif resp_buy['status'] != OrderStatus.FULLY_EXECUTED:
-                deal['client_buy'].order_loop.create_task(
-                    deal['client_buy'].cancel_order(resp_buy['exchange_order_id'])
+                deal.client_buy.order_loop.create_task(
+                    deal.client_buy.cancel_order(resp_buy['exchange_order_id'])
                 )
             if resp_buy['size'] != 0:
-                sell_price, sell_size = deal['client_sell'].fit_sizes(deal['sell_px'] * 0.995,
-                                                                      resp_buy['size'],
-                                                                      deal['sell_mrkt'])
-                deal['client_sell'].order_loop.create_task(deal['client_sell'].create_fast_order(sell_price,
-                                                                                                 sell_size,
-                                                                                                 'sell',
-                                                                                                 deal['sell_mrkt'],
-                                                                                                 client_id))
+                sell_price, sell_size = deal.client_sell.fit_sizes(deal.sell_px * 0.995,
+                                                                   resp_buy['size'],
+                                                                   deal.sell_mrkt)
+                self.balance_ledger.expect(deal.ex_sell, client_id, deal.sell_mrkt, 'sell')
+                deal.client_sell.order_loop.create_task(deal.client_sell.create_fast_order(sell_price,
+                                                                                           sell_size,
+                                                                                           'sell',
+                                                                                           deal.sell_mrkt,
+                                                                                           client_id))
                 ts_send = time.time()
                 await asyncio.sleep(self.deal_pause)
-                gc.enable()
                 self.ap_deal_report(deal, client_id, precised_sz, ts_send)
-                self.arbitrage_processing = False
-                await self.update_all_av_balances()
+                self.positions_cache.update(deal.ex_buy)
+                self.positions_cache.update(deal.ex_sell)
             else:
                 self.last_unsuccess = [buy_price, buy_size]
                 self.unsuccessful_deal_report(deal)
-                gc.enable()
-        elif deal['ex_sell'] == 'BITKUB':
-            sell_price, sell_size = deal['client_sell'].fit_sizes(deal['sell_px'] * 0.997, precised_sz, deal['sell_mrkt'])
+        elif deal.ex_sell == 'BITKUB':
+            sell_price, sell_size = deal.client_sell.fit_sizes(deal.sell_px * 0.997, precised_sz, deal.sell_mrkt)
             if [sell_price, sell_size] == self.last_unsuccess:
-                deal['client_sell'].orderbook[deal['sell_mrkt']] = {'asks': [], 'bids': [], 'ts_ms': 0, 'timestamp': 0}
-            deal['client_sell'].order_loop.create_task(deal['client_sell'].create_fast_order(sell_price,
-                                                                                             sell_size,
-                                                                                             'sell',
-                                                                                             deal['sell_mrkt'],
-                                                                                             client_id))
-            for i in range(30):
-                time.sleep(0.1)
-                resp_sell = deal['client_sell'].responses.get(client_id)
-                if resp_sell:
-                    break
+                deal.client_sell.orderbook[deal.sell_mrkt] = {'asks': [], 'bids': [], 'ts_ms': 0, 'timestamp': 0}
+            self.balance_ledger.expect(deal.ex_sell, client_id, deal.sell_mrkt, 'sell')
+            deal.client_sell.order_loop.create_task(deal.client_sell.create_fast_order(sell_price,
+                                                                                       sell_size,
+                                                                                       'sell',
+                                                                                       deal.sell_mrkt,
+                                                                                       client_id))
+            resp_id, resp_sell = await self.order_responses.wait(deal.client_sell, [client_id], 3)
             if not resp_sell:
-                deal['client_sell'].cancel_all_orders()
-                gc.enable()
+                deal.client_sell.cancel_all_orders()
                 self.last_unsuccess = [sell_price, sell_size]
                 self.unsuccessful_deal_report(deal)
                 return
             elif resp_sell['status'] != OrderStatus.FULLY_EXECUTED:
-                deal['client_sell'].order_loop.create_task(
-                    deal['client_sell'].cancel_order(resp_sell['exchange_order_id'])
+                deal.client_sell.order_loop.create_task(
+                    deal.client_sell.cancel_order(resp_sell['exchange_order_id'])
                 )
             if resp_sell['size'] != 0:
-                buy_price, buy_size = deal['client_buy'].fit_sizes(deal['buy_px'] * 1.005,
-                                                                   resp_sell['size'],
-                                                                   deal['buy_mrkt'])
-                deal['client_buy'].order_loop.create_task(deal['client_buy'].create_fast_order(buy_price,
-                                                                                               buy_size,
-                                                                                               'buy',
-                                                                                               deal['buy_mrkt'],
-                                                                                               client_id))
+                buy_price, buy_size = deal.client_buy.fit_sizes(deal.buy_px * 1.005,
+                                                                resp_sell['size'],
+                                                                deal.buy_mrkt)
+                self.balance_ledger.expect(deal.ex_buy, client_id, deal.buy_mrkt, 'buy')
+                deal.client_buy.order_loop.create_task(deal.client_buy.create_fast_order(buy_price,
+                                                                                         buy_size,
+                                                                                         'buy',
+                                                                                         deal.buy_mrkt,
+                                                                                         client_id))
                 ts_send = time.time()
-                time.sleep(1)
-                gc.enable()
+                await asyncio.sleep(1)
                 self.ap_deal_report(deal, client_id, precised_sz, ts_send)
-                self.arbitrage_processing = False
-                await self.update_all_av_balances()
+                self.positions_cache.update(deal.ex_buy)
+                self.positions_cache.update(deal.ex_sell)
                 await asyncio.sleep(self.deal_pause)
             else:
                 self.last_unsuccess = [sell_price, sell_size]
                 self.unsuccessful_deal_report(deal)
-                gc.enable()
 
     @try_exc_regular
     def check_bitkub_price(self, deal):
-        if deal['ex_buy'] == 'BITKUB':
-            actual_ob = deal['client_buy'].get_orderbook_by_symbol_reg(deal['buy_mrkt'])
-            if actual_ob['asks'][0][0] > deal['buy_px'] * 1.001:
-                print(f"{actual_ob['asks'][0][0]=} {deal['buy_px']=}")
+        if deal.ex_buy == 'BITKUB':
+            actual_ob = deal.client_buy.get_orderbook_by_symbol_reg(deal.buy_mrkt)
+            if actual_ob['asks'][0][0] > deal.buy_px * 1.001:
+                print(f"{actual_ob['asks'][0][0]=} {deal.buy_px=}")
                 return True
-        elif deal['ex_sell'] == 'BITKUB':
-            actual_ob = deal['client_sell'].get_orderbook_by_symbol_reg(deal['sell_mrkt'])
-            if actual_ob['bids'][0][0] < deal['sell_px'] * 0.999:
-                print(f"{actual_ob['bids'][0][0]=} {deal['sell_px']=}")
+        elif deal.ex_sell == 'BITKUB':
+            actual_ob = deal.client_sell.get_orderbook_by_symbol_reg(deal.sell_mrkt)
+            if actual_ob['bids'][0][0] < deal.sell_px * 0.999:
+                print(f"{actual_ob['bids'][0][0]=} {deal.sell_px=}")
                 return True
         return False
 
     @try_exc_async
     async def run_arbitrage(self, deal):
         if self.arbitrage_processing:
-            gc.enable()
             return
-        size = self.if_tradable(deal['ex_buy'], deal['ex_sell'], deal['buy_mrkt'], deal['sell_mrkt'], deal['buy_px'])
+        size = self.deal_locks.acquire(deal.coin, deal.ex_buy, deal.ex_sell,
+                                       lambda: self.if_tradable(deal.ex_buy, deal.ex_sell, deal.buy_mrkt,
+                                                                deal.sell_mrkt, deal.buy_px))
         if not size:
-            # av_bal_buy = self._get_available_balance(deal['ex_buy'], deal['buy_mrkt'], 'buy')
-            # av_bal_sell = self._get_available_balance(deal['ex_sell'], deal['sell_mrkt'], 'sell')
-            # min_size_buy = deal['client_buy'].instruments[deal['buy_mrkt']]['min_size']
-            # min_size_sell = deal['client_sell'].instruments[deal['sell_mrkt']]['min_size']
-            # print(f'{deal["coin"]} deal is not tradable because of balance')
-            # print(f"Buy ex: {deal['ex_buy']} | Sell ex: {deal['ex_sell']}")
-            # print(f"BuyMS:{min_size_buy * deal['buy_px']}|AvBalBuy: {av_bal_buy}")
-            # print(f"SellMS:{min_size_sell * deal['buy_px']}|AvBalSell: {av_bal_sell}")
-            gc.enable()
+            # av_bal_buy = self.balance_ledger.get_available(deal.ex_buy, deal.buy_mrkt, 'buy')
+            # av_bal_sell = self.balance_ledger.get_available(deal.ex_sell, deal.sell_mrkt, 'sell')
+            # min_size_buy = deal.client_buy.instruments[deal.buy_mrkt]['min_size']
+            # min_size_sell = deal.client_sell.instruments[deal.sell_mrkt]['min_size']
+            # print(f'{deal["coin"]} deal is not tradable because of balance or coin is already in process')
+            # print(f"Buy ex: {deal.ex_buy} | Sell ex: {deal.ex_sell}")
+            # print(f"BuyMS:{min_size_buy * deal.buy_px}|AvBalBuy: {av_bal_buy}")
+            # print(f"SellMS:{min_size_sell * deal.buy_px}|AvBalSell: {av_bal_sell}")
             return
-        unprecised_sz = min([size / deal['buy_px'], deal['buy_sz'], deal['sell_sz']])
-        precised_sz = self.precise_size(deal['coin'], unprecised_sz * 0.98)
+        try:
+            await self.execute_arbitrage(deal, size)
+        finally:
+            self.deal_locks.release(deal.coin, deal.ex_buy, deal.ex_sell, size)
+
+    @try_exc_async
+    async def execute_arbitrage(self, deal, size):
+        unprecised_sz = min([size / deal.buy_px, deal.buy_sz, deal.sell_sz])
+        precised_sz = self.precise_size(deal.coin, unprecised_sz * 0.98)
         if precised_sz == 0:
             # print(f'{precised_sz=} deal is not tradable because of balance')
-            gc.enable()
             return
         print(f"ARBITRAGE PROCESSING STARTED:\n{deal=}")
-        # print(f"{self.available_balances[deal['ex_buy']][deal['buy_mrkt']]=}")
-        # print(f"{self.available_balances[deal['ex_sell']][deal['sell_mrkt']]=}")
-        self.arbitrage_processing = True
-        if deal['ex_buy'] == 'BITKUB' or deal['ex_sell'] == 'BITKUB':
+        # print(f"{self.available_balances[deal.ex_buy][deal.buy_mrkt]=}")
+        # print(f"{self.available_balances[deal.ex_sell][deal.sell_mrkt]=}")
+        if deal.ex_buy == 'BITKUB' or deal.ex_sell == 'BITKUB':
             if self.check_bitkub_price(deal):
-                self.arbitrage_processing = False
-                self.telegram.send_message(f"BITKUB PRICE CHANGED FOR {deal['coin']}. SKIPPING AP", TG_Groups.MainGroup)
-                gc.enable()
+                self.telegram.send_message(f"BITKUB PRICE CHANGED FOR {deal.coin}. SKIPPING AP", TG_Groups.MainGroup)
                 return
             # await self.bitkub_run_arbitrage(deal, precised_sz)
-            # self.arbitrage_processing = False
             # return
 
         rand_id = self.id_generator()
-        client_id = f'takerxxx' + deal['coin'] + 'xxx' + rand_id
-        buy_price, buy_size = deal['client_buy'].fit_sizes(deal['buy_px'] * 1.001, precised_sz, deal['buy_mrkt'])
-        deal['client_buy'].order_loop.create_task(deal['client_buy'].create_fast_order(buy_price,
-                                                                                       buy_size,
-                                                                                       'buy',
-                                                                                       deal['buy_mrkt'],
-                                                                                       client_id))
-        # tick_sell = deal['client_sell'].instruments[deal['sell_mrkt']]['tick_size']
-        sell_price, sell_size = deal['client_sell'].fit_sizes(deal['sell_px'] * 0.999, precised_sz, deal['sell_mrkt'])
-        deal['client_sell'].order_loop.create_task(deal['client_sell'].create_fast_order(sell_price,
-                                                                                         sell_size,
-                                                                                         'sell',
-                                                                                         deal['sell_mrkt'],
-                                                                                         client_id))
+        client_id = f'takerxxx' + deal.coin + 'xxx' + rand_id
+        buy_price, buy_size = deal.client_buy.fit_sizes(deal.limit_buy_px * 1.001, precised_sz, deal.buy_mrkt)
+        self.balance_ledger.expect(deal.ex_buy, client_id, deal.buy_mrkt, 'buy')
+        deal.client_buy.order_loop.create_task(deal.client_buy.create_fast_order(buy_price,
+                                                                                 buy_size,
+                                                                                 'buy',
+                                                                                 deal.buy_mrkt,
+                                                                                 client_id))
+        # tick_sell = deal.client_sell.instruments[deal.sell_mrkt]['tick_size']
+        sell_price, sell_size = deal.client_sell.fit_sizes(deal.limit_sell_px * 0.999, precised_sz, deal.sell_mrkt)
+        self.balance_ledger.expect(deal.ex_sell, client_id, deal.sell_mrkt, 'sell')
+        deal.client_sell.order_loop.create_task(deal.client_sell.create_fast_order(sell_price,
+                                                                                   sell_size,
+                                                                                   'sell',
+                                                                                   deal.sell_mrkt,
+                                                                                   client_id))
         ts_send = time.time()
         await asyncio.sleep(self.deal_pause)
-        gc.enable()
         self.ap_deal_report(deal, client_id, precised_sz, ts_send)
-        self.arbitrage_processing = False
-        await self.update_all_av_balances()
+        self.positions_cache.update(deal.ex_buy)
+        self.positions_cache.update(deal.ex_sell)
 
     @try_exc_regular
     def ap_deal_report(self, deal, client_id, precised_sz, ts_send):
@@ -318,56 +395,58 @@ class MultiBot:
         ts_sent_sell_own = 0
         ts_sent_buy_api = 0
         ts_sent_sell_api = 0
-        trigger_side = 'sell' if deal['trigger_ex'] == deal['ex_sell'] else 'buy'
-        count_to_send_ping = ts_send - deal['ts_start_counting']
+        trigger_side = 'sell' if deal.trigger_ex == deal.ex_sell else 'buy'
+        count_to_send_ping = ts_send - deal.ts_start_counting
         if trigger_side == 'sell':
-            trigger_ping = deal['ob_sell_own_ts']
+            trigger_ping = deal.ob_sell_own_ts
             inner_ping = ts_send - trigger_ping
-            fetch_to_count_ping = deal['ts_start_counting'] - trigger_ping
+            fetch_to_count_ping = deal.ts_start_counting - trigger_ping
         else:
-            trigger_ping = deal['ob_buy_own_ts']
+            trigger_ping = deal.ob_buy_own_ts
             inner_ping = ts_send - trigger_ping
-            fetch_to_count_ping = deal['ts_start_counting'] - trigger_ping
-        # if deal['client_buy'].responses.get(client_id):
-        resp_buy = deal['client_buy'].responses.get(client_id)
-        resp_sell = deal['client_sell'].responses.get(client_id)
+            fetch_to_count_ping = deal.ts_start_counting - trigger_ping
+        # if deal.client_buy.responses.get(client_id):
+        resp_buy = deal.client_buy.responses.get(client_id)
+        resp_sell = deal.client_sell.responses.get(client_id)
         if resp_buy:
-            deal['client_buy'].responses.pop(client_id)
+            deal.client_buy.responses.pop(client_id)
             ts_sent_buy_own = resp_buy['time_order_sent']
             ts_sent_buy_api = resp_buy['timestamp']
-        # if deal['client_sell'].responses.get(client_id):
+        # if deal.client_sell.responses.get(client_id):
         if resp_sell:
-            deal['client_sell'].responses.pop(client_id)
+            deal.client_sell.responses.pop(client_id)
             ts_sent_sell_own = resp_sell['time_order_sent']
             ts_sent_sell_api = resp_sell['timestamp']
         if resp_buy and resp_sell and resp_sell['price'] and resp_buy['price']:
-            fees = deal['client_buy'].taker_fee + deal['client_sell'].taker_fee
+            fees = deal.client_buy.taker_fee + deal.client_sell.taker_fee
             real_profit = round((resp_sell['price'] - resp_buy['price']) / resp_buy['price'] - fees, 5)
-        oneway_ping_orderbook_buy = round(deal['ob_buy_api_ts'], 5)
-        oneway_ping_orderbook_sell = round(deal['ob_sell_api_ts'], 5)
+        oneway_ping_orderbook_buy = round(deal.ob_buy_api_ts, 5)
+        oneway_ping_orderbook_sell = round(deal.ob_sell_api_ts, 5)
         oneway_ping_order_buy = round(resp_buy['create_order_time'], 5) if resp_buy else None
         oneway_ping_order_sell = round(resp_sell['create_order_time'], 5) if resp_sell else None
         inner_ping_buy = round(ts_sent_buy_own - trigger_ping, 5)
         inner_ping_sell = round(ts_sent_sell_own - trigger_ping, 5)
-        message = f"TAKER DEAL EXECUTED | {deal['coin']}\n"
-        message += f"DEAL DIRECTION: {deal['direction']}\n"
-        message += f"BUY EXCHANGE: {deal['ex_buy']}\n"
-        message += f"SELL EXCHANGE: {deal['ex_sell']}\n"
-        message += f"TRIGGER EXCHANGE: {deal['trigger_ex']}\n"
-        message += f"TRIGGER TYPE: {deal['trigger_type']}\n"
-        message += f"TARGET BUY PRICE: {deal['buy_px']}\n"
-        message += f"TARGET SELL PRICE: {deal['sell_px']}\n"
+        self.record_deal_latencies(deal, resp_buy, resp_sell, trigger_ping, fetch_to_count_ping,
+                                   count_to_send_ping, inner_ping)
+        message = f"TAKER DEAL EXECUTED | {deal.coin}\n"
+        message += f"DEAL DIRECTION: {deal.direction}\n"
+        message += f"BUY EXCHANGE: {deal.ex_buy}\n"
+        message += f"SELL EXCHANGE: {deal.ex_sell}\n"
+        message += f"TRIGGER EXCHANGE: {deal.trigger_ex}\n"
+        message += f"TRIGGER TYPE: {deal.trigger_type}\n"
+        message += f"TARGET BUY PRICE: {deal.buy_px}\n"
+        message += f"TARGET SELL PRICE: {deal.sell_px}\n"
         message += f"TARGET SIZE: {precised_sz}\n"
-        message += f"TARGET SIZE, USD: {round(precised_sz * deal['buy_px'], 2)}\n"
-        message += f"TARGET PROFIT: {deal['profit']}\n"
-        message += f"LIMIT PROFIT: {deal['target_profit']}\n"
+        message += f"TARGET SIZE, USD: {round(precised_sz * deal.buy_px, 2)}\n"
+        message += f"TARGET PROFIT: {deal.profit}\n"
+        message += f"LIMIT PROFIT: {deal.target_profit}\n"
         message += f"REAL BUY PRICE: {resp_buy['price'] if resp_buy else None}\n"
         message += f"REAL SELL PRICE: {resp_sell['price'] if resp_sell else None}\n"
         message += f"REAL BUY SIZE: {resp_buy['size'] if resp_buy else None}\n"
         message += f"REAL SELL SIZE: {resp_sell['size'] if resp_sell else None}\n"
         message += f"REAL PROFIT: {real_profit}\n"
-        message += f"AGE BUY OB: {round(ts_send - deal['ob_buy_own_ts'], 5)}\n"
-        message += f"AGE SELL OB: {round(ts_send - deal['ob_sell_own_ts'], 5)}\n"
+        message += f"AGE BUY OB: {round(ts_send - deal.ob_buy_own_ts, 5)}\n"
+        message += f"AGE SELL OB: {round(ts_send - deal.ob_sell_own_ts, 5)}\n"
         message += f"PING BUY ORDER: {oneway_ping_order_buy}\n"
         message += f"PING SELL ORDER: {oneway_ping_order_sell}\n"
         message += f"PING BUY OB API: {oneway_ping_orderbook_buy}\n"
@@ -382,9 +461,11 @@ class MultiBot:
         ap_id = uuid.uuid4()
         buy_id = uuid.uuid4()
         sell_id = uuid.uuid4()
-        self.db.save_arbitrage_possibilities(deal, precised_sz, ts_send, ap_id, buy_id, sell_id, inner_ping, self.env)
+        deal_data = deal.to_dict()
+        self.db.save_arbitrage_possibilities(deal_data, precised_sz, ts_send, ap_id, buy_id, sell_id, inner_ping,
+                                             self.env)
         self.db.save_order(order_id=buy_id,
-                           deal=deal,
+                           deal=deal_data,
                            ap_id=ap_id,
                            resp=resp_buy,
                            side='buy',
@@ -395,7 +476,7 @@ class MultiBot:
                            oneway_ping_order=oneway_ping_order_buy,
                            inner_ping=inner_ping_buy)
         self.db.save_order(order_id=sell_id,
-                           deal=deal,
+                           deal=deal_data,
                            ap_id=ap_id,
                            resp=resp_sell,
                            side='sell',
@@ -407,29 +488,54 @@ class MultiBot:
                            inner_ping=inner_ping_sell)
         self.telegram.send_message(message, TG_Groups.MainGroup)
 
+    @try_exc_regular
+    def record_deal_latencies(self, deal, resp_buy, resp_sell, trigger_ping, fetch_to_count_ping,
+                              count_to_send_ping, inner_ping):
+        # Inner stages go to the trigger exchange, order stages - to the exchange of the order
+        histograms = self.latency_histograms
+        histograms.record(deal.trigger_ex, 'fetch_to_count', fetch_to_count_ping)
+        histograms.record(deal.trigger_ex, 'count_to_send', count_to_send_ping)
+        histograms.record(deal.trigger_ex, 'fetch_to_created_tasks', inner_ping)
+        for exchange, resp in [(deal.ex_buy, resp_buy), (deal.ex_sell, resp_sell)]:
+            if resp:
+                histograms.record(exchange, 'fetch_to_sent', resp['time_order_sent'] - trigger_ping)
+                histograms.record(exchange, 'fetch_to_placed', resp['timestamp'] - trigger_ping)
+                histograms.record(exchange, 'order_ping', resp['create_order_time'])
+
     @try_exc_regular
     def run_sub_processes(self):
+        # Before the finders are built: their pair indexes must not include excluded coins
+        self.exclude_markets(self.markets)
         mm_finder = None
         ap_finder = None
         if self.market_maker:
             mm_finder = MarketFinder(self.markets, self.clients_with_names, self)
         if self.arbitrage:
-            ap_finder = ArbitrageFinder(self, self.markets, self.clients_with_names, self.profit_open, self.profit_close)
+            if self.setts.get('MATRIX_FINDER', '0') == '1':
+                ap_finder = ArbitrageFinderMatrix(self, self.markets, self.clients_with_names,
+                                                  self.profit_open, self.profit_close)
+            else:
+                ap_finder = ArbitrageFinder(self, self.markets, self.clients_with_names,
+                                            self.profit_open, self.profit_close)
         if self.parser_mode:
             ap_finder = ArbitrageFinderParse(self.markets, self.clients_with_names, self.profit_open, self.profit_close)
+        self.finder = ap_finder
+        self.mm_finder = mm_finder
+        if self.setts.get('COALESCE_TRIGGERS', '1') == '1':
+            if mm_finder:
+                mm_finder = CoinTriggerScheduler(mm_finder, 'market finder')
+            if ap_finder and not self.parser_mode:
+                ap_finder = CoinTriggerScheduler(ap_finder, 'arbitrage finder')
         # pipes = self.get_pipes()
-        if self.markets.get('PEPE'):
-            self.markets.pop('PEPE')
-        if self.markets.get('PEOPLE'):
-            self.markets.pop('PEOPLE')
-        if self.markets.get('MASK'):
-            self.markets.pop('MASK')
-        if self.markets.get('LUNA'):
-            self.markets.pop('LUNA')
-        if self.markets.get('ZETA'):
-            self.markets.pop('ZETA')
-        if self.markets.get('VELO'):
-            self.markets.pop('VELO')
+        self.market_recorder = None
+        if self.setts.get('RECORD_MARKET_DATA', '0') == '1':
+            # Journal of orderbooks which triggered finders, for core.market_replay
+            self.market_recorder = MarketRecorder(self.setts.get('MARKET_DATA_FILE', 'market_data.bin'))
+            self.market_recorder.write_markets(self.clients_with_names, self.markets)
+            if mm_finder:
+                mm_finder = RecordingFinder(mm_finder, self.market_recorder, self.clients_with_names, True)
+            if ap_finder:
+                ap_finder = RecordingFinder(ap_finder, self.market_recorder, self.clients_with_names)
         for client in self.clients:
             print(f"{client.EXCHANGE_NAME} started to process")
             # client.pipes = pipes
@@ -438,11 +544,42 @@ class MultiBot:
             client.finder = ap_finder
             client.run_updater()
 
+    @staticmethod
+    @try_exc_regular
+    def exclude_markets(markets: dict) -> dict:
+        for coin in ['PEPE', 'PEOPLE', 'MASK', 'LUNA', 'ZETA', 'VELO']:
+            markets.pop(coin, None)
+        return markets
+
+    @try_exc_async
+    async def reload_markets(self):
+        # Periodic check: indexes of finders are rebuilt only when ClientsMarketData gives other markets.
+        # client.get_markets() may go to the exchange's API, so the trading loop doesn't wait for it
+        markets = await self._loop.run_in_executor(None, self.clients_markets_data.reload_markets)
+        markets = self.exclude_markets(markets)
+        if not markets or markets == self.markets:
+            return
+        print(f"MARKETS CHANGED: {len(self.markets)} -> {len(markets)} COINS")
+        self.markets = markets
+        self.markets_data = self.clients_markets_data.clients_data
+        for client in self.clients:
+            client.markets_list = list([x for x in self.markets.keys() if client.markets.get(x)])
+        finder = self.finder
+        while isinstance(finder, (CoinTriggerScheduler, RecordingFinder)):
+            finder = finder.finder
+        if isinstance(finder, (ArbitrageFinder, ArbitrageFinderMatrix)):
+            finder.update_markets(self.markets)
+        if self.mm_finder:
+            self.mm_finder.update_markets(self.markets)
+        self.instrument_table.refresh()
+
     @try_exc_async
     async def check_for_non_legit_orders(self):
         time_start = time.time()
         all_canceled_orders = self.deleted_orders.copy()
         open_orders_set = {x[0] for x in self.open_orders.values()}
+        if self.maker_ladder:
+            open_orders_set.update(self.maker_ladder.get_order_ids())
         all_canceled_orders.update(open_orders_set)
         if non_legit := all_canceled_orders - self.created_orders:
             print(f'CHECKING ORDERS TIME: {time.time() - time_start} sec')
@@ -463,32 +600,23 @@ class MultiBot:
         old_order = self.open_orders.get(market_id)
         mm_client = self.clients_with_names[self.mm_exchange]
         market = mm_client.markets[coin]
-        client_id = old_order[1]['client_id']
-        price, size = mm_client.fit_sizes(deal['price'], deal['size'], market)
-        deal.update({'market': market,
-                     'order_id': order_id,
-                     'client_id': client_id,
-                     'price': price,
-                     'size': size,
-                     'side': old_order[1]['side'],
-                     'old_order_size': old_order[1]['size']})
-        task = ['amend_order', deal]
+        client_id = old_order[1].client_id
+        price, size = mm_client.fit_sizes(deal.price, deal.size, market)
+        deal.market = market
+        deal.order_id = order_id
+        deal.client_id = client_id
+        deal.price = price
+        deal.size = size
+        deal.side = old_order[1].side
+        deal.old_order_size = old_order[1].size
+        task = ['amend_order', deal.to_dict()]
         mm_client.async_tasks.append(task)
-        for i in range(0, 200):
-            if resp := mm_client.responses.get(client_id):
-                if resp['exchange_order_id']:
-                # print(f"AMEND: {old_order[0]} -> {resp['exchange_order_id']}")
-                    self.open_orders.update({market_id: [resp['exchange_order_id'], deal]})
-                    mm_client.responses.pop(client_id)
-                    self.requests_in_progress.update({market_id: False})
-                    return
-            elif resp := mm_client.responses.get(order_id):
-                if resp['exchange_order_id']:
-                    self.open_orders.update({market_id: [resp['exchange_order_id'], deal]})
-                    mm_client.responses.pop(order_id)
-                    self.requests_in_progress.update({market_id: False})
-                    return
-            await asyncio.sleep(0.001)
+        resp_id, resp = await self.order_responses.wait(mm_client, [client_id, order_id], self.order_response_timeout)
+        if resp and resp['exchange_order_id']:
+            # print(f"AMEND: {old_order[0]} -> {resp['exchange_order_id']}")
+            self.open_orders.update({market_id: [resp['exchange_order_id'], deal]})
+            mm_client.responses.pop(resp_id)
+            return
         await self.delete_maker_order(coin, order_id)
         # self.telegram.send_message(f"ALERT! MAKER ORDER WAS NOT AMENDED\n{deal}", TG_Groups.MainGroup)
 
@@ -500,22 +628,80 @@ class MultiBot:
         task = ['cancel_order', {'market': market, 'order_id': order_id}]
         mm_client.async_tasks.append(task)
         market_id = coin + '-' + self.mm_exchange
-        for i in range(0, 200):
-            if mm_client.cancel_responses.get(order_id):
-                # print(f"DELETE: {order_id}")
-                # self.open_orders.pop(market_id, '')
-                self.dump_orders.update({market_id: self.open_orders.pop(market_id, '')})
-                mm_client.cancel_responses.pop(order_id, '')
-                break
-            await asyncio.sleep(0.001)
-        self.requests_in_progress.update({market_id: False})
+        resp_id, resp = await self.order_responses.wait(mm_client, [order_id], self.order_response_timeout, 'cancel')
+        if resp:
+            # print(f"DELETE: {order_id}")
+            # self.open_orders.pop(market_id, '')
+            self.dump_orders.update({market_id: self.open_orders.pop(market_id, '')})
+            mm_client.cancel_responses.pop(order_id, '')
         # print(f"ALERT! MAKER ORDER WASN'T DELETED: {coin + '-' + self.mm_exchange} {order_id}")
 
+    @try_exc_async
+    async def update_maker_ladder(self, ladder, coin):
+        # Diff of the desired ladder against the order index goes out as one batch: all requests are added
+        # to async_tasks at once, then their responses are awaited together
+        mm_client = self.clients_with_names[self.mm_exchange]
+        market = mm_client.markets[coin]
+        requests = []
+        for side, quotes in (('buy', ladder.buy), ('sell', ladder.sell)):
+            for action, key, quote, order_id in self.maker_ladder.get_diff(market, side, quotes):
+                if request := self.get_ladder_request(mm_client, action, key, quote, order_id):
+                    requests.append(request)
+        if requests:
+            mm_client.async_tasks.extend([x[0] for x in requests])
+            await asyncio.gather(*[self.wait_ladder_response(mm_client, *x[1:]) for x in requests])
+
+    @try_exc_regular
+    def get_ladder_request(self, mm_client, action, key, deal, order_id):
+        # [task for the client, key, deal, order_id, response keys]
+        market = key[0]
+        if action != 'Delete':
+            size = self.precise_size(deal.coin, deal.size)
+            price, size = mm_client.fit_sizes(deal.price, size, market)
+            if size <= 0:
+                if not order_id:
+                    return None
+                action = 'Delete'
+        if action == 'Delete':
+            return [['cancel_order', {'market': market, 'order_id': order_id}], key, None, order_id, [order_id]]
+        deal.market = market
+        deal.price = price
+        deal.size = size
+        if order_id:
+            old_order = self.maker_ladder.orders[key][1]
+            deal.client_id = old_order.client_id
+            deal.order_id = order_id
+            deal.old_order_size = old_order.size
+            return [['amend_order', deal.to_dict()], key, deal, order_id, [deal.client_id, order_id]]
+        rand_id = self.id_generator(size=12)
+        deal.client_id = f'makerxxx{mm_client.EXCHANGE_NAME}xxx' + deal.coin + 'xxx' + rand_id
+        return [['create_order', deal.to_dict()], key, deal, None, [deal.client_id]]
+
+    @try_exc_async
+    async def wait_ladder_response(self, mm_client, key, deal, order_id, resp_keys):
+        if not deal:
+            resp_id, resp = await self.order_responses.wait(mm_client, resp_keys, self.order_response_timeout,
+                                                            'cancel')
+            if resp:
+                self.maker_ladder.pop(key)
+                mm_client.cancel_responses.pop(order_id, '')
+            return
+        resp_id, resp = await self.order_responses.wait(mm_client, resp_keys, self.order_response_timeout)
+        if resp and resp['exchange_order_id']:
+            self.maker_ladder.set(key, resp['exchange_order_id'], deal)
+            mm_client.responses.pop(resp_id, '')
+        elif order_id:
+            # Not amended: the level is cancelled and placed again by the next finder's pass
+            await self.delete_ladder_order(mm_client, key, order_id)
+
+    @try_exc_async
+    async def delete_ladder_order(self, mm_client, key, order_id):
+        mm_client.async_tasks.append(['cancel_order', {'market': key[0], 'order_id': order_id}])
+        await self.wait_ladder_response(mm_client, key, None, order_id, [order_id])
+
     @try_exc_regular
     def precise_size(self, coin, size):
-        step_size = max([x.instruments[x.markets[coin]]['step_size'] for x in self.clients if x.markets.get(coin)])
-        perfect_size = math.floor(size / step_size) * step_size
-        return perfect_size
+        return self.instrument_table.precise_size(coin, size)
 
     @staticmethod
     @try_exc_regular
@@ -529,81 +715,94 @@ class MultiBot:
         market = mm_client.markets[coin]
         rand_id = self.id_generator(size=12)
         client_id = f'makerxxx{mm_client.EXCHANGE_NAME}xxx' + coin + 'xxx' + rand_id
-        size = self.precise_size(coin, deal['size'])
-        price, size = mm_client.fit_sizes(deal['price'], size, market)
+        size = self.precise_size(coin, deal.size)
+        price, size = mm_client.fit_sizes(deal.price, size, market)
         if size <= 0:
-            self.requests_in_progress.update({market_id: False})
             return
-        deal.update({'market': market,
-                     'client_id': client_id,
-                     'price': price,
-                     'size': size})
-        task = ['create_order', deal]
+        deal.market = market
+        deal.client_id = client_id
+        deal.price = price
+        deal.size = size
+        task = ['create_order', deal.to_dict()]
         mm_client.async_tasks.append(task)
-        for i in range(0, 200):
-            if resp := mm_client.responses.get(client_id):
-                if resp['exchange_order_id']:
-                # print(f"CREATE: {self.open_orders.get(market_id, [''])[0]} -> {resp['exchange_order_id']}")
-                    self.open_orders.update({market_id: [resp['exchange_order_id'], deal]})
-                    mm_client.responses.pop(client_id)
-                    break
-            await asyncio.sleep(0.001)
-        self.requests_in_progress.update({market_id: False})
+        resp_id, resp = await self.order_responses.wait(mm_client, [client_id], self.order_response_timeout)
+        if resp and resp['exchange_order_id']:
+            # print(f"CREATE: {self.open_orders.get(market_id, [''])[0]} -> {resp['exchange_order_id']}")
+            self.open_orders.update({market_id: [resp['exchange_order_id'], deal]})
+            mm_client.responses.pop(client_id)
         # print(f"NEW MAKER ORDER WAS NOT PLACED\n{deal=}")
 
     @try_exc_async
     async def hedge_maker_position(self, deal):
         mrkt_id = deal['coin'] + '-' + self.mm_exchange
-        self.requests_in_progress.update({mrkt_id: True})
-        deal_mem = self.open_orders.get(mrkt_id)
-        dump_deal_mem = self.dump_orders.get(mrkt_id)
-        side = 'buy' if deal['side'] == 'sell' else 'sell'
-        best_market = None
-        best_price = None
-        top_clnt = None
-        best_ob = None
-        for client in self.clients:
-            if self.mm_exchange == client.EXCHANGE_NAME:
-                continue
-            market = client.markets.get(deal['coin'])
-            if market and client.instruments[market]['min_size'] <= deal['size']:
-                tick = client.instruments[market]['tick_size']
-                ob = client.get_orderbook(market)
-                price = ob['asks'][self.limit_order_shift][0] if side == 'buy' else ob['bids'][self.limit_order_shift][0]
-                if best_price:
+        # No new maker requests of the market until the hedge is sent
+        self.quote_engine.set_hedging(mrkt_id, True)
+        try:
+            if mm_market := self.clients_with_names[self.mm_exchange].markets.get(deal['coin']):
+                self.balance_ledger.add_fill(self.mm_exchange, mm_market, deal['side'], deal['size'], deal['price'])
+            self.positions_cache.update(self.mm_exchange)
+            deal_mem = self.open_orders.get(mrkt_id)
+            if self.maker_ladder:
+                deal_mem = self.maker_ladder.on_fill(deal.get('order_id'), deal['size'])
+            dump_deal_mem = self.dump_orders.get(mrkt_id)
+            side = 'buy' if deal['side'] == 'sell' else 'sell'
+            best_market = None
+            best_price = None
+            top_clnt = None
+            best_ob = None
+            for client in self.clients:
+                if self.mm_exchange == client.EXCHANGE_NAME:
+                    continue
+                market = client.markets.get(deal['coin'])
+                if not market or not (venue := self.instrument_table.get(client.EXCHANGE_NAME, market)):
+                    continue
+                if venue.min_size <= deal['size']:
+                    tick = venue.tick
+                    ob = client.get_orderbook(market)
                     if side == 'buy':
-                        if best_price > price:
-                            best_price = price + 5 * tick
-                            best_market = market
-                            top_clnt = client
-                            best_ob = ob
+                        price = ob['asks'][self.limit_order_shift][0]
                     else:
-                        if best_price < price:
-                            best_price = price - 5 * tick
-                            best_market = market
-                            top_clnt = client
-                            best_ob = ob
-                else:
-                    best_price = price + 5 * tick if side == 'buy' else price - 5 * tick
-                    best_market = market
-                    top_clnt = client
-                    best_ob = ob
-        if top_clnt:
-            rand_id = self.id_generator()
-            client_id = f'mtakerxxx{top_clnt.EXCHANGE_NAME}xxx' + deal['coin'] + 'xxx' + rand_id
-            price, size = top_clnt.fit_sizes(best_price, deal['size'], best_market)
-            top_clnt.order_loop.create_task(top_clnt.create_fast_order(price, size, side, best_market, client_id))
-            loop = asyncio.get_event_loop()
-            loop.create_task(self.get_resp_report_deal(top_clnt, client_id, deal_mem, dump_deal_mem,
-                                                       deal, best_ob, mrkt_id, price))
-        else:
-            print(f"ALERT: {deal} was not hedged")
-        self.requests_in_progress.update({mrkt_id: False})
+                        price = ob['bids'][self.limit_order_shift][0]
+                    if best_price:
+                        if side == 'buy':
+                            if best_price > price:
+                                best_price = price + 5 * tick
+                                best_market = market
+                                top_clnt = client
+                                best_ob = ob
+                        else:
+                            if best_price < price:
+                                best_price = price - 5 * tick
+                                best_market = market
+                                top_clnt = client
+                                best_ob = ob
+                    else:
+                        best_price = price + 5 * tick if side == 'buy' else price - 5 * tick
+                        best_market = market
+                        top_clnt = client
+                        best_ob = ob
+            if top_clnt:
+                rand_id = self.id_generator()
+                client_id = f'mtakerxxx{top_clnt.EXCHANGE_NAME}xxx' + deal['coin'] + 'xxx' + rand_id
+                price, size = top_clnt.fit_sizes(best_price, deal['size'], best_market)
+                self.balance_ledger.expect(top_clnt.EXCHANGE_NAME, client_id, best_market, side)
+                top_clnt.order_loop.create_task(top_clnt.create_fast_order(price, size, side, best_market, client_id))
+                loop = asyncio.get_event_loop()
+                loop.create_task(self.get_resp_report_deal(top_clnt, client_id, deal_mem, dump_deal_mem,
+                                                           deal, best_ob, mrkt_id, price))
+            else:
+                print(f"ALERT: {deal} was not hedged")
+        finally:
+            # An exception must not leave the market unquoted for good
+            self.quote_engine.set_hedging(mrkt_id, False)
 
     @try_exc_async
     async def get_resp_report_deal(self, top_clnt, client_id, deal_mem, dump_deal_mem, deal, best_ob, mrkt_id, limit_px):
-        await asyncio.sleep(0.2)
-        if resp := top_clnt.responses.get(client_id):
+        resp_id, resp = await self.order_responses.wait(top_clnt, [client_id], 0.2)
+        # Late responses update the taker's positions in BalanceLedger.on_response
+        self.positions_cache.update(self.mm_exchange)
+        self.positions_cache.update(top_clnt.EXCHANGE_NAME)
+        if resp:
             if not deal_mem:
                 deal_mem = dump_deal_mem
             print(f"STORED DEAL: {deal_mem}")
@@ -643,9 +842,9 @@ class MultiBot:
     @try_exc_regular
     def sort_deal_response_data(self, maker_deal: dict, taker_deal: dict, taker_ob: dict, deal_mem, limit_px) -> dict:
         results = dict()
-        last_upd = deal_mem[1]['last_update'] if deal_mem else 0
-        target_price = deal_mem[1]['target'] if deal_mem else None
-        direction = deal_mem[1]['direction'] if deal_mem else 'guess'
+        last_upd = deal_mem[1].last_update if deal_mem else 0
+        target_price = deal_mem[1].target if deal_mem else None
+        direction = deal_mem[1].direction if deal_mem else 'guess'
         results.update({'direction': direction,
                         'coin': maker_deal['coin'],
                         'maker fill type': maker_deal['type'],
@@ -687,8 +886,10 @@ class MultiBot:
     @try_exc_async
     async def launch(self):
         self.db = DB(self.rabbit)
-        await self.db.setup_postgres()
+        if not self.simulation:
+            await self.db.setup_postgres()
         await self.update_all_av_balances()
+        self.positions_cache.update_all()
         self.update_all_positions_aggregates()
         print('CLIENTS MARKET DATA:')
         for exchange, exchange_data in self.markets_data.items():
@@ -707,12 +908,7 @@ class MultiBot:
 
     @try_exc_regular
     def check_min_size(self, exchange, market, deal_avail_size_usd, price):
-        min_size_amount = self.clients_with_names[exchange].instruments[market]['min_size']
-        min_size_usd = min_size_amount * price
-        if deal_avail_size_usd < min_size_usd:
-            return False
-        else:
-            return True
+        return self.instrument_table.check_min_size(exchange, market, deal_avail_size_usd, price)
 
     @try_exc_regular
     def get_close_only_exchanges(self):
@@ -722,24 +918,10 @@ class MultiBot:
                 close_only_exchanges.append(exchange)
         return close_only_exchanges
 
-    @try_exc_regular
-    def _get_available_balance(self, exchange, market, direction):
-        if self.available_balances.get(exchange):
-            if self.available_balances[exchange].get(market):
-                avail_size = self.available_balances[exchange][market][direction]
-            else:
-                avail_size = self.available_balances[exchange][direction]
-            return avail_size
-        else:
-            return 'updating'
-
     @try_exc_regular
     def if_tradable(self, buy_ex, sell_ex, buy_mrkt, sell_mrkt, price):
-        avl_sz_buy_usd = self._get_available_balance(buy_ex, buy_mrkt, 'buy')
-        avl_sz_sell_usd = self._get_available_balance(sell_ex, sell_mrkt, 'sell')
-        if avl_sz_buy_usd == 'updating' or avl_sz_sell_usd == 'updating':
-            return False
-        max_deal_size_usd = min(avl_sz_buy_usd, avl_sz_sell_usd, self.max_order_size_usd)
+        max_deal_size_usd = min(self.balance_ledger.get_max_tradable_usd(buy_ex, buy_mrkt, sell_ex, sell_mrkt),
+                                self.max_order_size_usd)
         if max_deal_size_usd < self.min_size:
             return False
         if not self.check_min_size(buy_ex, buy_mrkt, max_deal_size_usd, price):
@@ -756,9 +938,8 @@ class MultiBot:
 
     @try_exc_async
     async def update_all_av_balances(self):
-        for exchange, client in self.clients_with_names.items():
-            self.available_balances.update({exchange: client.get_available_balance()})
-            # print(f"UPDATED {exchange} avl balances: {client.get_available_balance()}")
+        # Full refresh from exchanges. After deals balances are updated by fills, see core/balance_ledger.py
+        self.balance_ledger.reconcile_all(force=True)
 
     @try_exc_regular
     def update_all_positions_aggregates(self):
@@ -777,15 +958,25 @@ class MultiBot:
                             'abs_pos': int(round(abs_pos)), 'markets': markets, 'position_details': details}})
 
     @try_exc_async
-    async def __check_order_status(self):
+    async def run_order_updates(self, interval: float, batched: bool):
         # Эта функция инициирует обновление данных по ордеру в базе,
-        # когда от биржи в клиенте появляется обновление после создания ордера
-        for client in self.clients:
-            orders = client.orders.copy()
+        # когда от биржи в клиенте появляется обновление после создания ордера.
+        # Обновления забираются из клиентов по мере появления и уходят в базу по одному (UPDATE_ORDERS)
+        # или пачками (Rabbit.add_batch_row в UPDATE_ORDERS_BATCH)
+        while True:
+            self.drain_order_updates(batched)
+            await asyncio.sleep(interval)
 
-            for order_id, message in orders.items():
-                self.rabbit.add_task_to_queue(message, "UPDATE_ORDERS")
-                client.orders.pop(order_id)
+    @try_exc_regular
+    def drain_order_updates(self, batched: bool) -> None:
+        for client in self.clients:
+            # Pop by key without a copy: clients keep writing from their threads
+            for order_id in list(client.orders):
+                if message := client.orders.pop(order_id, None):
+                    if batched:
+                        self.rabbit.add_batch_row(message, "UPDATE_ORDERS_BATCH")
+                    else:
+                        self.rabbit.add_task_to_queue(message, "UPDATE_ORDERS")
 
 
 if __name__ == '__main__':